@@ -0,0 +1,216 @@
+"""Benchmarks of `lookout.core.bytes_to_unicode_converter.BytesToUnicodeConverter`."""
+import argparse
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, Tuple
+
+import bblfsh
+from lookout.sdk.service_data_pb2 import File
+
+from lookout.core.bytes_to_unicode_converter import BytesToUnicodeConverter
+from lookout.core.uast import iter_positions
+
+
+def legacy_bytes_to_str_offset_mapping(content: bytes) -> Dict[int, int]:
+    """Build the byte to unicode offset mapping the way it was done before the NumPy array."""
+    byte_to_str_offset = {0: 0}
+    byte_len_before = 0
+    content_str = content.decode(errors="replace")
+    for i, char in enumerate(content_str):
+        if char != "\ufffd":
+            byte_len_before += len(char.encode())
+        else:
+            byte_len_before += 1
+        byte_to_str_offset[byte_len_before] = i + 1
+    byte_to_str_offset[len(content)] = len(content_str)
+    return byte_to_str_offset
+
+
+def generate_content(size: int, non_ascii_ratio: float, seed: int = 7,
+                     encoding: str = "utf-8") -> bytes:
+    """
+    Generate a pseudo-source code file.
+
+    :param size: Approximate size of the result in bytes.
+    :param non_ascii_ratio: Fraction of the characters which are not ASCII.
+    :param seed: Random generator seed.
+    :param encoding: Encoding of the result. The non-ASCII characters are restricted to \
+                     Latin-1 for "latin-1", which makes the content invalid UTF-8.
+    :return: Encoded content.
+    """
+    rnd = random.Random(seed)
+    ascii_chars = "abcdefghijklmnopqrstuvwxyz_(){};= \n"
+    other_chars = "éèàüßπλжщ€✓😀" if encoding != "latin-1" else "éèàüßñç"
+    chars = []
+    written = 0
+    while written < size:
+        if rnd.random() < non_ascii_ratio:
+            char = rnd.choice(other_chars)
+        else:
+            char = rnd.choice(ascii_chars)
+        chars.append(char)
+        written += len(char.encode(encoding))
+    return "".join(chars).encode(encoding)
+
+
+def legacy_convert_uast(converter: BytesToUnicodeConverter, uast: bblfsh.Node) -> bblfsh.Node:
+    """Convert the UAST positions one by one the way it was done before the batch mode."""
+    uast = bblfsh.Node.FromString(uast.SerializeToString())
+    for position in iter_positions(uast):
+        position.CopyFrom(converter._convert_position(position))
+    return uast
+
+
+def generate_uast(content: bytes) -> bblfsh.Node:
+    """
+    Build a synthetic UAST for the content: one node per line and one node per token.
+
+    Tokens are separated by spaces so that the positions never split a multibyte character.
+    """
+    line_nodes = []
+    offset = 0
+    for line_num, line in enumerate(content.splitlines(keepends=True), start=1):
+        line_node = bblfsh.Node(
+            start_position=bblfsh.Position(offset=offset, line=line_num, col=1),
+            end_position=bblfsh.Position(offset=offset + len(line), line=line_num,
+                                         col=len(line) + 1))
+        token_nodes = []
+        col = 0
+        for token in line.split(b" "):
+            if token.strip():
+                token_nodes.append(bblfsh.Node(
+                    start_position=bblfsh.Position(
+                        offset=offset + col, line=line_num, col=col + 1),
+                    end_position=bblfsh.Position(
+                        offset=offset + col + len(token), line=line_num,
+                        col=col + len(token) + 1)))
+            col += len(token) + 1
+        line_node.children.extend(token_nodes)
+        line_nodes.append(line_node)
+        offset += len(line)
+    root = bblfsh.Node(start_position=bblfsh.Position(offset=0, line=1, col=1),
+                       end_position=bblfsh.Position(offset=len(content), line=len(line_nodes),
+                                                    col=1))
+    root.children.extend(line_nodes)
+    return root
+
+
+def measure(func: Callable, *args, repeats: int = 1) -> Tuple[float, int]:
+    """
+    Run the function and measure the elapsed time and the allocated memory.
+
+    Time and memory are measured in separate runs because `tracemalloc` slows down allocations.
+
+    :return: The best elapsed seconds and the peak memory in bytes reported by `tracemalloc`.
+    """
+    elapsed = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = min(elapsed, time.perf_counter() - start)
+    tracemalloc.start()
+    result = func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return elapsed, peak
+
+
+def benchmark_offset_mapping(size: int, repeats: int):
+    """Compare the dict-based and the array-based byte to unicode offset mappings."""
+    print("offset mapping, %d bytes" % size)
+    print("%-10s %-8s %-8s %12s %14s" % (
+        "non-ascii", "encoding", "impl", "time, ms", "peak mem, MB"))
+    for ratio, encoding in ((0, "utf-8"), (0.01, "utf-8"), (0.3, "utf-8"),
+                            (0.01, "latin-1"), (0.3, "latin-1")):
+        content = generate_content(size, ratio, encoding=encoding)
+        for name, func in (
+                ("dict", legacy_bytes_to_str_offset_mapping),
+                ("numpy", BytesToUnicodeConverter._build_bytes_to_str_offset_mapping)):
+            elapsed, peak = measure(func, content, repeats=repeats)
+            print("%-10s %-8s %-8s %12.1f %14.1f" % (
+                ratio, encoding, name, elapsed * 1000, peak / (1 << 20)))
+
+
+def benchmark_convert_uast(size: int, repeats: int):
+    """Compare the per-position and the batch UAST conversions."""
+    content = generate_content(size, 0.05)
+    uast = generate_uast(content)
+    converter = BytesToUnicodeConverter(content)
+    print("UAST conversion, %d bytes, %d lines, %d nodes" % (
+        size, len(converter._lines), sum(len(n.children) + 1 for n in uast.children) + 1))
+    print("%-8s %12s" % ("impl", "time, ms"))
+    for name, func in (("per-node", legacy_convert_uast),
+                       ("batch", BytesToUnicodeConverter.convert_uast)):
+        elapsed, _ = measure(func, converter, uast, repeats=repeats)
+        print("%-8s %12.1f" % (name, elapsed * 1000))
+
+
+def benchmark_convert_uast_inplace(size: int, repeats: int):
+    """Compare the copying and the in-place UAST conversions."""
+    content = generate_content(size, 0.05)
+    uast = generate_uast(content)
+    converter = BytesToUnicodeConverter(content)
+    print("UAST conversion with and without the copy, %d bytes, serialized UAST %d bytes" % (
+        size, len(uast.SerializeToString())))
+    print("%-8s %12s %14s" % ("impl", "time, ms", "peak mem, MB"))
+    for inplace in (False, True):
+        elapsed, peak = float("inf"), 0
+        for _ in range(repeats):
+            target = bblfsh.Node.FromString(uast.SerializeToString())
+            start = time.perf_counter()
+            converter.convert_uast(target, inplace=inplace)
+            elapsed = min(elapsed, time.perf_counter() - start)
+        target = bblfsh.Node.FromString(uast.SerializeToString())
+        tracemalloc.start()
+        result = converter.convert_uast(target, inplace=inplace)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del result
+        print("%-8s %12.1f %14.1f" % ("inplace" if inplace else "copy", elapsed * 1000,
+                                      peak / (1 << 20)))
+
+
+def benchmark_lazy(size: int, repeats: int, n_files: int = 50, accessed: float = 0.1):
+    """Compare the eager and the lazy file conversions when only a part of UASTs is used."""
+    files = []
+    for i in range(n_files):
+        content = generate_content(size // n_files, 0.05, seed=i)
+        files.append(File(content=content, uast=generate_uast(content), path=str(i)))
+    n_accessed = int(n_files * accessed)
+    print("file conversion, %d files, %d UASTs accessed" % (n_files, n_accessed))
+    print("%-8s %12s" % ("impl", "time, ms"))
+
+    def convert(lazy: bool):
+        for i, file in enumerate(files):
+            unicode_file = BytesToUnicodeConverter.convert_file(file, lazy=lazy)
+            if i < n_accessed:
+                unicode_file.uast
+
+    for lazy in (False, True):
+        elapsed, _ = measure(convert, lazy, repeats=repeats)
+        print("%-8s %12.1f" % ("lazy" if lazy else "eager", elapsed * 1000))
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=1 << 20, help="Input size in bytes.")
+    parser.add_argument("--uast-size", type=int, default=400 * 1000,
+                        help="Input size in bytes for the UAST benchmarks. The default "
+                             "corresponds to more than 10k lines.")
+    parser.add_argument("--repeats", type=int, default=5, help="Number of runs to take the best.")
+    args = parser.parse_args()
+    benchmark_offset_mapping(args.size, args.repeats)
+    print()
+    benchmark_convert_uast(args.uast_size, args.repeats)
+    print()
+    benchmark_convert_uast_inplace(args.uast_size, args.repeats)
+    print()
+    benchmark_lazy(args.uast_size, args.repeats)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
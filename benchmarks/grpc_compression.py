@@ -0,0 +1,161 @@
+"""Benchmarks of the gRPC compression and flow control options of `DataService`."""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import socket
+import sys
+import threading
+import time
+from typing import List, Tuple
+
+from bytes_to_unicode_converter import generate_content, generate_uast
+import grpc
+
+from lookout.core.analyzer import ReferencePointer
+from lookout.core.api.service_data_pb2 import File
+from lookout.core.api.service_data_pb2_grpc import add_DataServicer_to_server, DataServicer
+from lookout.core.data_requests import DataService, request_files
+from lookout.core.grpc_options import COMPRESSION_ALGORITHMS, make_grpc_options
+
+
+class StandInDataServicer(DataServicer):
+    """Local data server which returns the same synthetic files for every revision."""
+
+    def __init__(self, files: List[File]):
+        """
+        Initialize a new instance of `StandInDataServicer`.
+
+        :param files: Files to return from `GetFiles`.
+        """
+        self.files = files
+
+    def GetFiles(self, request, context):  # noqa: N802
+        """Stream all the files."""
+        yield from self.files
+
+
+class CountingProxy:
+    """TCP proxy which counts the bytes sent from the server to the client."""
+
+    def __init__(self, target_port: int):
+        """
+        Initialize a new instance of `CountingProxy`.
+
+        :param target_port: Port of the proxied server on localhost.
+        """
+        self.target_port = target_port
+        self.received = 0
+        self._lock = threading.Lock()
+        self._listener = socket.socket()
+        self._listener.bind(("localhost", 0))
+        self._listener.listen(16)
+        self.port = self._listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._listener.accept()
+            except OSError:
+                return
+            server = socket.create_connection(("localhost", self.target_port))
+            threading.Thread(target=self._pump, args=(client, server, False), daemon=True).start()
+            threading.Thread(target=self._pump, args=(server, client, True), daemon=True).start()
+
+    def _pump(self, src: socket.socket, dst: socket.socket, count: bool):
+        try:
+            while True:
+                data = src.recv(1 << 16)
+                if not data:
+                    break
+                if count:
+                    with self._lock:
+                        self.received += len(data)
+                dst.sendall(data)
+        except OSError:
+            pass
+        finally:
+            for sock in (src, dst):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def close(self):
+        """Stop accepting the connections."""
+        self._listener.close()
+
+
+def generate_files(n_files: int, size: int, uast: bool) -> List[File]:
+    """Generate the files with contents and optionally UASTs of the given total size in bytes."""
+    files = []
+    for i in range(n_files):
+        content = generate_content(size // n_files, 0.01, seed=i)
+        file = File(content=content, path="%d.js" % i, language="javascript")
+        if uast:
+            file.uast.CopyFrom(generate_uast(content))
+        files.append(file)
+    return files
+
+
+def fetch(compression: str, window_size: int, files: List[File], repeats: int,
+          ) -> Tuple[float, float, int]:
+    """
+    Request the files from a stand-in server through `DataService` with the given options.
+
+    :return: The best elapsed seconds, the corresponding CPU seconds of the whole process \
+             (both the server and the client) and the number of bytes received by the client \
+             per request.
+    """
+    options = make_grpc_options(compression=compression, window_size=window_size)
+    server = grpc.server(ThreadPoolExecutor(max_workers=1), options=options)
+    add_DataServicer_to_server(StandInDataServicer(files), server)
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    proxy = CountingProxy(port)
+    data_service = DataService("localhost:%d" % proxy.port, channel_options=options)
+    ptr = ReferencePointer("repo", "ref", "1" * 40)
+    best = (float("inf"), 0.0)
+    try:
+        for _ in range(repeats):
+            start, start_cpu = time.perf_counter(), time.process_time()
+            n_files = sum(1 for _ in request_files(
+                data_service.get_data(), ptr, contents=True, uast=files[0].HasField("uast"),
+                unicode=False))
+            elapsed = time.perf_counter() - start
+            assert n_files == len(files)
+            if elapsed < best[0]:
+                best = elapsed, time.process_time() - start_cpu
+    finally:
+        data_service.shutdown()
+        proxy.close()
+        server.stop(None)
+    return best[0], best[1], proxy.received // repeats
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=200, help="Number of files to transfer.")
+    parser.add_argument("--size", type=int, default=20 << 20,
+                        help="Total size of the file contents in bytes.")
+    parser.add_argument("--window-sizes", type=int, nargs="+", default=[0, 16 << 20],
+                        help="HTTP/2 flow control window sizes in bytes; 0 means automatic.")
+    parser.add_argument("--uast", action="store_true",
+                        help="Transfer the UASTs. Their decoding takes most of the time.")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of runs to take the best.")
+    args = parser.parse_args()
+    files = generate_files(args.files, args.size, args.uast)
+    message_bytes = sum(f.ByteSize() for f in files)
+    print("GetFiles, %d files, %.1f MB of messages" % (len(files), message_bytes / (1 << 20)))
+    print("%-12s %-10s %12s %12s %14s %8s" % (
+        "compression", "window", "time, ms", "cpu, ms", "received, MB", "ratio"))
+    for compression in COMPRESSION_ALGORITHMS:
+        for window_size in args.window_sizes:
+            elapsed, cpu, received = fetch(compression, window_size, files, args.repeats)
+            print("%-12s %-10s %12.1f %12.1f %14.1f %8.2f" % (
+                compression, window_size or "auto", elapsed * 1000, cpu * 1000,
+                received / (1 << 20), message_bytes / received))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""Benchmarks of the UAST traversals in `lookout.core.uast`."""
+import argparse
+import sys
+import time
+from typing import Callable, Iterator
+
+import bblfsh
+
+from lookout.core.uast import iter_bfs, iter_positions, iter_preorder
+
+
+def legacy_traverse_uast(uast: bblfsh.Node) -> Iterator[bblfsh.Node]:
+    """Traverse the UAST the way `BytesToUnicodeConverter` did before, with `list.pop(0)`."""
+    stack = [uast]
+    while stack:
+        node = stack.pop(0)
+        stack.extend(node.children)
+        yield node
+
+
+def generate_tree(size: int, fanout: int) -> bblfsh.Node:
+    """
+    Build a synthetic UAST level by level.
+
+    :param size: Number of nodes.
+    :param fanout: Number of children of each internal node.
+    :return: UAST root node.
+    """
+    root = bblfsh.Node(start_position=bblfsh.Position(offset=0, line=1, col=1))
+    frontier = [root]
+    count = 1
+    while count < size:
+        next_frontier = []
+        for parent in frontier:
+            for _ in range(min(fanout, size - count)):
+                child = parent.children.add()
+                child.start_position.offset = count
+                child.start_position.line = count
+                child.start_position.col = 1
+                child.end_position.offset = count + 1
+                child.end_position.line = count
+                child.end_position.col = 2
+                next_frontier.append(child)
+                count += 1
+        frontier = next_frontier
+    return root
+
+
+def measure(func: Callable[[bblfsh.Node], Iterator], uast: bblfsh.Node, repeats: int) -> float:
+    """Exhaust the iterator and return the best elapsed seconds."""
+    elapsed = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in func(uast):
+            pass
+        elapsed = min(elapsed, time.perf_counter() - start)
+    return elapsed
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=1000 * 1000, help="Number of nodes.")
+    parser.add_argument("--legacy-size", type=int, default=100 * 1000,
+                        help="Number of nodes for the quadratic legacy traversal.")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of runs to take the best.")
+    args = parser.parse_args()
+    print("%-8s %-10s %10s %12s" % ("fanout", "impl", "nodes", "time, ms"))
+    for fanout in (2, 8, 1000):
+        trees = {size: generate_tree(size, fanout) for size in (args.legacy_size, args.size)}
+        for size, name, func in (
+                (args.legacy_size, "legacy", legacy_traverse_uast),
+                (args.legacy_size, "bfs", iter_bfs),
+                (args.size, "bfs", iter_bfs),
+                (args.size, "preorder", iter_preorder),
+                (args.size, "positions", iter_positions)):
+            uast = trees[size]
+            elapsed = measure(func, uast, args.repeats)
+            print("%-8d %-10s %10d %12.1f" % (fanout, name, size, elapsed * 1000))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -145,12 +145,28 @@ class Analyzer:
     not match, a new model is trained.
     `model_type` points to the specific derivative of AnalyzerModel - type of the model used
     in analyze() and generated in train().
+    `bblfsh_drivers` lists the required Babelfish driver versions as setup.py-like version
+    specifiers, e.g. "javascript>=1.3.0". They are checked at startup if enabled.
+    `languages`, `include_pattern` and `max_file_size` restrict the files which are requested
+    by the `lookout.core.data_requests` decorators: the names of the supported languages
+    (empty means all), the regular expression which the paths must match and the maximum size
+    of the raw file contents in bytes (0 means unlimited).
+    `content_changes_only` drops the changes whose base and head have the same content and UAST,
+    e.g. renames and mode changes.
+    `untrained_fallback` is the analyzer with `DummyAnalyzerModel` which reviews instead while
+    the model is trained in the background, see `AnalyzerManager`. None means no comments.
     """
 
     version = None  # type: int
     model_type = None  # type: Type[AnalyzerModel]
     name = None  # type: str
     vendor = None  # type: str
+    bblfsh_drivers = ()  # type: Iterable[str]
+    languages = ()  # type: Iterable[str]
+    include_pattern = None  # type: Optional[str]
+    max_file_size = 0  # type: int
+    content_changes_only = False  # type: bool
+    untrained_fallback = None  # type: Optional[Type[Analyzer]]
 
     def __init__(self, model: AnalyzerModel, url: str, config: Mapping[str, Any]):
         """
@@ -204,6 +220,36 @@ class Analyzer:
         """
         raise NotImplementedError
 
+    @classmethod
+    def update(cls, model: AnalyzerModel, ptr_from: ReferencePointer, ptr_to: ReferencePointer,
+               config: Mapping[str, Any], data_service: "lookout.core.data_requests.DataService",
+               **data) -> AnalyzerModel:
+        """
+        Generate a new model by updating the existing one with the changes since it was trained.
+
+        Implementing this method is optional. If it is implemented, it is called instead of \
+        `train()` on Push events when the number of changed files is small enough.
+
+        :param model: Previously trained model. It is never None.
+        :param ptr_from: Git repository state pointer of the model, that is, `model.ptr`.
+        :param ptr_to: Git repository state pointer to update the model to.
+        :param config: Configuration of the training of unspecified structure.
+        :param data_service: The channel to the data service in Lookout server to query for \
+                             UASTs, file contents, etc.
+        :param data: Extra data passed into the method. Used by the decorators to simplify \
+                     the data retrieval.
+        :return: Instance of `AnalyzerModel` (`model_type`, to be precise) with `ptr` set to \
+                 `ptr_to`.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def supports_update(cls) -> bool:
+        """
+        Return the value indicating whether `update()` is implemented.
+        """
+        return getattr(cls.update, "__func__", None) is not Analyzer.update.__func__
+
     @classmethod
     def construct_model(cls, ptr: ReferencePointer) -> AnalyzerModel:
         """
@@ -0,0 +1,374 @@
+"""asyncio counterparts of `lookout.core.data_requests` built on `grpc.aio`."""
+import asyncio
+import functools
+import logging
+import os
+from typing import Any, AsyncIterator, Callable, Iterable, Optional, Sequence, Tuple
+
+import bblfsh
+import grpc
+import grpc.aio
+
+from lookout.core.analyzer import Analyzer, AnalyzerModel, ReferencePointer
+from lookout.core.api.service_analyzer_pb2 import Comment
+from lookout.core.api.service_data_pb2 import Change, File
+from lookout.core.api.service_data_pb2_grpc import DataStub
+from lookout.core.bytes_to_unicode_converter import BytesToUnicodeConverter, UnicodeFileCache
+from lookout.core.data_requests import _unicode_converter, make_change_filter, \
+    make_changes_request, make_file_filter, make_files_request, request_filters
+from lookout.core.grpc_options import make_grpc_options
+from lookout.core.ports import Type
+
+
+class AsyncDataService:
+    """
+    Retrieves UASTs/files from the Lookout server without blocking the event loop.
+
+    All the coroutines which run on the same event loop share a single channel, so the number \
+    of outstanding requests is not limited by the number of threads.
+    """
+
+    _log = logging.getLogger("AsyncDataService")
+
+    def __init__(self, address: str, unicode_cache_size: int = 0,
+                 channel_options: Optional[Sequence[Tuple[str, Any]]] = None):
+        """
+        Initialize a new instance of `AsyncDataService`. The channels are opened on demand.
+
+        :param address: GRPC endpoint to use.
+        :param unicode_cache_size: Maximum memory size of the cache of the files converted to \
+                                   Unicode (in bytes). 0 disables the cache.
+        :param channel_options: Additional gRPC channel options, e.g. the compression, see \
+                                `lookout.core.grpc_options.make_grpc_options()`.
+        """
+        self._address = address
+        self._channel_options = list(dict(make_grpc_options() + list(channel_options or []))
+                                     .items())
+        self._channels = {}
+        self.unicode_cache = UnicodeFileCache(unicode_cache_size) \
+            if unicode_cache_size > 0 else None
+
+    def __str__(self):
+        """Summarize the AsyncDataService instance as a string."""
+        return "AsyncDataService(%s)" % self._address
+
+    def get_data(self) -> DataStub:
+        """
+        Return a `DataStub` for the current event loop.
+        """
+        return self._get_stubs()[1]
+
+    def get_bblfsh(self) -> bblfsh.aliases.ProtocolServiceStub:
+        """
+        Return a Babelfish `ProtocolServiceStub` for the current event loop.
+        """
+        return self._get_stubs()[2]
+
+    async def close_channel(self):
+        """
+        Close the channel of the current event loop and free all the associated resources.
+        """
+        stubs = self._channels.pop(asyncio.get_event_loop(), None)
+        if stubs is not None:
+            await stubs[0].close()
+            self._log.info("Disposed %s", stubs[0])
+
+    def shutdown(self):
+        """
+        Close all the open network connections. Must not be called from a running event loop.
+        """
+        self._log.info("Shutting down")
+        for loop, stubs in self._channels.items():
+            if not loop.is_closed() and not loop.is_running():
+                loop.run_until_complete(stubs[0].close())
+        self._channels.clear()
+
+    def _get_stubs(self) -> Tuple[grpc.aio.Channel, DataStub,
+                                  bblfsh.aliases.ProtocolServiceStub]:
+        loop = asyncio.get_event_loop()
+        stubs = self._channels.get(loop)
+        if stubs is None:
+            channel = grpc.aio.insecure_channel(self._address, options=self._channel_options)
+            self._channels[loop] = stubs = (
+                channel, DataStub(channel), bblfsh.aliases.ProtocolServiceStub(channel))
+            self._log.info("Opened %s", channel)
+        return stubs
+
+
+class _AsyncMap:
+    def __init__(self, func: Callable, stream):
+        self._func = func
+        self._stream = stream
+        self._iterator = stream.__aiter__()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return self._func(await self._iterator.__anext__())
+
+    def cancel(self):
+        return self._stream.cancel()
+
+
+class _AsyncFilter(_AsyncMap):
+    async def __anext__(self):
+        while True:
+            item = await self._iterator.__anext__()
+            if self._func(item):
+                return item
+
+
+def request_changes(stub: DataStub, ptr_from: ReferencePointer, ptr_to: ReferencePointer,
+                    contents: bool, uast: bool, unicode: bool, lazy: bool = False,
+                    unicode_cache: Optional[UnicodeFileCache] = None,
+                    languages: Iterable[str] = (), include_pattern: Optional[str] = None,
+                    max_file_size: int = 0, skip_identical: bool = False,
+                    ) -> AsyncIterator[Change]:
+    """
+    Invoke GRPC API and get the changes asynchronously.
+
+    :param stub: `DataStub` returned by `AsyncDataService.get_data()`.
+    :param ptr_from: Git repository state pointer to the base revision.
+    :param ptr_to: Git repository state pointer to the head revision.
+    :param contents: Value indicating whether to request the file contents.
+    :param uast: Value indicating whether to request the UASTs.
+    :param unicode: Value indicating whether to convert the files to `UnicodeFile`-s.
+    :param lazy: Value indicating whether the Unicode conversion should be postponed until \
+                 the converted fields are accessed. Ignored if `unicode` is False.
+    :param unicode_cache: Cache of the files converted to Unicode. Ignored if `unicode` is \
+                          False or `lazy` is True.
+    :param languages: Names of the languages to request. Empty means all.
+    :param include_pattern: Regular expression which the requested paths must match.
+    :param max_file_size: Maximum size of the raw file contents in bytes. The bigger files \
+                          are dropped before the Unicode conversion. 0 means unlimited.
+    :param skip_identical: Value indicating whether to drop the changes with identical \
+                           `base` and `head`. Otherwise, such sides share the same object after \
+                           the Unicode conversion.
+    :return: The asynchronous stream of the gRPC invocation results.
+    """
+    changes = stub.GetChanges(make_changes_request(
+        ptr_from, ptr_to, contents, uast, languages=languages, include_pattern=include_pattern))
+    accept = make_change_filter(languages, max_file_size)
+    if skip_identical and (contents or uast):
+        accept = _skip_identical_sides(accept)
+    if accept is not None:
+        changes = _AsyncFilter(accept, changes)
+    if unicode:
+        changes = _AsyncMap(_unicode_converter(
+            functools.partial(BytesToUnicodeConverter.convert_change, share_identical=True),
+            lazy, unicode_cache), changes)
+    return changes
+
+
+def _skip_identical_sides(accept: Optional[Callable[[Change], bool]],
+                          ) -> Callable[[Change], bool]:
+    def accept_change(change: Change) -> bool:
+        if BytesToUnicodeConverter.has_identical_sides(change):
+            return False
+        return accept is None or accept(change)
+
+    return accept_change
+
+
+def request_files(stub: DataStub, ptr: ReferencePointer, contents: bool, uast: bool,
+                  unicode: bool, lazy: bool = False,
+                  unicode_cache: Optional[UnicodeFileCache] = None,
+                  languages: Iterable[str] = (), include_pattern: Optional[str] = None,
+                  max_file_size: int = 0) -> AsyncIterator[File]:
+    """
+    Invoke GRPC API and get the files asynchronously.
+
+    :param stub: `DataStub` returned by `AsyncDataService.get_data()`.
+    :param ptr: Git repository state pointer.
+    :param contents: Value indicating whether to request the file contents.
+    :param uast: Value indicating whether to request the UASTs.
+    :param unicode: Value indicating whether to convert the files to `UnicodeFile`-s.
+    :param lazy: Value indicating whether the Unicode conversion should be postponed until \
+                 the converted fields are accessed. Ignored if `unicode` is False.
+    :param unicode_cache: Cache of the files converted to Unicode. Ignored if `unicode` is \
+                          False or `lazy` is True.
+    :param languages: Names of the languages to request. Empty means all.
+    :param include_pattern: Regular expression which the requested paths must match.
+    :param max_file_size: Maximum size of the raw file contents in bytes. The bigger files \
+                          are dropped before the Unicode conversion. 0 means unlimited.
+    :return: The asynchronous stream of the gRPC invocation results.
+    """
+    files = stub.GetFiles(make_files_request(ptr, contents, uast, languages=languages,
+                                             include_pattern=include_pattern))
+    accept = make_file_filter(languages, max_file_size)
+    if accept is not None:
+        files = _AsyncFilter(accept, files)
+    if unicode:
+        files = _AsyncMap(_unicode_converter(
+            BytesToUnicodeConverter.convert_file, lazy, unicode_cache), files)
+    return files
+
+
+async def parse_uast(stub: bblfsh.aliases.ProtocolServiceStub, code: str, filename: str,
+                     unicode: bool, language: Optional[str] = None,
+                     ) -> Tuple[bblfsh.Node, list]:
+    """
+    Return UAST for given file contents and name asynchronously.
+
+    :param stub: The Babelfish protocol stub returned by `AsyncDataService.get_bblfsh()`.
+    :param code: The contents of the file.
+    :param filename: The name of the file, can be a full path.
+    :param language: The name of the language. It is not required to set: Babelfish can \
+                     autodetect it.
+    :param unicode: Set to True if UAST position information should be converted to unicode \
+                    positions.
+    :return: The parsed UAST or undefined object if there was an error; the list of parsing errors.
+    """
+    request = bblfsh.aliases.ParseRequest(filename=os.path.basename(filename), content=code,
+                                          language=language)
+    response = await stub.Parse(request)
+    uast = response.uast
+    if unicode:
+        uast = BytesToUnicodeConverter(code.encode()).convert_uast(uast, inplace=True)
+    return uast, response.errors
+
+
+def handle_analyze_rpc_errors_async(func):
+    """
+    Close the channel of `AsyncDataService` on RPC errors in `async def analyze()`.
+
+    :param func: Method to decorate.
+    :return: The decorated method.
+    """
+    @functools.wraps(func)
+    async def wrapped_handle_rpc_errors(self: Analyzer, ptr_from: ReferencePointer,
+                                        ptr_to: ReferencePointer,
+                                        data_service: AsyncDataService, **data) -> [Comment]:
+        try:
+            return await func(self, ptr_from, ptr_to, data_service, **data)
+        except grpc.RpcError as e:
+            await data_service.close_channel()
+            raise e from None
+
+    return wrapped_handle_rpc_errors
+
+
+def _handle_train_rpc_errors_async(func):
+    @functools.wraps(func)
+    async def wrapped_handle_rpc_errors(cls: Type[Analyzer], ptr: ReferencePointer, config: dict,
+                                        data_service: AsyncDataService,
+                                        **data) -> AnalyzerModel:
+        try:
+            return await func(cls, ptr, config, data_service, **data)
+        except grpc.RpcError as e:
+            await data_service.close_channel()
+            raise e from None
+
+    return wrapped_handle_rpc_errors
+
+
+def _with_changes_async(contents: bool, uast: bool, unicode: bool, lazy: bool):
+    def configured_with_changes(func):
+        @functools.wraps(func)
+        @handle_analyze_rpc_errors_async
+        async def wrapped_with_changes(
+                self: Analyzer, ptr_from: ReferencePointer, ptr_to: ReferencePointer,
+                data_service: AsyncDataService, **data) -> [Comment]:
+            changes = request_changes(
+                data_service.get_data(), ptr_from, ptr_to, contents=contents, uast=uast,
+                unicode=unicode, lazy=lazy, unicode_cache=data_service.unicode_cache,
+                skip_identical=getattr(self, "content_changes_only", False),
+                **request_filters(self))
+            return await func(self, ptr_from, ptr_to, data_service, changes=changes, **data)
+
+        return wrapped_with_changes
+
+    return configured_with_changes
+
+
+def _with_files_async(contents: bool, uast: bool, unicode: bool, lazy: bool):
+    def configured_with_files(func):
+        @functools.wraps(func)
+        @_handle_train_rpc_errors_async
+        async def wrapped_with_files(cls: Type[Analyzer], ptr: ReferencePointer, config: dict,
+                                     data_service: AsyncDataService, **data) -> AnalyzerModel:
+            files = request_files(data_service.get_data(), ptr, contents=contents, uast=uast,
+                                  unicode=unicode, lazy=lazy,
+                                  unicode_cache=data_service.unicode_cache,
+                                  **request_filters(cls))
+            return await func(cls, ptr, config, data_service, files=files, **data)
+
+        return wrapped_with_files
+
+    return configured_with_files
+
+
+def with_changed_uasts_async(unicode: bool, lazy: bool = False):
+    """
+    Provide "changes" keyword argument to `**data` in `async def analyze()`.
+
+    "changes" is the asynchronous stream of `Change`-s with only UASTs, no raw file contents. \
+    See `lookout.core.data_requests.with_changed_uasts()` for the description of the parameters.
+
+    :return: The decorated method.
+    """
+    return _with_changes_async(contents=False, uast=True, unicode=unicode, lazy=lazy)
+
+
+def with_changed_contents_async(unicode: bool, lazy: bool = False):
+    """
+    Provide "changes" keyword argument to `**data` in `async def analyze()`.
+
+    "changes" is the asynchronous stream of `Change`-s with only raw file contents, no UASTs. \
+    See `lookout.core.data_requests.with_changed_contents()` for the description of the \
+    parameters.
+
+    :return: The decorated method.
+    """
+    return _with_changes_async(contents=True, uast=False, unicode=unicode, lazy=lazy)
+
+
+def with_changed_uasts_and_contents_async(unicode: bool, lazy: bool = False):
+    """
+    Provide "changes" keyword argument to `**data` in `async def analyze()`.
+
+    "changes" is the asynchronous stream of `Change`-s with both UASTs and raw file contents. \
+    See `lookout.core.data_requests.with_changed_uasts_and_contents()` for the description of \
+    the parameters.
+
+    :return: The decorated method.
+    """
+    return _with_changes_async(contents=True, uast=True, unicode=unicode, lazy=lazy)
+
+
+def with_uasts_async(unicode: bool, lazy: bool = False):
+    """
+    Provide "files" keyword argument to `**data` in `async def train()`.
+
+    "files" is the asynchronous stream of `File`-s with only UASTs, no raw file contents. \
+    See `lookout.core.data_requests.with_uasts()` for the description of the parameters.
+
+    :return: The decorated method.
+    """
+    return _with_files_async(contents=False, uast=True, unicode=unicode, lazy=lazy)
+
+
+def with_contents_async(unicode: bool, lazy: bool = False):
+    """
+    Provide "files" keyword argument to `**data` in `async def train()`.
+
+    "files" is the asynchronous stream of `File`-s with only raw file contents, no UASTs. \
+    See `lookout.core.data_requests.with_contents()` for the description of the parameters.
+
+    :return: The decorated method.
+    """
+    return _with_files_async(contents=True, uast=False, unicode=unicode, lazy=lazy)
+
+
+def with_uasts_and_contents_async(unicode: bool, lazy: bool = False):
+    """
+    Provide "files" keyword argument to `**data` in `async def train()`.
+
+    "files" is the asynchronous stream of `File`-s with both UASTs and raw file contents. \
+    See `lookout.core.data_requests.with_uasts_and_contents()` for the description of the \
+    parameters.
+
+    :return: The decorated method.
+    """
+    return _with_files_async(contents=True, uast=True, unicode=unicode, lazy=lazy)
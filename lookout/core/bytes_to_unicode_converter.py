@@ -1,10 +1,45 @@
-from typing import Dict, Iterator
+import codecs
+import copyreg
+import hashlib
+import logging
+import sys
+import threading
+from typing import Any, Callable, Iterator, List, Optional, Tuple, Union
 
 import bblfsh
+import cachetools
 from lookout.sdk.service_data_pb2 import Change, File
 import numpy
 
 from lookout.core.analyzer import UnicodeChange, UnicodeFile
+from lookout.core.metrics import record_event
+from lookout.core.uast import iter_bfs, iter_positions
+
+
+_invalid_utf8_spans = threading.local()
+
+
+def _record_invalid_utf8(error: UnicodeDecodeError) -> Tuple[str, int]:
+    _invalid_utf8_spans.spans.append((error.start, error.end))
+    return "", error.end
+
+
+# the decoder calls the handler for every maximal invalid subpart in a single linear pass
+codecs.register_error("lookout.record_invalid_utf8", _record_invalid_utf8)
+
+
+def _unpickle_node(data: bytes) -> bblfsh.Node:
+    return bblfsh.Node.FromString(data)
+
+
+def _pickle_node(node: bblfsh.Node) -> Tuple[Callable[[bytes], bblfsh.Node], Tuple[bytes]]:
+    return _unpickle_node, (node.SerializeToString(),)
+
+
+# The generated class claims to live in "gopkg.in...", which pickle cannot resolve, so
+# UnicodeConversionPool passes the UASTs between the processes serialized. The reducer is
+# registered here because the spawned workers import only the conversion functions.
+copyreg.pickle(bblfsh.Node, _pickle_node)
 
 
 class BytesToUnicodeConverter:
@@ -20,66 +55,109 @@ class BytesToUnicodeConverter:
         self._content_str = content.decode(errors="replace")
         self._lines = self._content_str.splitlines(keepends=True)
         self._byte_to_str_offset = self._build_bytes_to_str_offset_mapping(content)
-        self._lines_offset = self._build_lines_offset_mapping(self._content_str)
+        self._lines_offset = self._build_lines_offset_mapping(self._content_str, self._lines)
 
     def convert_content(self):
         """Convert byte content (or code) to unicode."""
         return self._content_str
 
-    def convert_uast(self, uast: bblfsh.Node) -> bblfsh.Node:
+    def convert_uast(self, uast: bblfsh.Node, inplace: bool = False) -> bblfsh.Node:
         """
         Convert uast Nodes bytes position to unicode position.
 
         UAST is expected to correspond to provided content.
         :param uast: corresponding UAST.
-        :return: UAST with unicode positions.
+        :param inplace: Value indicating whether to change the positions of `uast` itself \
+                        instead of a deep copy. Only safe if nobody else uses `uast`.
+        :return: UAST with unicode positions. It is `uast` if `inplace` is True.
         """
-        uast = bblfsh.Node.FromString(uast.SerializeToString())  # deep copy the whole tree
+        if not inplace:
+            uast = bblfsh.Node.FromString(uast.SerializeToString())  # deep copy the whole tree
         if not self._content:
             return uast
-        for node in self._traverse_uast(uast):
-            for position in (node.start_position, node.end_position):
-                if position.offset == 0 and position.col == 0 and position.line == 0:
-                    continue
-                new_position = self._convert_position(position)
-                for attr in ("offset", "line", "col"):
-                    setattr(position, attr, getattr(new_position, attr))
+        positions = list(iter_positions(uast))
+        if not positions:
+            return uast
+        byte_offsets = numpy.fromiter((p.offset for p in positions), dtype=numpy.int64,
+                                      count=len(positions))
+        byte_lines = numpy.fromiter((p.line for p in positions), dtype=numpy.int64,
+                                    count=len(positions))
+        offsets, lines, cols = self._convert_offsets(byte_offsets, byte_lines)
+        for position, offset, line, col in zip(
+                positions, offsets.tolist(), lines.tolist(), cols.tolist()):
+            position.offset = offset
+            position.line = line
+            position.col = col
         return uast
 
     @staticmethod
-    def convert_file(file: File) -> UnicodeFile:
+    def convert_file(file: File, inplace: bool = False, lazy: bool = False) -> UnicodeFile:
         """
         Convert lookout `File` to `UnicodeFile` with converted content and uast.
 
         path and language fields are the same for result and provided `File` instance.
 
         :param file: lookout File to convert.
+        :param inplace: Value indicating whether to convert `file.uast` in place. See \
+                        `convert_uast()`.
+        :param lazy: Value indicating whether to postpone the conversion until `content` or \
+                     `uast` is accessed. See `LazyUnicodeFile`.
         :return: New UnicodeFile instance.
         """
+        if lazy:
+            return LazyUnicodeFile(file, inplace=inplace)
         converter = BytesToUnicodeConverter(file.content)
         return UnicodeFile(
             content=converter.convert_content(),
-            uast=converter.convert_uast(file.uast),
+            uast=converter.convert_uast(file.uast, inplace=inplace),
             path=file.path,
             language=file.language,
         )
 
     @staticmethod
-    def convert_change(change: Change) -> UnicodeChange:
+    def convert_change(change: Change, inplace: bool = False, lazy: bool = False,
+                       share_identical: bool = False) -> UnicodeChange:
         """
         Convert lookout `Change` to `UnicodeChange` with converted content and uast.
 
         :param change: lookout Change to convert.
+        :param inplace: Value indicating whether to convert the UASTs in place. See \
+                        `convert_uast()`.
+        :param lazy: Value indicating whether `base` and `head` should be `LazyUnicodeFile`-s.
+        :param share_identical: Value indicating whether to convert `head` only once and to \
+                                reuse its content and UAST in `base` if the sides are \
+                                identical. See `has_identical_sides()`.
         :return: New UnicodeChange instance.
         """
-        return UnicodeChange(
-            base=BytesToUnicodeConverter.convert_file(change.base),
-            head=BytesToUnicodeConverter.convert_file(change.head),
-        )
+        # the in-place conversion of head changes its UAST, so compare before converting
+        identical = share_identical and BytesToUnicodeConverter.has_identical_sides(change)
+        head = BytesToUnicodeConverter.convert_file(change.head, inplace=inplace, lazy=lazy)
+        if not identical:
+            base = BytesToUnicodeConverter.convert_file(change.base, inplace=inplace, lazy=lazy)
+        elif change.base.path == change.head.path and \
+                change.base.language == change.head.language:
+            base = head
+        elif lazy:
+            # renaming would force the conversion
+            base = LazyUnicodeFile(change.base, inplace=inplace)
+        else:
+            base = head._replace(path=change.base.path, language=change.base.language)
+        return UnicodeChange(base=base, head=head)
+
+    @staticmethod
+    def has_identical_sides(change: Change) -> bool:
+        """
+        Return the value indicating whether `base` and `head` of the change have the same \
+        blob hash, content and UAST, e.g. after a rename or a mode change. Added and deleted \
+        files never have identical sides.
+        """
+        base, head = change.base, change.head
+        return bool(base.path) and bool(head.path) and base.hash == head.hash and \
+            base.content == head.content and base.uast == head.uast
 
     def _convert_position(self, byte_position: bblfsh.Position) -> bblfsh.Position:
         """Get a new byte_position from an old one."""
-        offset = self._byte_to_str_offset[byte_position.offset]
+        offset = int(self._byte_to_str_offset[byte_position.offset])
         line_num = numpy.argmax(self._lines_offset > offset) - 1
         col = offset - self._lines_offset[line_num]
         # line number can change. File example:
@@ -95,46 +173,308 @@ class BytesToUnicodeConverter:
                 "position.") % (line_num + 1, byte_position.line)
         return bblfsh.Position(offset=offset, line=line_num + 1, col=col + 1)
 
+    def _convert_offsets(self, byte_offsets: numpy.ndarray, byte_lines: numpy.ndarray,
+                         ) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """
+        Convert many byte positions at once. Vectorized version of `_convert_position()`.
+
+        :param byte_offsets: Byte offsets of the positions.
+        :param byte_lines: Line numbers of the positions, only used for the sanity check.
+        :return: Unicode offsets, 1-based line numbers and 1-based columns.
+        """
+        offsets = self._byte_to_str_offset[byte_offsets]
+        line_nums = numpy.searchsorted(self._lines_offset, offsets, side="right") - 1
+        cols = offsets - self._lines_offset[line_nums]
+        # The same line number change as in `_convert_position()`. The column can be equal to
+        # the line length only on the last line because `_lines_offset` ends with len + 1.
+        last_line = self._lines[-1]
+        if last_line.splitlines()[0] != last_line:
+            at_end = offsets == len(self._content_str)
+            line_nums[at_end] += 1
+            cols[at_end] = 0
+        invalid = line_nums + 1 < byte_lines
+        if invalid.any():
+            index = numpy.argmax(invalid)
+            raise AssertionError(
+                "Unicode line number %d is smaller then in bytes (%d) position." % (
+                    line_nums[index] + 1, byte_lines[index]))
+        return offsets, line_nums + 1, cols + 1
+
     @staticmethod
-    def _build_lines_offset_mapping(content: str) -> numpy.ndarray:
+    def _build_lines_offset_mapping(content: str,
+                                    lines: Optional[List[str]] = None) -> numpy.ndarray:
         """
-        Create a dictionary with line number to bytes offset for the line start mapping.
+        Create an array with the unicode offsets of the line starts.
 
-        :param content: Code byte representation.
-        :return: array with lines offsets. Last number is equal to the length of the content.
+        :param content: Code unicode representation.
+        :param lines: Precomputed `content.splitlines(keepends=True)`.
+        :return: array with lines offsets. Last number is equal to the length of the content \
+                 plus one.
         """
         if not content:
             return numpy.empty(shape=(0, 0))
-        line_start_offsets = [0]
-        for d in content.splitlines(keepends=True):
-            line_start_offsets.append(line_start_offsets[-1] + len(d))
+        if lines is None:
+            lines = content.splitlines(keepends=True)
+        line_start_offsets = numpy.zeros(len(lines) + 1, dtype=numpy.int32)
+        numpy.cumsum([len(line) for line in lines], dtype=numpy.int32,
+                     out=line_start_offsets[1:])
         line_start_offsets[-1] += 1
-        return numpy.array(line_start_offsets)
+        return line_start_offsets
 
     @staticmethod
-    def _build_bytes_to_str_offset_mapping(content: bytes) -> Dict[int, int]:
+    def _build_bytes_to_str_offset_mapping(content: bytes) -> numpy.ndarray:
         """
-        Create a dictionary with bytes offset to unicode string offset mapping.
+        Create an array with bytes offset to unicode string offset mapping.
+
+        The mapping is dense: each byte offset from 0 to `len(content)` inclusive has a value. \
+        Offsets which point inside a multibyte character are mapped to the offset right after \
+        that character. Invalid byte sequences are treated the same way as \
+        `content.decode(errors="replace")` does: every maximal invalid subpart becomes a single \
+        replacement character.
 
         :param content: Bytes object which is used to create offsets mapping.
-        :return: Dictionary with bytes offset to unicode string offset mapping.
-        """
-        byte_to_str_offset = {0: 0}
-        byte_len_before = 0
-        content_str = content.decode(errors="replace")
-        for i, char in enumerate(content_str):
-            if char != "\ufffd":  # replacement character
-                byte_len_before += len(char.encode())
-            else:
-                byte_len_before += 1  # It is smart enough to replace by byte that is why only +=1
-            byte_to_str_offset[byte_len_before] = i + 1
-        byte_to_str_offset[len(content)] = len(content_str)
+        :return: int32 array of length `len(content) + 1`; the value at index `i` is the \
+                 unicode string offset which corresponds to the byte offset `i`.
+        """
+        data = numpy.frombuffer(content, dtype=numpy.uint8)
+        # UTF-8 continuation bytes are 10xxxxxx, everything else starts a new character
+        char_starts = (data & 0xC0) != 0x80
+        _invalid_utf8_spans.spans = spans = []
+        try:
+            content.decode(errors="lookout.record_invalid_utf8")
+        finally:
+            del _invalid_utf8_spans.spans
+        if spans:
+            starts, ends = numpy.array(spans, dtype=numpy.int64).T
+            char_starts[starts] = True
+            # a maximal invalid subpart of UTF-8 is at most 3 bytes long
+            for shift in (1, 2):
+                char_starts[starts[ends - starts > shift] + shift] = False
+        byte_to_str_offset = numpy.zeros(len(content) + 1, dtype=numpy.int32)
+        numpy.cumsum(char_starts, dtype=numpy.int32, out=byte_to_str_offset[1:])
         return byte_to_str_offset
 
+
+class LazyUnicodeFile(UnicodeFile):
+    """
+    `UnicodeFile` which converts `content` and `uast` only on the first access.
+
+    It behaves like a regular `UnicodeFile` named tuple: the fields are available by name, \
+    by index and by unpacking. The converted values are memoized. Pickling produces a regular \
+    `UnicodeFile`.
+    """
+
+    def __new__(cls, file: File, inplace: bool = False) -> "LazyUnicodeFile":
+        """
+        Create a new instance of LazyUnicodeFile.
+
+        :param file: lookout File to convert.
+        :param inplace: Value indicating whether to convert `file.uast` in place. See \
+                        `BytesToUnicodeConverter.convert_uast()`.
+        :return: New LazyUnicodeFile which converts `file` on demand.
+        """
+        self = super().__new__(cls, None, None, file.path, file.language)
+        self._file = file
+        self._inplace = inplace
+        self._converted_content = None
+        self._converted_uast = None
+        self._lock = threading.Lock()
+        return self
+
+    @property
+    def content(self) -> str:
+        """Return the Unicode content of the file."""
+        if self._converted_content is None:
+            with self._lock:
+                if self._converted_content is None:
+                    self._converted_content = self._file.content.decode(errors="replace")
+        return self._converted_content
+
+    @property
+    def uast(self) -> bblfsh.Node:
+        """Return the UAST of the file with Unicode positions."""
+        if self._converted_uast is None:
+            with self._lock:
+                if self._converted_uast is None:
+                    converter = BytesToUnicodeConverter(self._file.content)
+                    if self._converted_content is None:
+                        self._converted_content = converter.convert_content()
+                    self._converted_uast = converter.convert_uast(
+                        self._file.uast, inplace=self._inplace)
+        return self._converted_uast
+
+    @property
+    def converted(self) -> bool:
+        """Return the value indicating whether the UAST has already been converted."""
+        return self._converted_uast is not None
+
+    def __getitem__(self, index: Union[int, slice]):
+        """Return the field(s) by index like a tuple does."""
+        if isinstance(index, slice):
+            return tuple(self[i] for i in range(len(self._fields))[index])
+        field = self._fields[index]
+        if field in ("content", "uast"):
+            return getattr(self, field)
+        # the other field properties call __getitem__ on Python < 3.8, so avoid getattr()
+        return tuple.__getitem__(self, index)
+
+    def __iter__(self) -> Iterator:
+        """Iterate over the fields like a tuple does."""
+        return (getattr(self, field) for field in self._fields)
+
+    def __eq__(self, other) -> bool:
+        """Compare the fields with another tuple."""
+        if isinstance(other, LazyUnicodeFile):
+            other = tuple(other)
+        return tuple(self) == other
+
+    def __ne__(self, other) -> bool:
+        """Compare the fields with another tuple."""
+        return not self == other
+
+    def __hash__(self) -> int:
+        """Hash the fields like a tuple does."""
+        return hash(tuple(self))
+
+    def __repr__(self) -> str:
+        """Represent the file the same way as `UnicodeFile` does."""
+        return repr(UnicodeFile(*self)).replace("UnicodeFile", type(self).__name__, 1)
+
+    def __reduce__(self):
+        """Pickle as a regular `UnicodeFile`."""
+        return UnicodeFile, tuple(self)
+
+    def _replace(self, **kwargs) -> UnicodeFile:
+        return UnicodeFile(*self)._replace(**kwargs)
+
+
+class UnicodeFileCache:
+    """
+    Thread-safe LRU cache of the converted `UnicodeFile`-s.
+
+    The key is the hash of the file content and of the serialized UAST, so the same blob is \
+    converted only once regardless of its path or revision. The cached UASTs are shared and \
+    must not be modified.
+    """
+
+    # approximate memory taken by each parsed UAST node on top of its serialized size
+    NODE_OVERHEAD = 200
+
+    _log = logging.getLogger("UnicodeFileCache")
+
+    def __init__(self, max_size: int):
+        """
+        Initialize a new instance of UnicodeFileCache.
+
+        :param max_size: Maximum memory size to use for the cache (in bytes, approximate).
+        """
+        self._cache = cachetools.LRUCache(maxsize=max_size, getsizeof=self._getsizeof)
+        self._lock = threading.Lock()
+
+    def __str__(self) -> str:
+        """Summarize the cache as a string."""
+        return "UnicodeFileCache(%d/%d)" % (self._cache.currsize, self._cache.maxsize)
+
+    def convert(self, item: Union[File, Change], inplace: bool = False,
+                ) -> Union[UnicodeFile, UnicodeChange]:
+        """
+        Convert a lookout `File` or `Change`, reusing the previously converted files.
+
+        :param item: lookout `File` or `Change` to convert.
+        :param inplace: Value indicating whether to convert the UASTs in place on a cache miss.
+        :return: `UnicodeFile` or `UnicodeChange`, depending on the type of `item`.
+        """
+        if isinstance(item, Change):
+            return UnicodeChange(base=self.convert(item.base, inplace=inplace),
+                                 head=self.convert(item.head, inplace=inplace))
+        key, result = self.lookup(item)
+        if result is None:
+            result = self.store(
+                key, BytesToUnicodeConverter.convert_file(item, inplace=inplace))
+        return result
+
+    def lookup(self, item: Union[File, Change],
+               ) -> Tuple[Any, Optional[Union[UnicodeFile, UnicodeChange]]]:
+        """
+        Find the converted `File` or `Change` in the cache.
+
+        A `Change` is found only if both `base` and `head` are cached.
+
+        :param item: lookout `File` or `Change` to look up.
+        :return: The cache key to pass to `store()` and the converted item or None on a miss.
+        """
+        if isinstance(item, Change):
+            base_key, base = self.lookup(item.base)
+            head_key, head = self.lookup(item.head)
+            if base is None or head is None:
+                return (base_key, head_key), None
+            return (base_key, head_key), UnicodeChange(base=base, head=head)
+        key = self._key(item)
+        with self._lock:
+            result = self._cache.get(key)
+        if result is None:
+            record_event("UnicodeFileCache.miss", 1)
+            return key, None
+        record_event("UnicodeFileCache.hit", 1)
+        return key, self._rename(result, item)
+
+    def store(self, key: Any, value: Union[UnicodeFile, UnicodeChange],
+              ) -> Union[UnicodeFile, UnicodeChange]:
+        """
+        Put the converted `File` or `Change` to the cache.
+
+        The UASTs are copied before caching: a UAST converted in place is a submessage of \
+        the original `File` and would otherwise keep its raw content and UAST alive.
+
+        :param key: The key returned by `lookup()`.
+        :param value: The converted item.
+        :return: The item as it is cached, it should be used instead of `value`.
+        """
+        if isinstance(value, UnicodeChange):
+            return UnicodeChange(base=self.store(key[0], value.base),
+                                 head=self.store(key[1], value.head))
+        # cheap lower bound of _getsizeof() to avoid copying the UASTs which are too big
+        if sys.getsizeof(value.content) + value.uast.ByteSize() > self._cache.maxsize:
+            self._log.debug("%s is too big to be cached", value.path)
+            return value
+        value = self._detach(value)
+        with self._lock:
+            try:
+                self._cache[key] = value
+            except ValueError:
+                self._log.debug("%s is too big to be cached", value.path)
+            size = self._cache.currsize
+        record_event("UnicodeFileCache.size", size)
+        return value
+
+    def clear(self):
+        """
+        Remove all the cached files.
+        """
+        with self._lock:
+            self._cache.clear()
+
     @staticmethod
-    def _traverse_uast(uast: "bblfsh.Node") -> Iterator["bblfsh.Node"]:
-        stack = [uast]
-        while stack:
-            node = stack.pop(0)
-            stack.extend(node.children)
-            yield node
+    def _key(file: File) -> bytes:
+        digest = hashlib.sha1(file.content)
+        digest.update(file.uast.SerializeToString(deterministic=True))
+        return digest.digest()
+
+    @staticmethod
+    def _rename(unicode_file: UnicodeFile, file: File) -> UnicodeFile:
+        if unicode_file.path == file.path and unicode_file.language == file.language:
+            return unicode_file
+        return unicode_file._replace(path=file.path, language=file.language)
+
+    @staticmethod
+    def _detach(unicode_file: UnicodeFile) -> UnicodeFile:
+        uast = bblfsh.Node()
+        uast.CopyFrom(unicode_file.uast)
+        return unicode_file._replace(uast=uast)
+
+    @classmethod
+    def _getsizeof(cls, unicode_file: UnicodeFile) -> int:
+        uast = unicode_file.uast
+        nodes = sum(1 for _ in iter_bfs(uast)) if uast.ByteSize() else 0
+        return sys.getsizeof(unicode_file.content) + uast.ByteSize() + \
+            nodes * cls.NODE_OVERHEAD
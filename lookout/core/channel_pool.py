@@ -0,0 +1,296 @@
+"""Bounded pool of gRPC channels which are shared by the threads."""
+import logging
+import threading
+import time
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import grpc
+
+from lookout.core.grpc_options import make_grpc_options
+from lookout.core.metrics import record_event
+
+
+class PooledChannel:
+    """
+    gRPC channel which belongs to `ChannelPool`. It caches the stubs created for the channel.
+    """
+
+    def __init__(self, channel: grpc.Channel, slot: int):
+        """
+        Initialize a new instance of `PooledChannel`.
+
+        :param channel: Wrapped gRPC channel.
+        :param slot: Index of the channel in the pool.
+        """
+        self.channel = channel
+        self.slot = slot
+        self.borrowers = 0
+        self.last_used = time.monotonic()
+        self.state = None
+        self.retired = False
+        self.watcher = None
+        self._stubs = {}
+
+    def __str__(self):
+        """Summarize the PooledChannel instance as a string."""
+        return "PooledChannel(%d, %s)" % (self.slot, self.channel)
+
+    @property
+    def healthy(self) -> bool:
+        """
+        Return the value indicating whether the channel is not known to be broken.
+        """
+        return self.state not in (grpc.ChannelConnectivity.TRANSIENT_FAILURE,
+                                  grpc.ChannelConnectivity.SHUTDOWN)
+
+    def get_stub(self, factory: Callable[[grpc.Channel], object]):
+        """
+        Return the stub for the channel. The stub is created only once per factory.
+
+        :param factory: Callable which creates a stub from `grpc.Channel`, for example, \
+                        `DataStub`.
+        :return: The stub returned by the factory.
+        """
+        stub = self._stubs.get(factory)
+        if stub is None:
+            self._stubs[factory] = stub = factory(self.channel)
+        return stub
+
+
+class ChannelPool:
+    """
+    Bounded pool of gRPC channels to the same endpoint.
+
+    The threads borrow the channels and return them after they finish their RPCs. gRPC \
+    channels are thread safe, so a channel can be borrowed by several threads at once. \
+    The channels are opened on demand and closed after staying idle for `idle_timeout`. \
+    The connectivity of each channel is watched; broken channels are not lent while there \
+    are healthy ones. A channel which failed an RPC is replaced with a new one after an \
+    exponentially growing delay.
+    """
+
+    ROUND_ROBIN = "round-robin"
+    LEAST_LOADED = "least-loaded"
+    POLICIES = (ROUND_ROBIN, LEAST_LOADED)
+    # gRPC polls the connectivity every 0.2s and raises if the channel is closed before
+    # it notices that there are no subscribers
+    CLOSE_GRACE = 0.5
+    _log = logging.getLogger("ChannelPool")
+
+    def __init__(self, address: str, size: int, policy: str = LEAST_LOADED,
+                 idle_timeout: float = 300, keepalive_time: float = 300,
+                 keepalive_timeout: float = 20, initial_backoff: float = 1,
+                 max_backoff: float = 60, options: Optional[Sequence[Tuple[str, object]]] = None):
+        """
+        Initialize a new instance of `ChannelPool`.
+
+        :param address: GRPC endpoint to connect to.
+        :param size: Maximum number of simultaneously open channels.
+        :param policy: How to choose the channel to lend: "round-robin" or "least-loaded".
+        :param idle_timeout: Number of seconds after which an unused channel is closed. \
+                             0 disables the eviction.
+        :param keepalive_time: Interval between the HTTP/2 keepalive pings in seconds. \
+                               0 disables the pings.
+        :param keepalive_timeout: Number of seconds to wait for the keepalive ping \
+                                  acknowledgement before the connection is considered dead.
+        :param initial_backoff: Number of seconds to wait before reopening a failed channel \
+                                for the first time. The delay doubles with each consecutive \
+                                failure.
+        :param max_backoff: Maximum number of seconds to wait before reopening a failed channel.
+        :param options: Additional gRPC channel options, see `make_grpc_options()`. They \
+                        override the defaults.
+        """
+        if size < 1:
+            raise ValueError("The pool size must be positive, got %d" % size)
+        if policy not in self.POLICIES:
+            raise ValueError("Unsupported policy %s, must be one of %s" % (policy, self.POLICIES))
+        self._address = address
+        self._size = size
+        self._policy = policy
+        self._idle_timeout = idle_timeout
+        self._initial_backoff = initial_backoff
+        self._max_backoff = max_backoff
+        channel_options = make_grpc_options()
+        if keepalive_time > 0:
+            channel_options.extend([
+                ("grpc.keepalive_time_ms", int(keepalive_time * 1000)),
+                ("grpc.keepalive_timeout_ms", int(keepalive_timeout * 1000)),
+                ("grpc.keepalive_permit_without_calls", 1),
+                ("grpc.http2.max_pings_without_data", 0),
+            ])
+        channel_options.extend([
+            ("grpc.initial_reconnect_backoff_ms", int(initial_backoff * 1000)),
+            ("grpc.max_reconnect_backoff_ms", int(max_backoff * 1000)),
+        ])
+        channel_options.extend(options or [])
+        # the later values of the same option take precedence
+        self._options = list(dict(channel_options).items())
+        self._slots = [None] * size  # type: List[Optional[PooledChannel]]
+        self._failures = [0] * size
+        self._retry_at = [0.0] * size
+        self._open = set()
+        self._closing = []  # type: List[Tuple[float, PooledChannel]]
+        self._next_slot = 0
+        self._lock = threading.RLock()
+
+    def __str__(self):
+        """Summarize the ChannelPool instance as a string."""
+        return "ChannelPool(%s, %d, %s)" % (self._address, self._size, self._policy)
+
+    @property
+    def size(self) -> int:
+        """
+        Return the maximum number of simultaneously open channels.
+        """
+        return self._size
+
+    def borrow(self) -> PooledChannel:
+        """
+        Lend a channel. It must be returned with `release()`.
+
+        Blocks if all the channels are waiting for reconnection.
+
+        :return: Borrowed channel.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._evict_idle(now)
+                self._close_unsubscribed(now)
+                slots = [i for i in range(self._size) if self._retry_at[i] <= now]
+                if slots:
+                    slot = self._choose(slots)
+                    pooled = self._slots[slot]
+                    if pooled is None:
+                        pooled = self._open_channel(slot)
+                    pooled.borrowers += 1
+                    pooled.last_used = now
+                    self._report()
+                    return pooled
+                delay = min(self._retry_at) - now
+            self._log.warning("all the channels are reconnecting, waiting %.1fs", delay)
+            time.sleep(delay)
+
+    def release(self, pooled: PooledChannel) -> None:
+        """
+        Return the borrowed channel to the pool.
+
+        :param pooled: Channel returned by `borrow()`.
+        :return: None
+        """
+        with self._lock:
+            pooled.borrowers -= 1
+            pooled.last_used = now = time.monotonic()
+            if pooled.retired and pooled.borrowers == 0:
+                self._close_channel(pooled)
+            self._evict_idle(now)
+            self._close_unsubscribed(now)
+            self._report()
+
+    def invalidate(self, pooled: PooledChannel) -> None:
+        """
+        Stop lending the channel after an RPC failure. It is closed when the last borrower \
+        releases it. The replacement channel is opened after the backoff delay.
+
+        :param pooled: Channel returned by `borrow()`.
+        :return: None
+        """
+        with self._lock:
+            if pooled.retired:
+                return
+            pooled.retired = True
+            slot = pooled.slot
+            self._slots[slot] = None
+            self._failures[slot] += 1
+            delay = min(self._initial_backoff * 2 ** (self._failures[slot] - 1),
+                        self._max_backoff)
+            self._retry_at[slot] = time.monotonic() + delay
+            self._log.info("%s failed, reopening in %.1fs", pooled, delay)
+            record_event("ChannelPool.failure", 1)
+
+    def close(self) -> None:
+        """
+        Close all the channels, including the borrowed ones.
+
+        Blocks for up to `CLOSE_GRACE` seconds until gRPC stops watching the channels.
+
+        :return: None
+        """
+        with self._lock:
+            for pooled in list(self._open):
+                self._close_channel(pooled)
+            if self._closing:
+                time.sleep(max(self._closing[-1][0] - time.monotonic(), 0))
+                self._close_unsubscribed(float("inf"))
+            self._slots = [None] * self._size
+            self._failures = [0] * self._size
+            self._retry_at = [0.0] * self._size
+            self._report()
+
+    def _choose(self, slots: List[int]) -> int:
+        def healthy(i):
+            return self._slots[i] is None or self._slots[i].healthy
+
+        candidates = [i for i in slots if healthy(i)] or slots
+        if self._policy == self.ROUND_ROBIN:
+            slot = min(candidates, key=lambda i: (i - self._next_slot) % self._size)
+            self._next_slot = (slot + 1) % self._size
+            return slot
+
+        def load(i):
+            pooled = self._slots[i]
+            if pooled is None:
+                return 0, True
+            return pooled.borrowers, False
+
+        return min(candidates, key=load)
+
+    def _open_channel(self, slot: int) -> PooledChannel:
+        pooled = PooledChannel(grpc.insecure_channel(self._address, self._options), slot)
+        self._slots[slot] = pooled
+        self._open.add(pooled)
+        pooled.watcher = self._state_watcher(pooled)
+        pooled.channel.subscribe(pooled.watcher)
+        self._log.info("Opened %s", pooled)
+        return pooled
+
+    def _close_channel(self, pooled: PooledChannel) -> None:
+        if self._slots[pooled.slot] is pooled:
+            self._slots[pooled.slot] = None
+        self._open.discard(pooled)
+        pooled.retired = True
+        pooled.channel.unsubscribe(pooled.watcher)
+        self._closing.append((time.monotonic() + self.CLOSE_GRACE, pooled))
+        self._log.info("Disposed %s", pooled)
+
+    def _close_unsubscribed(self, now: float) -> None:
+        while self._closing and self._closing[0][0] <= now:
+            _, pooled = self._closing.pop(0)
+            pooled.channel.close()
+
+    def _evict_idle(self, now: float) -> None:
+        if self._idle_timeout <= 0:
+            return
+        for pooled in self._slots:
+            if pooled is not None and pooled.borrowers == 0 and \
+                    now - pooled.last_used >= self._idle_timeout:
+                self._close_channel(pooled)
+
+    def _state_watcher(self, pooled: PooledChannel) -> Callable[[grpc.ChannelConnectivity], None]:
+        def watch_state(state: grpc.ChannelConnectivity):
+            with self._lock:
+                pooled.state = state
+                if state == grpc.ChannelConnectivity.READY:
+                    self._failures[pooled.slot] = 0
+                elif state == grpc.ChannelConnectivity.TRANSIENT_FAILURE:
+                    self._log.warning("%s lost the connection", pooled)
+                    record_event("ChannelPool.disconnect", 1)
+
+        return watch_state
+
+    def _report(self) -> None:
+        busy = sum(1 for pooled in self._slots if pooled is not None and pooled.borrowers > 0)
+        record_event("ChannelPool.channels", len(self._open))
+        record_event("ChannelPool.borrowers",
+                     sum(pooled.borrowers for pooled in self._open))
+        record_event("ChannelPool.utilization", busy / self._size)
@@ -1,4 +1,5 @@
 import argparse
+import asyncio
 import importlib
 import json
 import logging
@@ -9,12 +10,15 @@ import tempfile
 from unittest.mock import patch
 
 import configargparse
+import grpc
 import humanfriendly
 import lookout
 
 from lookout.core import slogging
+from lookout.core.channel_pool import ChannelPool
 from lookout.core.data_requests import DataService
 from lookout.core.event_listener import EventListener
+from lookout.core.grpc_options import COMPRESSION_ALGORITHMS, make_grpc_options
 from lookout.core.manager import AnalyzerManager
 from lookout.core.package import package_cmdline_entry
 from lookout.core.sqla_model_repository import SQLAlchemyModelRepository
@@ -80,23 +84,77 @@ def run_analyzers(args: argparse.Namespace):
         data_request_address = "%s:10301" % args.server.split(":")[0]
     else:
         data_request_address = args.request_server
-    data_service = DataService(data_request_address)
+    grpc_options = make_grpc_options(
+        compression=args.grpc_compression,
+        max_message_size=humanfriendly.parse_size(args.grpc_max_message_size, binary=True),
+        window_size=humanfriendly.parse_size(args.grpc_window_size, binary=True))
+    data_service = DataService(
+        data_request_address, unicode_workers=args.unicode_workers,
+        unicode_cache_size=humanfriendly.parse_size(args.unicode_cache_size),
+        prefetch_bytes=humanfriendly.parse_size(args.prefetch_size),
+        cache_dir=args.data_cache_dir,
+        cache_size=humanfriendly.parse_size(args.data_cache_size),
+        channel_pool_size=args.channel_pool_size,
+        channel_pool_policy=args.channel_pool_policy,
+        channel_idle_timeout=humanfriendly.parse_timespan(args.channel_idle_timeout),
+        channel_keepalive_time=humanfriendly.parse_timespan(args.channel_keepalive_time),
+        stream_retries=args.stream_retries,
+        stream_retry_backoff=humanfriendly.parse_timespan(args.stream_retry_backoff),
+        bblfsh_drivers_ttl=humanfriendly.parse_timespan(args.bblfsh_drivers_ttl),
+        channel_options=grpc_options,
+        measure_stream_bytes=args.measure_stream_bytes)
     log.info("Created %s", data_service)
     sys.path.append(os.getcwd())
+    analyzers = [importlib.import_module(a).analyzer_class for a in args.analyzer]
+    sys.path = sys.path[:-1]
+    if args.check_bblfsh_drivers:
+        drivers = sorted({d for a in analyzers for d in a.bblfsh_drivers})
+        # the main thread does not make any other requests, so return the borrowed channel
+        try:
+            data_service.check_bblfsh_driver_versions(drivers)
+        except grpc.RpcError as e:
+            data_service.close_channel()
+            raise e from None
+        finally:
+            data_service.release_channel()
+        log.info("Checked the Babelfish drivers: %s", ", ".join(drivers))
+    async_data_service = None
+    if any(asyncio.iscoroutinefunction(getattr(a, m)) for a in analyzers
+           for m in ("analyze", "train", "check_training_required")):
+        # grpc.aio is not available in Python 3.5, so the import is optional
+        from lookout.core.async_data_requests import AsyncDataService
+        async_data_service = AsyncDataService(
+            data_request_address,
+            unicode_cache_size=humanfriendly.parse_size(args.unicode_cache_size),
+            channel_options=grpc_options)
+        log.info("Created %s", async_data_service)
     manager = AnalyzerManager(
-        analyzers=[importlib.import_module(a).analyzer_class for a in args.analyzer],
+        analyzers=analyzers,
         model_repository=model_repository,
         data_service=data_service,
+        async_data_service=async_data_service,
+        max_update_changes=args.max_update_changes,
+        analyzer_workers=args.analyzer_workers,
+        analyzer_timeout=humanfriendly.parse_timespan(args.analyzer_timeout),
+        share_changes=args.share_changes,
+        shared_changes_memory=humanfriendly.parse_size(args.shared_changes_memory),
+        background_training=args.train_in_background,
+        training_workers=args.training_workers,
+        push_debounce=humanfriendly.parse_timespan(args.push_debounce),
+        push_max_delay=humanfriendly.parse_timespan(args.push_max_delay),
     )
-    sys.path = sys.path[:-1]
     log.info("Created %s", manager)
-    listener = EventListener(address=args.server, handlers=manager, n_workers=args.workers)
+    listener = EventListener(address=args.server, handlers=manager, n_workers=args.workers,
+                             options=grpc_options)
     log.info("Created %s", listener)
     listener.start()
     log.info("Listening %s", args.server)
     listener.block()
+    manager.shutdown()
     model_repository.shutdown()
     data_service.shutdown()
+    if async_data_service is not None:
+        async_data_service.shutdown()
 
 
 def init_repo(args: argparse.Namespace):
@@ -132,7 +190,8 @@ def create_model_repo_from_args(args: argparse.Namespace) -> SQLAlchemyModelRepo
         db_endpoint=args.db, fs_root=args.fs,
         max_cache_mem=humanfriendly.parse_size(args.cache_size),
         ttl=int(humanfriendly.parse_timespan(args.cache_ttl)),
-        engine_kwargs=args.db_kwargs)
+        engine_kwargs=args.db_kwargs,
+        training_lock_ttl=int(humanfriendly.parse_timespan(args.training_lock_ttl)))
 
 
 def add_model_repository_args(parser):
@@ -150,6 +209,11 @@ def add_model_repository_args(parser):
                     "values like 30min, 4h, 1d.")
     parser.add("--db-kwargs", type=json.loads, default={},
                help="Additional keyword arguments to SQLAlchemy database engine.")
+    parser.add("--training-lock-ttl", default="0",
+               help="Lock the trainings in the database so that the processes which share it do "
+                    "not train the same model twice. The lock of a crashed process expires "
+                    "after this time - accepts human-readable values like 1h, 1d. 0 disables "
+                    "the locks.")
 
 
 def add_analyzer_arg(parser):
@@ -194,6 +258,98 @@ def create_parser() -> configargparse.ArgParser:
     add_model_repository_args(run_parser)
     run_parser.add_argument("--request-server", default="auto",
                             help="Address of the data retrieval service. \"same\" means --server.")
+    run_parser.add("--unicode-workers", type=int, default=0,
+                   help="Number of processes which convert the requested files to Unicode in "
+                        "parallel. 0 disables the parallel conversion.")
+    run_parser.add("--unicode-cache-size", default="0",
+                   help="Maximum size of the cache of the files converted to Unicode - accepts "
+                        "human-readable values like 200M, 2G. 0 disables the cache.")
+    run_parser.add("--prefetch-size", default="64MiB",
+                   help="Maximum size of the messages which are prefetched from each data stream "
+                        "by the analyzers which enable prefetching - accepts human-readable "
+                        "values like 200M, 2G. 0 means unlimited.")
+    run_parser.add("--data-cache-dir",
+                   help="Directory of the persistent cache of the data retrieval service "
+                        "responses. The cache is disabled if not specified.")
+    run_parser.add("--data-cache-size", default="4G",
+                   help="Maximum disk size of the persistent cache of the data retrieval service "
+                        "responses - accepts human-readable values like 200M, 2G.")
+    run_parser.add("--channel-pool-size", type=int, default=DataService.DEFAULT_CHANNEL_POOL_SIZE,
+                   help="Maximum number of connections to the data retrieval service which are "
+                        "shared by all the workers.")
+    run_parser.add("--channel-pool-policy", default=ChannelPool.LEAST_LOADED,
+                   choices=ChannelPool.POLICIES,
+                   help="How to distribute the workers among the connections to the data "
+                        "retrieval service.")
+    run_parser.add("--channel-idle-timeout", default="5min",
+                   help="Close the connections to the data retrieval service which stay unused "
+                        "for this time - accepts human-readable values like 30s, 5min. 0 "
+                        "disables closing.")
+    run_parser.add("--channel-keepalive-time", default="5min",
+                   help="Interval between the keepalive pings which detect dead connections to "
+                        "the data retrieval service - accepts human-readable values like 30s, "
+                        "5min. 0 disables the pings. Lookout rejects pings more frequent than "
+                        "every 5 minutes by default.")
+    run_parser.add("--grpc-compression", default="none", choices=list(COMPRESSION_ALGORITHMS),
+                   help="Compress the messages sent to Lookout and to the data retrieval "
+                        "service. It saves the network bandwidth at the cost of CPU time.")
+    run_parser.add("--grpc-max-message-size", default="100MiB",
+                   help="Maximum size of a sent or received gRPC message - accepts "
+                        "human-readable values like 64M, 1G.")
+    run_parser.add("--grpc-window-size", default="0",
+                   help="Size of the HTTP/2 flow control window of each gRPC stream - accepts "
+                        "human-readable values like 1M, 16M. 0 lets gRPC tune it automatically.")
+    run_parser.add("--stream-retries", type=int, default=DataService.DEFAULT_STREAM_RETRIES,
+                   help="Maximum number of times to resume each data stream after transient "
+                        "network failures. 0 disables resuming.")
+    run_parser.add("--stream-retry-backoff", default="1s",
+                   help="Delay before resuming a data stream for the first time, it doubles "
+                        "with each retry - accepts human-readable values like 500ms, 2s.")
+    run_parser.add("--measure-stream-bytes", action="store_true",
+                   help="Report the serialized size of the received and the dropped files and "
+                        "changes in the DataService.files.* and DataService.changes.* metrics.")
+    run_parser.add("--max-update-changes", type=int,
+                   default=AnalyzerManager.DEFAULT_MAX_UPDATE_CHANGES,
+                   help="Update the models incrementally on push events if the analyzer supports "
+                        "it and at most this number of files changed since the model's "
+                        "revision. 0 disables the incremental updates.")
+    run_parser.add("--analyzer-workers", type=int, default=0,
+                   help="Number of threads which run the analyzers of each review event "
+                        "concurrently. A failed analyzer does not fail the whole review then. 0 "
+                        "runs the analyzers one after another.")
+    run_parser.add("--analyzer-timeout", default="0",
+                   help="Drop the comments of the analyzers which did not finish a review event "
+                        "in this time - accepts human-readable values like 30s, 5min. 0 means "
+                        "no timeout. Requires --analyzer-workers.")
+    run_parser.add("--share-changes", action="store_true",
+                   help="Fetch the changes of each review event once for all the analyzers "
+                        "instead of once per analyzer.")
+    run_parser.add("--shared-changes-memory", default="256M",
+                   help="Maximum size of the shared changes to keep in memory, the rest are "
+                        "written to a temporary file - accepts human-readable values like "
+                        "64M, 1G.")
+    run_parser.add("--train-in-background", action="store_true",
+                   help="Do not wait for the missing models on review events: train them in "
+                        "the background and review with the analyzers' untrained_fallback or "
+                        "without comments meanwhile.")
+    run_parser.add("--training-workers", type=int, default=1,
+                   help="Number of threads which train the models in the background. Requires "
+                        "--train-in-background or --push-debounce.")
+    run_parser.add("--push-debounce", default="0",
+                   help="Acknowledge push events immediately and train after no more pushes to "
+                        "the same repository arrive for this time, at the newest commit - "
+                        "accepts human-readable values like 30s, 5min. 0 trains on each push "
+                        "event before answering.")
+    run_parser.add("--push-max-delay", default="0",
+                   help="Train at most this time after the oldest pending push event of the "
+                        "repository even if the pushes keep arriving - accepts human-readable "
+                        "values like 10min, 1h. 0 means unlimited. Requires --push-debounce.")
+    run_parser.add("--check-bblfsh-drivers", action="store_true",
+                   help="Ensure that the installed Babelfish drivers satisfy the analyzers' "
+                        "requirements before starting.")
+    run_parser.add("--bblfsh-drivers-ttl", default="10min",
+                   help="How long to cache the versions of the installed Babelfish drivers - "
+                        "accepts human-readable values like 30s, 1h.")
 
     init_parser = add_parser("init", "Initialize the model repository.")
     init_parser.set_defaults(handler=init_repo)
@@ -0,0 +1,557 @@
+"""Persistent content-addressed cache of the DataService responses."""
+from collections import OrderedDict
+import glob
+import hashlib
+import itertools
+import logging
+import mmap
+import os
+import sqlite3
+import threading
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from lookout.core.api.service_data_pb2 import Change, ChangesRequest, File, FilesRequest
+from lookout.core.api.service_data_pb2_grpc import DataStub
+from lookout.core.metrics import record_event
+
+
+class BlobStore:
+    """
+    Append-only content-addressed storage of binary blobs on disk.
+
+    The blobs are appended to segment files and read through `mmap`. Their locations are \
+    indexed in SQLite. When the total size exceeds the limit, the oldest segment is deleted \
+    together with all the blobs which it contains. The instance is thread safe, however, \
+    the same directory must not be used by several processes at once.
+    """
+
+    INDEX_NAME = "index.sqlite"
+    SEGMENT_SUFFIX = ".seg"
+    SEGMENTS_NUMBER = 16
+    _log = logging.getLogger("BlobStore")
+
+    def __init__(self, directory: str, max_size: int):
+        """
+        Initialize a new instance of `BlobStore` and load the existing index.
+
+        :param directory: Directory with the segments and the index. Created if it does not exist.
+        :param max_size: Maximum total size of the segments (in bytes).
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_size = max_size
+        self.segment_size = max(max_size // self.SEGMENTS_NUMBER, 1)
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(os.path.join(directory, self.INDEX_NAME),
+                                   check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._create_tables()
+        self._maps = {}
+        self._segments = sorted(
+            int(os.path.basename(path)[:-len(self.SEGMENT_SUFFIX)])
+            for path in glob.glob(os.path.join(directory, "*" + self.SEGMENT_SUFFIX)))
+        self.size = sum(os.path.getsize(self._segment_path(s)) for s in self._segments)
+        if not self._segments:
+            self._segments.append(0)
+        self._tail = open(self._segment_path(self._segments[-1]), "ab")
+        self._tail_size = self._tail.tell()
+        self._log.info("Opened %s with %d segments, %d bytes", directory, len(self._segments),
+                       self.size)
+
+    def __str__(self):
+        """Summarize the BlobStore instance as a string."""
+        return "%s(%s, %d/%d bytes)" % (type(self).__name__, self.directory, self.size,
+                                        self.max_size)
+
+    def __contains__(self, digest: bytes) -> bool:
+        """Check whether the blob with the specified digest exists."""
+        with self._lock:
+            return self._locate(digest) is not None
+
+    def put(self, data: bytes) -> bytes:
+        """
+        Store the blob unless it already exists.
+
+        :param data: Blob to store.
+        :return: SHA-1 digest of the blob which serves as its key.
+        """
+        digest = hashlib.sha1(data).digest()
+        with self._lock:
+            if self._locate(digest) is not None:
+                return digest
+            if self._tail_size > 0 and self._tail_size + len(data) > self.segment_size:
+                self._new_segment()
+            self._tail.write(data)
+            self._db.execute("INSERT INTO blobs VALUES (?, ?, ?, ?)",
+                             (digest, self._segments[-1], self._tail_size, len(data)))
+            self._tail_size += len(data)
+            self.size += len(data)
+            while self.size > self.max_size and len(self._segments) > 1:
+                self._evict()
+        return digest
+
+    def get(self, digest: bytes) -> Optional[bytes]:
+        """
+        Read the blob.
+
+        :param digest: Key returned by `put()`.
+        :return: The blob or None if it does not exist.
+        """
+        with self._lock:
+            location = self._locate(digest)
+            if location is None:
+                return None
+            segment, offset, size = location
+            if size == 0:
+                return b""
+            end = offset + size
+            view = self._maps.get(segment)
+            if view is None or len(view) < end:
+                if segment == self._segments[-1]:
+                    self._tail.flush()
+                if view is not None:
+                    view.close()
+                with open(self._segment_path(segment), "rb") as fobj:
+                    self._maps[segment] = view = mmap.mmap(
+                        fobj.fileno(), 0, access=mmap.ACCESS_READ)
+            return view[offset:end]
+
+    def flush(self):
+        """
+        Write the buffered blobs to disk and commit the index.
+        """
+        with self._lock:
+            self._tail.flush()
+            self._db.commit()
+
+    def close(self):
+        """
+        Flush and release all the resources.
+        """
+        with self._lock:
+            self.flush()
+            self._tail.close()
+            for view in self._maps.values():
+                view.close()
+            self._maps.clear()
+            self._db.close()
+
+    def _create_tables(self):
+        self._db.execute("CREATE TABLE IF NOT EXISTS blobs (digest BLOB PRIMARY KEY, "
+                         "segment INTEGER, offset INTEGER, size INTEGER)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS blobs_segment ON blobs (segment)")
+
+    def _locate(self, digest: bytes) -> Optional[Sequence[int]]:
+        return self._db.execute("SELECT segment, offset, size FROM blobs WHERE digest = ?",
+                                (digest,)).fetchone()
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, "%08d%s" % (segment, self.SEGMENT_SUFFIX))
+
+    def _new_segment(self):
+        self._tail.close()
+        self._segments.append(self._segments[-1] + 1)
+        self._tail = open(self._segment_path(self._segments[-1]), "ab")
+        self._tail_size = 0
+
+    def _evict(self):
+        segment = self._segments.pop(0)
+        view = self._maps.pop(segment, None)
+        if view is not None:
+            view.close()
+        path = self._segment_path(segment)
+        self.size -= os.path.getsize(path)
+        os.remove(path)
+        self._db.execute("DELETE FROM blobs WHERE segment = ?", (segment,))
+        self._log.debug("evicted segment %d", segment)
+
+
+class DataCache(BlobStore):
+    """
+    Stores the `File`-s and the `Change`-s returned by DataService in `BlobStore`.
+
+    The serialized files are content-addressed, so the same file which belongs to different \
+    revisions or responses is stored only once. Each complete response is indexed by its \
+    request; each file is indexed by its Git blob hash and the requested fields, so that \
+    the unchanged files can be reused in the responses for other revisions.
+    """
+
+    def put_response(self, request: Union[FilesRequest, ChangesRequest], digests: List[bytes]):
+        """
+        Index the complete response to the request.
+
+        :param request: `GetFiles` or `GetChanges` request.
+        :param digests: Keys of the serialized `File`-s in the response. There are two keys \
+                        per `Change`: base and head.
+        """
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?)",
+                             (self.request_key(request), b"".join(digests)))
+            self.flush()
+        record_event("DataCache.size", self.size)
+
+    def get_response(self, request: Union[FilesRequest, ChangesRequest],
+                     ) -> Optional[List[bytes]]:
+        """
+        Look up the response to the request.
+
+        :param request: `GetFiles` or `GetChanges` request.
+        :return: Keys of the serialized `File`-s or None if the response is not cached or \
+                 some of the files have been evicted.
+        """
+        key = self.request_key(request)
+        with self._lock:
+            row = self._db.execute("SELECT digests FROM responses WHERE request = ?",
+                                   (key,)).fetchone()
+            if row is not None:
+                digests = [row[0][i:i + 20] for i in range(0, len(row[0]), 20)]
+                if all(digest in self for digest in digests):
+                    record_event("DataCache.hit", 1)
+                    return digests
+                self._db.execute("DELETE FROM responses WHERE request = ?", (key,))
+        record_event("DataCache.miss", 1)
+        return None
+
+    def put_file(self, file: File, flags: Optional[int] = None) -> bytes:
+        """
+        Store the serialized file.
+
+        :param file: `File` to store.
+        :param flags: Requested fields, see `request_flags()`. If specified, the file is \
+                      indexed by its Git blob hash for `find_file()`.
+        :return: Key of the stored file.
+        """
+        digest = self.put(file.SerializeToString(deterministic=True))
+        if flags is not None and file.hash:
+            with self._lock:
+                self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                                 (file.hash, flags, file.path, digest))
+        return digest
+
+    def find_file(self, blob_hash: str, flags: int, path: Optional[str] = None,
+                  ) -> Optional[bytes]:
+        """
+        Look up the file with the specified Git blob hash in any revision.
+
+        :param blob_hash: `File.hash` - Git blob hash.
+        :param flags: Requested fields, see `request_flags()`.
+        :param path: Path which the file must have. None matches any path.
+        :return: Key of the stored file or None if it is not cached or has been evicted.
+        """
+        if not blob_hash:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT path, digest FROM files WHERE hash = ? AND flags = ?",
+                                   (blob_hash, flags)).fetchone()
+            if row is None or (path is not None and row[0] != path):
+                return None
+            if row[1] not in self:
+                # the segment has been evicted
+                self._db.execute("DELETE FROM files WHERE hash = ? AND flags = ?",
+                                 (blob_hash, flags))
+                return None
+            return row[1]
+
+    def load_file(self, digest: bytes) -> File:
+        """
+        Read and parse the stored file.
+
+        :param digest: Key returned by `put_file()`.
+        :return: `File`.
+        :raise KeyError: if the file has been evicted.
+        """
+        data = self.get(digest)
+        if data is None:
+            raise KeyError(digest)
+        return File.FromString(data)
+
+    @staticmethod
+    def request_key(request: Union[FilesRequest, ChangesRequest]) -> bytes:
+        """
+        Calculate the key of the request.
+
+        :param request: `GetFiles` or `GetChanges` request.
+        :return: SHA-1 digest of the request type and its serialized fields.
+        """
+        key = hashlib.sha1(type(request).__name__.encode())
+        key.update(request.SerializeToString(deterministic=True))
+        return key.digest()
+
+    @staticmethod
+    def request_flags(request: Union[FilesRequest, ChangesRequest]) -> int:
+        """
+        Encode the fields which the request asks for.
+
+        :param request: `GetFiles` or `GetChanges` request.
+        :return: Bit mask of `want_contents`, `want_uast` and `want_language`.
+        """
+        return int(request.want_contents) | int(request.want_uast) << 1 | \
+            int(request.want_language) << 2
+
+    def _create_tables(self):
+        super()._create_tables()
+        self._db.execute("CREATE TABLE IF NOT EXISTS responses (request BLOB PRIMARY KEY, "
+                         "digests BLOB)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS files (hash TEXT, flags INTEGER, "
+                         "path TEXT, digest BLOB, PRIMARY KEY (hash, flags))")
+
+
+class CachingDataStub:
+    """
+    Wraps `DataStub` and serves the repeated requests from `DataCache` without touching \
+    the network.
+
+    Only the requests which point to specific commits are cached. The responses are recorded \
+    while they are streamed and indexed after they are completely consumed. If the response \
+    is not cached, the files are listed without the contents and UASTs first, the files with \
+    the known Git blob hashes are read from the cache and only the rest are fetched.
+    """
+
+    def __init__(self, stub: DataStub, cache: DataCache):
+        """
+        Initialize a new instance of `CachingDataStub`.
+
+        :param stub: `DataStub` to wrap.
+        :param cache: Cache of the responses.
+        """
+        self._stub = stub
+        self._cache = cache
+
+    def GetFiles(self, request: FilesRequest, *args, **kwargs) -> Iterator[File]:  # noqa: N802
+        """Return the files from the cache or invoke `DataStub.GetFiles` and record them."""
+        if not request.revision.hash:
+            return self._stub.GetFiles(request, *args, **kwargs)
+        digests = self._cache.get_response(request)
+        if digests is not None:
+            return _CachedStream(digests, self._cache.load_file,
+                                 lambda: self._stub.GetFiles(request, *args, **kwargs))
+        if request.want_contents or request.want_uast:
+            return _AssembledStream(self._stub, self._cache, request, args, kwargs)
+        return _RecordingStream(self._stub.GetFiles(request, *args, **kwargs), request,
+                                self._cache)
+
+    def GetChanges(self, request: ChangesRequest, *args,  # noqa: N802
+                   **kwargs) -> Iterator[Change]:
+        """Return the changes from the cache or invoke `DataStub.GetChanges` and record them."""
+        if not request.base.hash or not request.head.hash:
+            return self._stub.GetChanges(request, *args, **kwargs)
+        digests = self._cache.get_response(request)
+        if digests is not None:
+            load_file = self._cache.load_file
+            return _CachedStream(
+                list(zip(digests[::2], digests[1::2])),
+                lambda pair: Change(base=load_file(pair[0]), head=load_file(pair[1])),
+                lambda: self._stub.GetChanges(request, *args, **kwargs))
+        if request.want_contents or request.want_uast:
+            return _AssembledStream(self._stub, self._cache, request, args, kwargs)
+        return _RecordingStream(self._stub.GetChanges(request, *args, **kwargs), request,
+                                self._cache)
+
+    def __getattr__(self, item):
+        """Forward the other calls to the wrapped `DataStub`."""
+        return getattr(self._stub, item)
+
+
+class _CachedStream:
+    _log = logging.getLogger("DataCache")
+
+    def __init__(self, keys: Sequence, load: Callable[[Any], Any],
+                 fetch: Callable[[], Iterator]):
+        self._keys = keys
+        self._load = load
+        self._fetch = fetch
+        self._index = 0
+        self._fallback = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._fallback is None:
+            if self._index >= len(self._keys):
+                raise StopIteration
+            try:
+                message = self._load(self._keys[self._index])
+            except KeyError:
+                # evicted by a concurrent writer after the lookup
+                self._log.warning("evicted while reading, fetching the rest from the network")
+                self._fallback = self._fetch()
+                self._iterator = itertools.islice(self._fallback, self._index, None)
+            else:
+                self._index += 1
+                return message
+        return next(self._iterator)
+
+    def cancel(self):
+        cancel = getattr(self._fallback, "cancel", None)
+        if cancel is not None:
+            cancel()
+
+
+class _RecordingStream:
+    def __init__(self, stream: Iterable, request: Union[FilesRequest, ChangesRequest],
+                 cache: DataCache):
+        self._stream = stream
+        self._iterator = iter(stream)
+        self._request = request
+        self._cache = cache
+        self._digests = []
+        self._flags = cache.request_flags(request)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            message = next(self._iterator)
+        except StopIteration:
+            self._cache.put_response(self._request, self._digests)
+            raise
+        put_file, flags = self._cache.put_file, self._flags
+        if isinstance(message, Change):
+            self._digests.append(put_file(message.base, flags))
+            self._digests.append(put_file(message.head, flags))
+        else:
+            self._digests.append(put_file(message, flags))
+        return message
+
+    def cancel(self):
+        cancel = getattr(self._stream, "cancel", None)
+        if cancel is not None:
+            cancel()
+
+
+class _AssembledStream:
+    """
+    Lists the files without the contents and UASTs, reads the files with the known Git blob \
+    hashes from the cache and fetches only the rest by their paths.
+    """
+
+    FETCH_BATCH_SIZE = 500
+    _log = logging.getLogger("DataCache")
+
+    def __init__(self, stub: DataStub, cache: DataCache,
+                 request: Union[FilesRequest, ChangesRequest], args: tuple, kwargs: dict):
+        self._stub = stub
+        self._cache = cache
+        self._request = request
+        self._args = args
+        self._kwargs = kwargs
+        self._flags = cache.request_flags(request)
+        self._streams = []
+        self._iterator = None
+        self._taken = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # the RPCs start on the first read, the same as with the network streams
+        if self._iterator is None:
+            self._iterator = self._assemble()
+        return next(self._iterator)
+
+    def cancel(self):
+        for stream in self._streams:
+            cancel = getattr(stream, "cancel", None)
+            if cancel is not None:
+                cancel()
+
+    def _assemble(self) -> Iterator:
+        request, cache, flags = self._request, self._cache, self._flags
+        changes = isinstance(request, ChangesRequest)
+        method = self._stub.GetChanges if changes else self._stub.GetFiles
+        list_request = type(request)()
+        list_request.CopyFrom(request)
+        list_request.want_contents = list_request.want_uast = False
+        listing = list(self._open(method, list_request))
+        if changes:
+            sides = [(revision, file) for change in listing for revision, file in
+                     zip((request.base, request.head), (change.base, change.head))]
+        else:
+            sides = [(request.revision, file) for file in listing]
+        # the UAST depends on the language which is detected by the file name
+        digests = [cache.find_file(file.hash, flags, file.path if request.want_uast else None)
+                   if file.path else None for _, file in sides]
+        missing = OrderedDict()
+        for (revision, file), digest in zip(sides, digests):
+            if file.path and digest is None:
+                missing.setdefault(revision.hash, (revision, []))[1].append(file.path)
+        files_count = sum(1 for _, file in sides if file.path)
+        missing_count = sum(len(paths) for _, paths in missing.values())
+        record_event("DataCache.files.reused", files_count - missing_count)
+        record_event("DataCache.files.fetched", missing_count)
+        if 0 < missing_count == files_count:
+            # nothing to reuse, so avoid matching the paths on the server
+            yield from _RecordingStream(self._open(method, request), request, cache)
+            return
+        fetched = {commit: self._fetch(revision, paths)
+                   for commit, (revision, paths) in missing.items()}
+        buffered = {}
+        response = []
+        step = 2 if changes else 1
+        for i in range(0, len(sides), step):
+            loaded = [self._load(revision, listed, digest, fetched, buffered)
+                      for (revision, listed), digest in zip(sides[i:i + step],
+                                                            digests[i:i + step])]
+            if None in loaded:
+                continue
+            response.extend(digest for _, digest in loaded)
+            files = [file for file, _ in loaded]
+            yield Change(base=files[0], head=files[1]) if changes else files[0]
+        if len(response) == len(sides):
+            cache.put_response(request, response)
+
+    def _load(self, revision: Any, listed: File, digest: Optional[bytes], fetched: dict,
+              buffered: dict) -> Optional[Tuple[File, bytes]]:
+        if not listed.path:
+            file = listed
+        elif digest is not None:
+            try:
+                file = self._cache.load_file(digest)
+            except KeyError:
+                self._log.warning("%s was evicted while reading, fetching it again",
+                                  listed.path)
+                file, digest = next(self._fetch(revision, [listed.path]), None), None
+        else:
+            file = self._take(fetched[revision.hash], buffered, revision.hash, listed.path)
+        if file is None:
+            self._log.warning("%s was not found in %s, dropped from the response",
+                              listed.path, revision.hash)
+            return None
+        if digest is None or (file.path, file.mode, file.language) != \
+                (listed.path, listed.mode, listed.language):
+            file.path, file.mode, file.language = listed.path, listed.mode, listed.language
+            digest = self._cache.put_file(file, self._flags)
+        return file, digest
+
+    def _fetch(self, revision: Any, paths: Sequence[str]) -> Iterator[File]:
+        # data_requests imports this module
+        from lookout.core.data_requests import make_paths_pattern
+        request = self._request
+        for i in range(0, len(paths), self.FETCH_BATCH_SIZE):
+            yield from self._open(self._stub.GetFiles, FilesRequest(
+                revision=revision, include_pattern=make_paths_pattern(
+                    paths[i:i + self.FETCH_BATCH_SIZE]),
+                want_contents=request.want_contents, want_uast=request.want_uast,
+                want_language=request.want_language))
+
+    def _take(self, files: Iterator[File], buffered: dict, commit: str,
+              path: str) -> Optional[File]:
+        key = commit, path
+        if self._taken is not None and self._taken[0] == key:
+            # both sides of the change point to the same file
+            return self._taken[1]
+        while key not in buffered:
+            file = next(files, None)
+            if file is None:
+                return None
+            buffered[commit, file.path] = file
+        self._taken = key, buffered.pop(key)
+        return self._taken[1]
+
+    def _open(self, method: Callable, request: Union[FilesRequest, ChangesRequest]) -> Iterable:
+        stream = method(request, *self._args, **self._kwargs)
+        self._streams.append(stream)
+        return stream
@@ -1,22 +1,33 @@
+from collections import deque
+from concurrent.futures import Executor, FIRST_COMPLETED, Future, ProcessPoolExecutor, \
+    ThreadPoolExecutor, wait
 import functools
 import logging
+import multiprocessing
 import os
+import sys
 import threading
-from typing import Iterable, Iterator, Optional, Tuple
+import time
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, NamedTuple, \
+    Optional, Sequence, Tuple, TYPE_CHECKING, Union
 
 import bblfsh
 import grpc
-from lookout.sdk.grpc import create_channel
 from packaging.requirements import Requirement
 from packaging.version import Version
 
-from lookout.core.analyzer import Analyzer, AnalyzerModel, ReferencePointer
+from lookout.core.analyzer import Analyzer, AnalyzerModel, ReferencePointer, UnicodeFile
 from lookout.core.api.service_analyzer_pb2 import Comment
 from lookout.core.api.service_data_pb2 import Change, ChangesRequest, File, FilesRequest
 from lookout.core.api.service_data_pb2_grpc import DataStub
-from lookout.core.bytes_to_unicode_converter import BytesToUnicodeConverter
+from lookout.core.bytes_to_unicode_converter import BytesToUnicodeConverter, UnicodeFileCache
+from lookout.core.channel_pool import ChannelPool, PooledChannel
+from lookout.core.data_cache import CachingDataStub, DataCache
 from lookout.core.garbage_exclusion import GARBAGE_PATTERN
+from lookout.core.metrics import record_event
 from lookout.core.ports import Type
+if TYPE_CHECKING:
+    from lookout.core.shared_changes import SharedChanges  # noqa: F401
 
 
 class UnsatisfiedDriverVersionError(Exception):
@@ -29,6 +40,502 @@ class UnsatisfiedDriverVersionError(Exception):
         self.args += tuple(mismatched)
 
 
+class UnicodeConversionPool:
+    """
+    Converts the streamed `File`-s or `Change`-s to Unicode in parallel processes.
+
+    The order of the stream is preserved. At most `window` items are being converted ahead of \
+    the consumer.
+    """
+
+    _log = logging.getLogger("UnicodeConversionPool")
+
+    def __init__(self, workers: int, window: int = 0, executor: Optional[Executor] = None):
+        """
+        Initialize a new instance of `UnicodeConversionPool`.
+
+        :param workers: Number of worker processes.
+        :param window: Maximum number of items which are submitted but not yet consumed. \
+                       0 means twice the number of workers.
+        :param executor: Executor to use instead of the default `ProcessPoolExecutor`. \
+                         It is not shut down by `shutdown()`.
+        """
+        self.workers = workers
+        self.window = window or 2 * workers
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._executor_lock = threading.Lock()
+        if self._owns_executor and sys.version_info < (3, 7):
+            # the workers can only be forked, which is unsafe after gRPC has started its
+            # threads, so we fork them right away - before the first channel is created
+            self._get_executor().submit(int).result()
+
+    def __str__(self):
+        """Summarize the UnicodeConversionPool instance as a string."""
+        return "UnicodeConversionPool(%d workers, window %d)" % (self.workers, self.window)
+
+    def map(self, func: Callable[[Any], Any], items: Iterable,
+            cache: Optional[UnicodeFileCache] = None) -> Iterator:
+        """
+        Lazily apply the function to each item in parallel and yield the results in order.
+
+        :param func: Function to apply. Must be picklable if the executor is a process pool.
+        :param items: Items to process, typically a gRPC stream.
+        :param cache: Cache of the converted files which is checked before submitting an item \
+                      and updated with the computed results.
+        :return: Iterator over the results.
+        """
+        executor = self._get_executor()
+        pending = deque()
+
+        def pop():
+            key, future, cached = pending.popleft()
+            result = future.result()
+            if cache is not None and not cached:
+                result = cache.store(key, result)
+            return result
+
+        try:
+            for item in items:
+                key, result = cache.lookup(item) if cache is not None else (None, None)
+                if result is not None:
+                    future = Future()
+                    future.set_result(result)
+                else:
+                    future = executor.submit(func, item)
+                pending.append((key, future, result is not None))
+                if len(pending) >= self.window:
+                    yield pop()
+            while pending:
+                yield pop()
+        finally:
+            for _, future, _ in pending:
+                future.cancel()
+
+    def shutdown(self):
+        """
+        Stop the worker processes.
+        """
+        with self._executor_lock:
+            if self._owns_executor and self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _get_executor(self) -> Executor:
+        with self._executor_lock:
+            if self._executor is None:
+                if sys.version_info >= (3, 7):
+                    # forked children may deadlock in gRPC, spawned ones start clean
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+                else:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._log.info("Started %d workers", self.workers)
+            return self._executor
+
+
+class StreamPrefetcher:
+    """
+    Drains a gRPC stream in a background thread so that receiving and parsing the next \
+    messages overlaps with processing the current one.
+
+    The prefetched messages are kept in a buffer which is bounded both by the number of \
+    messages and by their total size. A message which exceeds the size budget is still \
+    accepted when the buffer is empty. The errors raised by the stream are re-raised to the \
+    consumer after all the messages received before them.
+    """
+
+    def __init__(self, stream: Iterable, size: int, max_bytes: int = 0):
+        """
+        Initialize a new instance of `StreamPrefetcher` and start draining the stream.
+
+        :param stream: Stream to prefetch, typically returned by `GetChanges` or `GetFiles`.
+        :param size: Maximum number of prefetched messages.
+        :param max_bytes: Maximum total serialized size of the prefetched messages. \
+                          0 means unlimited.
+        """
+        self._stream = stream
+        # the thread must not reference self, otherwise __del__ is never called
+        self._buffer = buffer = _PrefetchBuffer(size, max_bytes)
+        self._thread = threading.Thread(target=buffer.fill, args=(iter(stream),),
+                                        name="StreamPrefetcher", daemon=True)
+        self._thread.start()
+
+    def __iter__(self) -> Iterator:
+        """Return self."""
+        return self
+
+    def __next__(self):
+        """Return the next prefetched message, wait if there is none yet."""
+        return self._buffer.get()
+
+    def __del__(self):
+        """Stop prefetching when the consumer disappears."""
+        self.close()
+
+    def close(self):
+        """
+        Stop prefetching and cancel the stream. Does nothing if the stream has been drained.
+        """
+        if self._buffer.close():
+            cancel = getattr(self._stream, "cancel", None)
+            if cancel is not None:
+                cancel()
+
+
+class _PrefetchBuffer:
+    def __init__(self, size: int, max_bytes: int):
+        self.size = max(size, 1)
+        self.max_bytes = max_bytes
+        self.items = deque()
+        self.bytes = 0
+        self.error = None
+        self.finished = False
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def fill(self, stream: Iterator):
+        try:
+            for item in stream:
+                nbytes = item.ByteSize() if self.max_bytes > 0 else 0
+                with self.condition:
+                    while not self.closed and self.items and (
+                            len(self.items) >= self.size or
+                            self.bytes + nbytes > self.max_bytes > 0):
+                        self.condition.wait()
+                    if self.closed:
+                        return
+                    self.items.append((item, nbytes))
+                    self.bytes += nbytes
+                    self.condition.notify_all()
+        except Exception as e:
+            with self.condition:
+                self.error = e
+        finally:
+            with self.condition:
+                self.finished = True
+                self.condition.notify_all()
+
+    def get(self):
+        with self.condition:
+            while not self.items and not self.finished:
+                self.condition.wait()
+            if self.items:
+                item, nbytes = self.items.popleft()
+                self.bytes -= nbytes
+                self.condition.notify_all()
+                return item
+            error, self.error = self.error, None
+            if error is not None:
+                raise error
+            raise StopIteration
+
+    def close(self) -> bool:
+        with self.condition:
+            active = not self.finished and not self.closed
+            self.closed = True
+            self.items.clear()
+            self.bytes = 0
+            self.condition.notify_all()
+        return active
+
+
+class ResumableStream:
+    """
+    Iterates over a gRPC stream and reopens it after transient RPC failures.
+
+    The messages which were delivered before the failure are skipped in the reopened stream, \
+    so the consumer sees each message exactly once. The messages are identified by their keys, \
+    e.g. the file paths, hence the order of the reopened stream does not matter.
+    """
+
+    TRANSIENT_CODES = frozenset((grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED,
+                                 grpc.StatusCode.ABORTED, grpc.StatusCode.RESOURCE_EXHAUSTED))
+    _log = logging.getLogger("ResumableStream")
+
+    def __init__(self, stream: Iterable, reopen: Callable[[], Iterable],
+                 key: Callable[[Any], Hashable], retries: int, backoff: float):
+        """
+        Initialize a new instance of `ResumableStream`.
+
+        :param stream: Stream to iterate, typically returned by `GetChanges` or `GetFiles`.
+        :param reopen: Function without arguments which sends the same request again and \
+                       returns the new stream.
+        :param key: Function which returns the unique key of a message.
+        :param retries: Maximum number of times to reopen the stream.
+        :param backoff: Number of seconds to wait before reopening the stream for the first \
+                        time. The delay doubles with each retry.
+        """
+        self._stream = stream
+        self._iterator = iter(stream)
+        self._reopen = reopen
+        self._key = key
+        self._retries = retries
+        self._backoff = backoff
+        self._attempt = 0
+        self._delivered = set()
+
+    def __iter__(self) -> Iterator:
+        """Return self."""
+        return self
+
+    def __next__(self):
+        """Return the next message which has not been delivered yet."""
+        while True:
+            try:
+                item = next(self._iterator)
+            except grpc.RpcError as e:
+                if self._attempt >= self._retries or not self.is_transient(e):
+                    raise e from None
+                self._resume(e)
+                continue
+            key = self._key(item)
+            if key not in self._delivered:
+                self._delivered.add(key)
+                return item
+
+    def cancel(self):
+        """
+        Cancel the current underlying stream.
+        """
+        cancel = getattr(self._stream, "cancel", None) or getattr(self._stream, "close", None)
+        if cancel is not None:
+            cancel()
+
+    @classmethod
+    def is_transient(cls, error: grpc.RpcError) -> bool:
+        """
+        Return the value indicating whether the RPC may succeed if it is sent again.
+        """
+        code = getattr(error, "code", None)
+        return code is not None and code() in cls.TRANSIENT_CODES
+
+    def _resume(self, error: grpc.RpcError):
+        self._attempt += 1
+        delay = self._backoff * 2 ** (self._attempt - 1)
+        self._log.warning("stream failed after %d messages with %s, retry %d/%d in %.1fs",
+                          len(self._delivered), error.code(), self._attempt, self._retries,
+                          delay)
+        record_event("ResumableStream.retry", 1)
+        time.sleep(delay)
+        self._stream = self._reopen()
+        self._iterator = iter(self._stream)
+
+
+class LazyContentFetcher:
+    """
+    Fetches the raw contents of the files at one revision on demand, many files per `GetFiles`.
+
+    The first access to a content which has not been fetched yet requests it together with \
+    the other registered pending paths, so N accesses after registering N paths cost a single \
+    round trip. The paths are not registered automatically: without `register()`, each access \
+    costs a separate round trip. The fetched contents are forgotten as soon as they are taken. \
+    The fetcher is thread safe; the lock is not held during the RPCs.
+    """
+
+    _log = logging.getLogger("LazyContentFetcher")
+
+    def __init__(self, stub: Callable[[], DataStub], ptr: ReferencePointer, batch_size: int,
+                 retries: int = 0, retry_backoff: float = 1,
+                 reconnect: Optional[Callable[[], DataStub]] = None):
+        """
+        Initialize a new instance of `LazyContentFetcher`.
+
+        :param stub: Function which returns the `DataStub` of the current thread.
+        :param ptr: Revision of the files.
+        :param batch_size: Maximum number of files requested at once.
+        :param retries: Maximum number of times to resume each `GetFiles` stream after \
+                        transient RPC failures. 0 disables resuming.
+        :param retry_backoff: Number of seconds to wait before resuming a stream for the first \
+                              time. The delay doubles with each retry.
+        :param reconnect: Function which returns a `DataStub` on a new channel to resume the \
+                          stream. None resumes with `stub()`.
+        """
+        self.ptr = ptr
+        self.batch_size = max(batch_size, 1)
+        self._stub = stub
+        self._retries = retries
+        self._retry_backoff = retry_backoff
+        self._reconnect = reconnect
+        self._pending = {}  # ordered set of the registered paths which are not fetched yet
+        self._contents = {}
+        self._batches = {}  # type: Dict[str, Future]
+        self._unbatched = 0
+        self._lock = threading.Lock()
+
+    def register(self, path: str):
+        """
+        Schedule the content of the file to be fetched with the next batch.
+        """
+        with self._lock:
+            if path not in self._contents and path not in self._batches:
+                self._pending[path] = None
+
+    def get(self, path: str) -> bytes:
+        """
+        Return the raw content of the file and forget it. Fetch it together with up to \
+        `batch_size - 1` other pending files if it has not been fetched yet. If the file is \
+        being fetched by another thread, wait for that batch.
+        """
+        while True:
+            with self._lock:
+                try:
+                    return self._contents.pop(path)
+                except KeyError:
+                    pass
+                batch = self._batches.get(path)
+                if batch is None:
+                    paths = self._take_batch(path)
+                    batch = Future()
+                    for batch_path in paths:
+                        self._batches[batch_path] = batch
+                    break
+            batch.result()
+        try:
+            contents = self._fetch(paths)
+        except BaseException as e:
+            with self._lock:
+                for batch_path in paths:
+                    del self._batches[batch_path]
+            batch.set_exception(e)
+            raise
+        content = contents.pop(path)
+        with self._lock:
+            self._contents.update(contents)
+            for batch_path in paths:
+                del self._batches[batch_path]
+        batch.set_result(None)
+        return content
+
+    def _take_batch(self, path: str) -> List[str]:
+        # the caller holds self._lock
+        self._pending.pop(path, None)
+        batch = [path]
+        for pending in self._pending:
+            if len(batch) >= self.batch_size:
+                break
+            batch.append(pending)
+        for pending in batch[1:]:
+            del self._pending[pending]
+        if len(batch) == 1:
+            self._unbatched += 1
+            if self._unbatched == 2:
+                self._log.warning("fetching the contents one by one at %s, call request() on "
+                                  "the interesting files first to fetch them in batches",
+                                  self.ptr.commit)
+        return batch
+
+    def _fetch(self, paths: Sequence[str]) -> Dict[str, bytes]:
+        files = request_files(self._stub(), self.ptr, contents=True, uast=False, unicode=False,
+                              retries=self._retries, retry_backoff=self._retry_backoff,
+                              reconnect=self._reconnect,
+                              include_pattern=make_paths_pattern(paths))
+        contents = dict.fromkeys(paths, b"")
+        for file in files:
+            if file.path in contents:
+                contents[file.path] = file.content
+        self._log.debug("fetched %d files at %s", len(paths), self.ptr.commit)
+        record_event("LazyContentFetcher.requests", 1)
+        record_event("LazyContentFetcher.files", len(paths))
+        return contents
+
+
+class LazyContentFile:
+    """
+    File from a change stream without the raw content. The content is fetched by \
+    `LazyContentFetcher` on the first access to `content`.
+
+    `request()` marks the content to be fetched with the next batch, so that the contents of \
+    many files are fetched in one round trip. It must be called explicitly: otherwise, each \
+    access to `content` costs a separate `GetFiles`. If `unicode` is True, the file behaves like \
+    `UnicodeFile`. Accessing `uast` fetches the content in that case since it is required to \
+    convert the positions.
+    """
+
+    __slots__ = ("_file", "_fetcher", "_unicode", "_converted", "_lock")
+
+    def __init__(self, file: File, fetcher: LazyContentFetcher, unicode: bool):
+        """
+        Initialize a new instance of `LazyContentFile`.
+
+        :param file: lookout File with the UAST but without the content. It is modified.
+        :param fetcher: Fetcher of the contents at the revision of the file.
+        :param unicode: Value indicating whether `content` and the UAST positions should be \
+                        converted to Unicode.
+        """
+        self._file = file
+        self._fetcher = fetcher
+        self._unicode = unicode
+        self._converted = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        """Return the path of the file."""
+        return self._file.path
+
+    @property
+    def language(self) -> str:
+        """Return the language of the file."""
+        return self._file.language
+
+    @property
+    def content(self) -> Union[bytes, str]:
+        """Return the content of the file, fetch it on the first access."""
+        return self._get().content
+
+    @property
+    def uast(self) -> "bblfsh.Node":
+        """Return the UAST of the file."""
+        if not self._unicode:
+            return self._file.uast
+        return self._get().uast
+
+    def request(self):
+        """
+        Schedule the content to be fetched together with the next accessed content.
+        """
+        fetcher = self._fetcher
+        if fetcher is not None and self._file.path:
+            fetcher.register(self._file.path)
+
+    @property
+    def fetched(self) -> bool:
+        """Return the value indicating whether the content has already been fetched."""
+        return self._fetcher is None
+
+    def __repr__(self) -> str:
+        """Summarize the file as a string."""
+        return "%s(path=%r, language=%r, fetched=%s)" % (
+            type(self).__name__, self.path, self.language, self.fetched)
+
+    def _get(self) -> Union[File, UnicodeFile]:
+        if self._fetcher is None:
+            return self._converted
+        with self._lock:
+            if self._fetcher is not None:
+                if self._file.path:
+                    self._file.content = self._fetcher.get(self._file.path)
+                self._converted = BytesToUnicodeConverter.convert_file(
+                    self._file, inplace=True) if self._unicode else self._file
+                self._fetcher = None
+        return self._converted
+
+
+LazyContentChange = NamedTuple("LazyContentChange", (("base", LazyContentFile),
+                                                     ("head", LazyContentFile)))
+LazyContentChange.__doc__ = """
+Change with `LazyContentFile`-s which is streamed by `with_changed_uasts_and_lazy_contents()`.
+""".strip()
+
+ChangesRequirements = NamedTuple("ChangesRequirements", (("contents", bool), ("uast", bool)))
+ChangesRequirements.__doc__ = """
+Parts of the changes which are requested by `with_changed_uasts()` and the likes. The decorated \
+method exposes them as `changes_requirements`, so that `AnalyzerManager` can fetch the changes \
+once for several analyzers, see `lookout.core.shared_changes`.
+""".strip()
+
+
 class DataService:
     """
     Retrieves UASTs/files from the Lookout server.
@@ -36,15 +543,73 @@ class DataService:
 
     _log = logging.getLogger("DataService")
 
-    def __init__(self, address: str):
+    DEFAULT_PREFETCH_BYTES = 64 << 20
+    DEFAULT_CHANNEL_POOL_SIZE = 4
+    DEFAULT_STREAM_RETRIES = 3
+
+    def __init__(self, address: str, unicode_workers: int = 0, unicode_cache_size: int = 0,
+                 prefetch_bytes: int = DEFAULT_PREFETCH_BYTES, cache_dir: Optional[str] = None,
+                 cache_size: int = 0, channel_pool_size: int = DEFAULT_CHANNEL_POOL_SIZE,
+                 channel_pool_policy: str = ChannelPool.LEAST_LOADED,
+                 channel_idle_timeout: float = 300, channel_keepalive_time: float = 300,
+                 stream_retries: int = DEFAULT_STREAM_RETRIES, stream_retry_backoff: float = 1,
+                 bblfsh_drivers_ttl: float = 600,
+                 channel_options: Optional[Sequence[Tuple[str, Any]]] = None,
+                 measure_stream_bytes: bool = False):
         """
         Initialize a new instance of `DataService`.
 
         :param address: GRPC endpoint to use.
+        :param unicode_workers: Number of processes which convert the requested data to \
+                                Unicode in parallel. 0 disables the parallel conversion.
+        :param unicode_cache_size: Maximum memory size of the cache of the files converted to \
+                                   Unicode (in bytes). 0 disables the cache.
+        :param prefetch_bytes: Maximum total size of the messages which are prefetched from \
+                               each stream by the decorators with `prefetch` > 0 (in bytes). \
+                               0 means unlimited.
+        :param cache_dir: Directory of the persistent cache of the responses. None disables \
+                          the cache.
+        :param cache_size: Maximum disk size of the persistent cache of the responses \
+                           (in bytes).
+        :param channel_pool_size: Maximum number of open channels shared by all the threads.
+        :param channel_pool_policy: How to choose the channel for a thread: "round-robin" or \
+                                    "least-loaded".
+        :param channel_idle_timeout: Number of seconds after which an unused channel is \
+                                     closed. 0 disables closing.
+        :param channel_keepalive_time: Interval between the keepalive pings which detect \
+                                       dead connections in seconds. 0 disables the pings.
+        :param stream_retries: Maximum number of times to resume each stream after transient \
+                               RPC failures. 0 disables resuming.
+        :param stream_retry_backoff: Number of seconds to wait before resuming a stream for \
+                                     the first time. The delay doubles with each retry.
+        :param bblfsh_drivers_ttl: Number of seconds to cache the versions of the Babelfish \
+                                   drivers. 0 disables the cache.
+        :param channel_options: Additional gRPC channel options, e.g. the compression, see \
+                                `lookout.core.grpc_options.make_grpc_options()`.
+        :param measure_stream_bytes: Value indicating whether the decorators report the \
+                                     serialized size of the received and the dropped \
+                                     messages. Measuring costs a traversal of every message.
         """
         self._data_request_local = threading.local()
-        self._data_request_channels = []
         self._data_request_address = address
+        self._channel_pool = ChannelPool(
+            address, channel_pool_size, policy=channel_pool_policy,
+            idle_timeout=channel_idle_timeout, keepalive_time=channel_keepalive_time,
+            options=channel_options)
+        self.unicode_pool = UnicodeConversionPool(unicode_workers) \
+            if unicode_workers > 0 else None
+        self.unicode_cache = UnicodeFileCache(unicode_cache_size) \
+            if unicode_cache_size > 0 else None
+        self.prefetch_bytes = prefetch_bytes
+        self.data_cache = DataCache(cache_dir, cache_size) \
+            if cache_dir is not None and cache_size > 0 else None
+        self.stream_retries = stream_retries
+        self.stream_retry_backoff = stream_retry_backoff
+        self.measure_stream_bytes = measure_stream_bytes
+        self._bblfsh_drivers_ttl = bblfsh_drivers_ttl
+        self._bblfsh_drivers = None
+        self._bblfsh_drivers_expire = 0.0
+        self._bblfsh_drivers_lock = threading.Lock()
 
     def __str__(self):
         """Summarize the DataService instance as a string."""
@@ -52,22 +617,25 @@ class DataService:
 
     def get_data(self) -> DataStub:
         """
-        Return a `DataStub` for the current thread.
+        Return a `DataStub` for the current thread. It is wrapped in `CachingDataStub` if the \
+        persistent cache is enabled.
         """
-        stub = getattr(self._data_request_local, "data_stub", None)
-        if stub is None:
-            self._data_request_local.data_stub = stub = DataStub(self._get_channel())
-        return stub
+        return self._get_channel().get_stub(self._create_data_stub)
+
+    def reconnect_data(self) -> DataStub:
+        """
+        Replace the channel borrowed by the current thread after an RPC failure.
+
+        :return: `DataStub` which uses the new channel.
+        """
+        self.close_channel()
+        return self.get_data()
 
     def get_bblfsh(self) -> bblfsh.aliases.ProtocolServiceStub:
         """
         Return a Babelfish `ProtocolServiceStub` for the current thread.
         """
-        stub = getattr(self._data_request_local, "bblfsh_stub", None)
-        if stub is None:
-            self._data_request_local.bblfsh_stub = stub = \
-                bblfsh.aliases.ProtocolServiceStub(self._get_channel())
-        return stub
+        return self._get_channel().get_stub(bblfsh.aliases.ProtocolServiceStub)
 
     def check_bblfsh_driver_versions(self, versions: Iterable[str]) -> None:
         """
@@ -79,12 +647,10 @@ class DataService:
         :return: Nothing
         :raise UnsatisfiedDriverVersionError: if there is one or more mismatches.
         """
-        existing = self.get_bblfsh().SupportedLanguages(
-            bblfsh.aliases.SupportedLanguagesRequest()).languages
-        existing = {driver.language: Version(driver.version) for driver in existing}
+        existing = self.get_bblfsh_driver_versions()
         mismatched = []
         for reqstr in versions:
-            req = Requirement(reqstr)
+            req = _parse_requirement(reqstr)
             try:
                 ver = existing[req.name]
             except KeyError:
@@ -95,37 +661,87 @@ class DataService:
         if mismatched:
             raise UnsatisfiedDriverVersionError(mismatched)
 
+    def get_bblfsh_driver_versions(self) -> Dict[str, Version]:
+        """
+        Return the versions of the installed Babelfish drivers.
+
+        The versions are requested from Babelfish once per `bblfsh_drivers_ttl` seconds, \
+        `invalidate_bblfsh_driver_versions()` forces the next call to request them again.
+
+        :return: Mapping from the language names to the driver versions.
+        """
+        with self._bblfsh_drivers_lock:
+            if self._bblfsh_drivers is not None and \
+                    time.monotonic() < self._bblfsh_drivers_expire:
+                return self._bblfsh_drivers
+        languages = self.get_bblfsh().SupportedLanguages(
+            bblfsh.aliases.SupportedLanguagesRequest()).languages
+        drivers = {driver.language: Version(driver.version) for driver in languages}
+        with self._bblfsh_drivers_lock:
+            self._bblfsh_drivers = drivers
+            self._bblfsh_drivers_expire = time.monotonic() + self._bblfsh_drivers_ttl
+        return drivers
+
+    def invalidate_bblfsh_driver_versions(self) -> None:
+        """
+        Forget the cached versions of the Babelfish drivers, e.g. after the drivers are updated.
+
+        :return: Nothing
+        """
+        with self._bblfsh_drivers_lock:
+            self._bblfsh_drivers = None
+
     def shutdown(self):
         """
         Close all the open network connections.
         """
         self._log.info("Shutting down")
-        for channel in self._data_request_channels:
-            channel.close()
-        self._data_request_channels.clear()
+        self._channel_pool.close()
         self._data_request_local = threading.local()
+        if self.unicode_pool is not None:
+            self.unicode_pool.shutdown()
+        if self.unicode_cache is not None:
+            self.unicode_cache.clear()
+        if self.data_cache is not None:
+            self.data_cache.close()
 
     def close_channel(self):
         """
-        Close the current channel and free all the associated resources.
+        Discard the channel borrowed by the current thread after an RPC failure. The pool \
+        opens a replacement channel with exponential backoff.
+        """
+        channel = getattr(self._data_request_local, "channel", None)
+        if channel is not None:
+            self._channel_pool.invalidate(channel)
+            self.release_channel()
+
+    def release_channel(self):
+        """
+        Return the channel borrowed by the current thread to the pool. The next call to \
+        `get_data()` or `get_bblfsh()` borrows a channel again.
         """
         channel = getattr(self._data_request_local, "channel", None)
         if channel is not None:
-            self._data_request_channels.remove(channel)
             self._data_request_local.channel = None
-            self._data_request_local.data_stub = None
-            self._data_request_local.bblfsh_stub = None
-            channel.close()
-            self._log.info("Disposed %s", channel)
+            self._channel_pool.release(channel)
 
-    def _get_channel(self) -> grpc.Channel:
+    def _get_channel(self) -> PooledChannel:
         channel = getattr(self._data_request_local, "channel", None)
         if channel is None:
-            self._data_request_local.channel = channel = create_channel(self._data_request_address)
-            self._data_request_channels.append(channel)
-            self._log.info("Opened %s", channel)
+            self._data_request_local.channel = channel = self._channel_pool.borrow()
         return channel
 
+    def _create_data_stub(self, channel: grpc.Channel) -> DataStub:
+        stub = DataStub(channel)
+        if self.data_cache is not None:
+            stub = CachingDataStub(stub, self.data_cache)
+        return stub
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_requirement(reqstr: str) -> Requirement:
+    return Requirement(reqstr)
+
 
 def handle_analyze_rpc_errors(func):  # noqa: D401
     """
@@ -144,6 +760,8 @@ def handle_analyze_rpc_errors(func):  # noqa: D401
         except grpc.RpcError as e:
             data_service.close_channel()
             raise e from None
+        finally:
+            data_service.release_channel()
 
     return wrapped_handle_rpc_errors
 
@@ -157,11 +775,34 @@ def _handle_train_rpc_errors(func):
         except grpc.RpcError as e:
             data_service.close_channel()
             raise e from None
+        finally:
+            data_service.release_channel()
 
     return wrapped_handle_rpc_errors
 
 
-def with_changed_uasts(unicode: bool):  # noqa: D401
+def _request_analyzed_changes(analyzer: Analyzer, ptr_from: ReferencePointer,
+                              ptr_to: ReferencePointer, data_service: DataService,
+                              shared_changes: Optional["SharedChanges"], contents: bool,
+                              uast: bool, unicode: bool, lazy: bool, prefetch: int,
+                              ) -> Iterator[Change]:
+    kwargs = dict(contents=contents, uast=uast, unicode=unicode, lazy=lazy,
+                  unicode_pool=data_service.unicode_pool,
+                  unicode_cache=data_service.unicode_cache,
+                  skip_identical=getattr(analyzer, "content_changes_only", False),
+                  **request_filters(analyzer))
+    if shared_changes is not None:
+        # AnalyzerManager has already fetched the changes for all the analyzers
+        return shared_changes.view(**kwargs)
+    return request_changes(
+        data_service.get_data(), ptr_from, ptr_to, prefetch=prefetch,
+        prefetch_bytes=data_service.prefetch_bytes, retries=data_service.stream_retries,
+        retry_backoff=data_service.stream_retry_backoff,
+        reconnect=data_service.reconnect_data,
+        measure_bytes=data_service.measure_stream_bytes, **kwargs)
+
+
+def with_changed_uasts(unicode: bool, lazy: bool = False, prefetch: int = 0):  # noqa: D401
     """
     Decorator to provide "changes" keyword argument to `**data` in `Analyzer.analyze()`.
 
@@ -171,6 +812,11 @@ def with_changed_uasts(unicode: bool):  # noqa: D401
 
     :param unicode: Value indicating whether `content` and UAST positions should be converted to \
                     Unicode. False keeps DataService response untouched.
+    :param lazy: Value indicating whether the Unicode conversion of each file should be \
+                 postponed until its `content` or `uast` is accessed. Ignored if `unicode` \
+                 is False.
+    :param prefetch: Number of messages to receive in the background ahead of the consumer, \
+                     bounded by `DataService.prefetch_bytes`. 0 disables prefetching.
     :return: The decorated method.
     """
     def configured_with_changed_uasts(func):
@@ -179,17 +825,19 @@ def with_changed_uasts(unicode: bool):  # noqa: D401
         def wrapped_with_changed_uasts(
                 self: Analyzer, ptr_from: ReferencePointer, ptr_to: ReferencePointer,
                 data_service: DataService, **data) -> [Comment]:
-            changes = request_changes(
-                data_service.get_data(), ptr_from, ptr_to, contents=False, uast=True,
-                unicode=unicode)
+            changes = _request_analyzed_changes(
+                self, ptr_from, ptr_to, data_service, data.pop("shared_changes", None),
+                contents=False, uast=True, unicode=unicode, lazy=lazy, prefetch=prefetch)
             return func(self, ptr_from, ptr_to, data_service, changes=changes, **data)
 
+        wrapped_with_changed_uasts.changes_requirements = ChangesRequirements(
+            contents=False, uast=True)
         return wrapped_with_changed_uasts
 
     return configured_with_changed_uasts
 
 
-def with_changed_contents(unicode: bool):  # noqa: D401
+def with_changed_contents(unicode: bool, lazy: bool = False, prefetch: int = 0):  # noqa: D401
     """
     Decorator to provide "changes" keyword argument to `**data` in `Analyzer.analyze()`.
 
@@ -199,6 +847,11 @@ def with_changed_contents(unicode: bool):  # noqa: D401
 
     :param unicode: Value indicating whether `content` and UAST positions should be converted to \
                     Unicode. False keeps DataService response untouched.
+    :param lazy: Value indicating whether the Unicode conversion of each file should be \
+                 postponed until its `content` or `uast` is accessed. Ignored if `unicode` \
+                 is False.
+    :param prefetch: Number of messages to receive in the background ahead of the consumer, \
+                     bounded by `DataService.prefetch_bytes`. 0 disables prefetching.
     :return: The decorated method.
     """
     def configured_with_changed_contents(func):
@@ -207,19 +860,22 @@ def with_changed_contents(unicode: bool):  # noqa: D401
         def wrapped_with_changed_contents(
                 self: Analyzer, ptr_from: ReferencePointer, ptr_to: ReferencePointer,
                 data_service: DataService, **data) -> [Comment]:
-            changes = request_changes(
-                data_service.get_data(), ptr_from, ptr_to, contents=True, uast=False,
-                unicode=unicode)
+            changes = _request_analyzed_changes(
+                self, ptr_from, ptr_to, data_service, data.pop("shared_changes", None),
+                contents=True, uast=False, unicode=unicode, lazy=lazy, prefetch=prefetch)
             return func(self, ptr_from, ptr_to, data_service, changes=changes, **data)
 
+        wrapped_with_changed_contents.changes_requirements = ChangesRequirements(
+            contents=True, uast=False)
         return wrapped_with_changed_contents
 
     return configured_with_changed_contents
 
 
-def with_changed_uasts_and_contents(unicode: bool):  # noqa: D401
+def with_changed_uasts_and_contents(unicode: bool, lazy: bool = False,
+                                    prefetch: int = 0):
     """
-    Decorator to provide "changes" keyword argument to `**data` in `Analyzer.analyze()`.
+    Provide "changes" keyword argument to `**data` in `Analyzer.analyze()`.
 
     "changes" contain the list of `Change` - see lookout/core/server/sdk/service_data.proto.
     The changes will have both UASTs and raw file contents.
@@ -227,6 +883,11 @@ def with_changed_uasts_and_contents(unicode: bool):  # noqa: D401
 
     :param unicode: Value indicating whether `content` and UAST positions should be converted to \
                     Unicode. False keeps DataService response untouched.
+    :param lazy: Value indicating whether the Unicode conversion of each file should be \
+                 postponed until its `content` or `uast` is accessed. Ignored if `unicode` \
+                 is False.
+    :param prefetch: Number of messages to receive in the background ahead of the consumer, \
+                     bounded by `DataService.prefetch_bytes`. 0 disables prefetching.
     :return: The decorated method.
     """
     def configured_with_changed_uasts_and_contents(func):
@@ -235,17 +896,19 @@ def with_changed_uasts_and_contents(unicode: bool):  # noqa: D401
         def wrapped_changed_uasts_and_contents(
                 self: Analyzer, ptr_from: ReferencePointer, ptr_to: ReferencePointer,
                 data_service: DataService, **data) -> [Comment]:
-            changes = request_changes(
-                data_service.get_data(), ptr_from, ptr_to, contents=True, uast=True,
-                unicode=unicode)
+            changes = _request_analyzed_changes(
+                self, ptr_from, ptr_to, data_service, data.pop("shared_changes", None),
+                contents=True, uast=True, unicode=unicode, lazy=lazy, prefetch=prefetch)
             return func(self, ptr_from, ptr_to, data_service, changes=changes, **data)
 
+        wrapped_changed_uasts_and_contents.changes_requirements = ChangesRequirements(
+            contents=True, uast=True)
         return wrapped_changed_uasts_and_contents
 
     return configured_with_changed_uasts_and_contents
 
 
-def with_uasts(unicode: bool):  # noqa: D401
+def with_uasts(unicode: bool, lazy: bool = False, prefetch: int = 0):  # noqa: D401
     """
     Decorator to provide "files" keyword argument to `**data` in `Analyzer.train()`. They \
     only contain the UASTs.
@@ -256,6 +919,11 @@ def with_uasts(unicode: bool):  # noqa: D401
 
     :param unicode: Value indicating whether `content` and UAST positions should be converted to \
                     Unicode. False keeps DataService response untouched.
+    :param lazy: Value indicating whether the Unicode conversion of each file should be \
+                 postponed until its `content` or `uast` is accessed. Ignored if `unicode` \
+                 is False.
+    :param prefetch: Number of messages to receive in the background ahead of the consumer, \
+                     bounded by `DataService.prefetch_bytes`. 0 disables prefetching.
     :return: The decorated method.
     """
     def configured_with_uasts(func):
@@ -264,7 +932,16 @@ def with_uasts(unicode: bool):  # noqa: D401
         def wrapped_with_uasts(cls: Type[Analyzer], ptr: ReferencePointer, config: dict,
                                data_service: DataService, **data) -> AnalyzerModel:
             files = request_files(data_service.get_data(), ptr, contents=False, uast=True,
-                                  unicode=unicode)
+                                  unicode=unicode, lazy=lazy,
+                                  unicode_pool=data_service.unicode_pool,
+                                  unicode_cache=data_service.unicode_cache,
+                                  prefetch=prefetch,
+                                  prefetch_bytes=data_service.prefetch_bytes,
+                                  retries=data_service.stream_retries,
+                                  retry_backoff=data_service.stream_retry_backoff,
+                                  reconnect=data_service.reconnect_data,
+                                  measure_bytes=data_service.measure_stream_bytes,
+                                  **request_filters(cls))
             return func(cls, ptr, config, data_service, files=files, **data)
 
         return wrapped_with_uasts
@@ -272,7 +949,7 @@ def with_uasts(unicode: bool):  # noqa: D401
     return configured_with_uasts
 
 
-def with_contents(unicode: bool):  # noqa: D401
+def with_contents(unicode: bool, lazy: bool = False, prefetch: int = 0):  # noqa: D401
     """
     Decorator to provide "files" keyword argument to `**data` in `Analyzer.train()`. They \
     only contain the raw file contents.
@@ -283,6 +960,11 @@ def with_contents(unicode: bool):  # noqa: D401
 
     :param unicode: Value indicating whether `content` and UAST positions should be converted to \
                     Unicode. False keeps DataService response untouched.
+    :param lazy: Value indicating whether the Unicode conversion of each file should be \
+                 postponed until its `content` or `uast` is accessed. Ignored if `unicode` \
+                 is False.
+    :param prefetch: Number of messages to receive in the background ahead of the consumer, \
+                     bounded by `DataService.prefetch_bytes`. 0 disables prefetching.
     :return: The decorated method.
     """
     def configured_with_contents(func):
@@ -291,7 +973,16 @@ def with_contents(unicode: bool):  # noqa: D401
         def wrapped_with_contents(cls: Type[Analyzer], ptr: ReferencePointer, config: dict,
                                   data_service: DataService, **data) -> AnalyzerModel:
             files = request_files(data_service.get_data(), ptr, contents=True, uast=False,
-                                  unicode=unicode)
+                                  unicode=unicode, lazy=lazy,
+                                  unicode_pool=data_service.unicode_pool,
+                                  unicode_cache=data_service.unicode_cache,
+                                  prefetch=prefetch,
+                                  prefetch_bytes=data_service.prefetch_bytes,
+                                  retries=data_service.stream_retries,
+                                  retry_backoff=data_service.stream_retry_backoff,
+                                  reconnect=data_service.reconnect_data,
+                                  measure_bytes=data_service.measure_stream_bytes,
+                                  **request_filters(cls))
             return func(cls, ptr, config, data_service, files=files, **data)
 
         return wrapped_with_contents
@@ -299,7 +990,7 @@ def with_contents(unicode: bool):  # noqa: D401
     return configured_with_contents
 
 
-def with_uasts_and_contents(unicode: bool):  # noqa: D401
+def with_uasts_and_contents(unicode: bool, lazy: bool = False, prefetch: int = 0):  # noqa: D401
     """
     Decorator to provide "files" keyword argument to `**data` in `Analyzer.train()`. They \
     contain both the raw file contents and the UASTs.
@@ -310,6 +1001,11 @@ def with_uasts_and_contents(unicode: bool):  # noqa: D401
 
     :param unicode: Value indicating whether `content` and UAST positions should be converted to \
                     Unicode. False keeps DataService response untouched.
+    :param lazy: Value indicating whether the Unicode conversion of each file should be \
+                 postponed until its `content` or `uast` is accessed. Ignored if `unicode` \
+                 is False.
+    :param prefetch: Number of messages to receive in the background ahead of the consumer, \
+                     bounded by `DataService.prefetch_bytes`. 0 disables prefetching.
     :return: The decorated method.
     """
     def configured_with_uasts_and_contents(func):
@@ -319,7 +1015,16 @@ def with_uasts_and_contents(unicode: bool):  # noqa: D401
                 cls: Type[Analyzer], ptr: ReferencePointer, config: dict,
                 data_service: DataService, **data) -> AnalyzerModel:
             files = request_files(data_service.get_data(), ptr, contents=True, uast=True,
-                                  unicode=unicode)
+                                  unicode=unicode, lazy=lazy,
+                                  unicode_pool=data_service.unicode_pool,
+                                  unicode_cache=data_service.unicode_cache,
+                                  prefetch=prefetch,
+                                  prefetch_bytes=data_service.prefetch_bytes,
+                                  retries=data_service.stream_retries,
+                                  retry_backoff=data_service.stream_retry_backoff,
+                                  reconnect=data_service.reconnect_data,
+                                  measure_bytes=data_service.measure_stream_bytes,
+                                  **request_filters(cls))
             return func(cls, ptr, config, data_service, files=files, **data)
 
         return wrapped_with_uasts_and_contents
@@ -327,43 +1032,530 @@ def with_uasts_and_contents(unicode: bool):  # noqa: D401
     return configured_with_uasts_and_contents
 
 
+def with_changed_uasts_and_lazy_contents(unicode: bool, prefetch: int = 0,
+                                         batch_size: int = 100):
+    """
+    Provide "changes" keyword argument to `**data` in `Analyzer.analyze()`.
+
+    "changes" contain the list of `LazyContentChange`. Only the UASTs are streamed, the raw \
+    contents are fetched with `GetFiles` on the first access to `content`.
+
+    The contents are batched only for the files which were marked with `request()`: call it \
+    on all the interesting `LazyContentFile`-s before accessing any of their contents to fetch \
+    them in batches of `batch_size` files per round trip. Otherwise, each accessed content \
+    costs a separate `GetFiles`.
+    Decorated method should have a signature compatible with `Analyzer.analyze()`.
+
+    :param unicode: Value indicating whether `content` and UAST positions should be converted to \
+                    Unicode. The conversion of each file happens when its content is fetched.
+    :param prefetch: Number of messages to receive in the background ahead of the consumer, \
+                     bounded by `DataService.prefetch_bytes`. 0 disables prefetching.
+    :param batch_size: Maximum number of files whose contents are fetched at once.
+    :return: The decorated method.
+    """
+    def configured_with_changed_uasts_and_lazy_contents(func):
+        @functools.wraps(func)
+        @handle_analyze_rpc_errors
+        def wrapped_with_changed_uasts_and_lazy_contents(
+                self: Analyzer, ptr_from: ReferencePointer, ptr_to: ReferencePointer,
+                data_service: DataService, **data) -> [Comment]:
+            changes = request_changes_with_lazy_contents(
+                data_service.get_data, ptr_from, ptr_to, unicode=unicode, batch_size=batch_size,
+                prefetch=prefetch, prefetch_bytes=data_service.prefetch_bytes,
+                retries=data_service.stream_retries,
+                retry_backoff=data_service.stream_retry_backoff,
+                reconnect=data_service.reconnect_data,
+                skip_identical=getattr(self, "content_changes_only", False),
+                measure_bytes=data_service.measure_stream_bytes,
+                **request_filters(self))
+            return func(self, ptr_from, ptr_to, data_service, changes=changes, **data)
+
+        return wrapped_with_changed_uasts_and_lazy_contents
+
+    return configured_with_changed_uasts_and_lazy_contents
+
+
+def _handle_update_rpc_errors(func):
+    @functools.wraps(func)
+    def wrapped_handle_rpc_errors(cls: Type[Analyzer], model: AnalyzerModel,
+                                  ptr_from: ReferencePointer, ptr_to: ReferencePointer,
+                                  config: dict, data_service: DataService,
+                                  **data) -> AnalyzerModel:
+        try:
+            return func(cls, model, ptr_from, ptr_to, config, data_service, **data)
+        except grpc.RpcError as e:
+            data_service.close_channel()
+            raise e from None
+        finally:
+            data_service.release_channel()
+
+    return wrapped_handle_rpc_errors
+
+
+def with_changes_since_model(unicode: bool, contents: bool = True, uast: bool = True,
+                             lazy: bool = False, prefetch: int = 0):
+    """
+    Provide "changes" keyword argument to `**data` in `Analyzer.update()`.
+
+    "changes" contain the list of `Change` between the revision of the model and the new \
+    revision, see lookout/core/server/sdk/service_data.proto.
+    Decorated method should have a signature compatible with `Analyzer.update()`.
+
+    :param unicode: Value indicating whether `content` and UAST positions should be converted to \
+                    Unicode. False keeps DataService response untouched.
+    :param contents: Value indicating whether to request the raw file contents.
+    :param uast: Value indicating whether to request the UASTs.
+    :param lazy: Value indicating whether the Unicode conversion of each file should be \
+                 postponed until its `content` or `uast` is accessed. Ignored if `unicode` \
+                 is False.
+    :param prefetch: Number of messages to receive in the background ahead of the consumer, \
+                     bounded by `DataService.prefetch_bytes`. 0 disables prefetching.
+    :return: The decorated method.
+    """
+    def configured_with_changes_since_model(func):
+        @functools.wraps(func)
+        @_handle_update_rpc_errors
+        def wrapped_with_changes_since_model(
+                cls: Type[Analyzer], model: AnalyzerModel, ptr_from: ReferencePointer,
+                ptr_to: ReferencePointer, config: dict, data_service: DataService,
+                **data) -> AnalyzerModel:
+            changes = request_changes(
+                data_service.get_data(), ptr_from, ptr_to, contents=contents, uast=uast,
+                unicode=unicode, lazy=lazy,
+                unicode_pool=data_service.unicode_pool,
+                unicode_cache=data_service.unicode_cache,
+                prefetch=prefetch, prefetch_bytes=data_service.prefetch_bytes,
+                retries=data_service.stream_retries,
+                retry_backoff=data_service.stream_retry_backoff,
+                reconnect=data_service.reconnect_data,
+                skip_identical=getattr(cls, "content_changes_only", False),
+                measure_bytes=data_service.measure_stream_bytes,
+                **request_filters(cls))
+            return func(cls, model, ptr_from, ptr_to, config, data_service, changes=changes,
+                        **data)
+
+        return wrapped_with_changes_since_model
+
+    return configured_with_changes_since_model
+
+
 def request_changes(stub: DataStub, ptr_from: ReferencePointer, ptr_to: ReferencePointer,
-                    contents: bool, uast: bool, unicode: bool) -> Iterator[Change]:
+                    contents: bool, uast: bool, unicode: bool, lazy: bool = False,
+                    unicode_pool: Optional[UnicodeConversionPool] = None,
+                    unicode_cache: Optional[UnicodeFileCache] = None, prefetch: int = 0,
+                    prefetch_bytes: int = 0, retries: int = 0, retry_backoff: float = 1,
+                    reconnect: Optional[Callable[[], DataStub]] = None,
+                    languages: Iterable[str] = (), include_pattern: Optional[str] = None,
+                    max_file_size: int = 0, skip_identical: bool = False,
+                    measure_bytes: bool = False) -> Iterator[Change]:
     """
     Invoke GRPC API and get the changes. Used by `with_changed_uasts()` and Review events.
 
+    :param stub: Data service stub.
+    :param ptr_from: Git repository state pointer to the base revision.
+    :param ptr_to: Git repository state pointer to the head revision.
+    :param contents: Value indicating whether to request the file contents.
+    :param uast: Value indicating whether to request the UASTs.
+    :param unicode: Value indicating whether to convert the files to `UnicodeFile`-s.
+    :param lazy: Value indicating whether the Unicode conversion should be postponed until \
+                 the converted fields are accessed. Ignored if `unicode` is False.
+    :param unicode_pool: Pool to run the Unicode conversion in parallel. Ignored if `unicode` \
+                         is False or `lazy` is True.
+    :param unicode_cache: Cache of the files converted to Unicode. Ignored if `unicode` is \
+                          False or `lazy` is True.
+    :param prefetch: Number of messages to receive in a background thread ahead of the \
+                     consumer. 0 disables prefetching.
+    :param prefetch_bytes: Maximum total size of the prefetched messages. 0 means unlimited.
+    :param retries: Maximum number of times to resume the stream after transient RPC failures. \
+                    0 disables resuming.
+    :param retry_backoff: Number of seconds to wait before resuming the stream for the first \
+                          time. The delay doubles with each retry.
+    :param reconnect: Function which returns a `DataStub` on a new channel to resume the \
+                      stream. None resumes with `stub`.
+    :param languages: Names of the languages to request. Empty means all.
+    :param include_pattern: Regular expression which the requested paths must match.
+    :param max_file_size: Maximum size of the raw file contents in bytes. The bigger files \
+                          are dropped before the Unicode conversion. 0 means unlimited.
+    :param skip_identical: Value indicating whether to drop the changes with identical \
+                           `base` and `head`, see \
+                           `BytesToUnicodeConverter.has_identical_sides()`. Otherwise, such \
+                           sides share the same object after the Unicode conversion. Only the \
+                           requested contents and UASTs are compared.
+    :param measure_bytes: Value indicating whether to report the serialized size of the \
+                          received and the dropped changes in the `DataService.changes.*` \
+                          metrics.
     :return: The stream of the gRPC invocation results. In theory, `.result()` would turn this \
              into a synchronous call, but in practice, that function call hangs for some reason.
     """
-    request = ChangesRequest(base=ptr_from.to_pb(), head=ptr_to.to_pb())
-    request.exclude_pattern = GARBAGE_PATTERN
-    request.exclude_vendored = True
-    request.want_contents = contents
-    request.want_language = contents or uast
-    request.want_uast = uast
-    changes = stub.GetChanges(request)
+    request = make_changes_request(ptr_from, ptr_to, contents, uast, languages=languages,
+                                   include_pattern=include_pattern)
+
+    def open_changes(stub: DataStub) -> Iterator[Change]:
+        changes = stub.GetChanges(request)
+        if prefetch > 0:
+            changes = StreamPrefetcher(changes, prefetch, prefetch_bytes)
+        return changes
+
+    changes = open_changes(stub)
+    if retries > 0:
+        changes = ResumableStream(
+            changes, lambda: open_changes(reconnect() if reconnect is not None else stub),
+            lambda change: (change.base.path, change.head.path), retries, retry_backoff)
+    changes = _filter_stream(changes, make_change_filter(languages, max_file_size),
+                             "DataService.changes", measure_bytes)
+    if contents or uast:
+        changes = count_identical_changes(changes, skip_identical)
     if unicode:
-        changes = map(BytesToUnicodeConverter.convert_change, changes)
+        changes = convert_to_unicode(
+            functools.partial(BytesToUnicodeConverter.convert_change, share_identical=True),
+            changes, lazy, unicode_pool, unicode_cache)
     return changes
 
 
+def request_changes_with_lazy_contents(
+        stub: Callable[[], DataStub], ptr_from: ReferencePointer, ptr_to: ReferencePointer,
+        unicode: bool, batch_size: int = 100, prefetch: int = 0, prefetch_bytes: int = 0,
+        retries: int = 0, retry_backoff: float = 1,
+        reconnect: Optional[Callable[[], DataStub]] = None, languages: Iterable[str] = (),
+        include_pattern: Optional[str] = None, max_file_size: int = 0,
+        skip_identical: bool = False, measure_bytes: bool = False,
+) -> Iterator[LazyContentChange]:
+    """
+    Invoke GRPC API and get the changes with the UASTs. The raw contents are fetched on demand. \
+    Used by `with_changed_uasts_and_lazy_contents()`.
+
+    :param stub: Function which returns the `DataStub` of the current thread, e.g. \
+                 `DataService.get_data`.
+    :param ptr_from: Git repository state pointer to the base revision.
+    :param ptr_to: Git repository state pointer to the head revision.
+    :param unicode: Value indicating whether `content` and UAST positions should be converted to \
+                    Unicode after the content is fetched.
+    :param batch_size: Maximum number of files whose contents are fetched at once.
+    :param prefetch: Number of messages to receive in a background thread ahead of the \
+                     consumer. 0 disables prefetching.
+    :param prefetch_bytes: Maximum total size of the prefetched messages. 0 means unlimited.
+    :param retries: Maximum number of times to resume the streams after transient RPC \
+                    failures. 0 disables resuming.
+    :param retry_backoff: Number of seconds to wait before resuming a stream for the first \
+                          time. The delay doubles with each retry.
+    :param reconnect: Function which returns a `DataStub` on a new channel to resume the \
+                      streams. None resumes with `stub()`.
+    :param languages: Names of the languages to request. Empty means all.
+    :param include_pattern: Regular expression which the requested paths must match.
+    :param max_file_size: Maximum size of the raw file contents in bytes. It is not checked \
+                          because the contents are not known in advance.
+    :param skip_identical: Value indicating whether to drop the changes with identical \
+                           `base` and `head`. The contents are not streamed, so they are \
+                           compared by the blob hashes together with the UASTs. The changes \
+                           without the hashes are never dropped.
+    :param measure_bytes: Value indicating whether to report the serialized size of the \
+                          received and the dropped changes in the `DataService.changes.*` \
+                          metrics.
+    :return: Iterator over the `LazyContentChange`-s.
+    """
+    fetchers = [LazyContentFetcher(stub, ptr, batch_size, retries=retries,
+                                   retry_backoff=retry_backoff, reconnect=reconnect)
+                for ptr in (ptr_from, ptr_to)]
+    changes = request_changes(
+        stub(), ptr_from, ptr_to, contents=False, uast=True, unicode=False, prefetch=prefetch,
+        prefetch_bytes=prefetch_bytes, retries=retries, retry_backoff=retry_backoff,
+        reconnect=reconnect, languages=languages, include_pattern=include_pattern,
+        measure_bytes=measure_bytes)
+    for change in changes:
+        if skip_identical and change.base.hash and \
+                BytesToUnicodeConverter.has_identical_sides(change):
+            continue
+        yield LazyContentChange(*(LazyContentFile(side, fetcher, unicode) for side, fetcher in
+                                  zip((change.base, change.head), fetchers)))
+
+
+def make_paths_pattern(paths: Iterable[str]) -> str:
+    """
+    Create the `include_pattern` which matches exactly the specified paths.
+
+    Only the regular expression metacharacters are escaped because the server uses Go's RE2 \
+    syntax, which rejects the escaped letters produced by `re.escape()` in older Pythons.
+
+    :param paths: File paths to match.
+    :return: Regular expression.
+    """
+    return "^(%s)$" % "|".join("".join("\\" + c if c in _REGEXP_METACHARACTERS else c
+                                       for c in path) for path in paths)
+
+
+_REGEXP_METACHARACTERS = frozenset("\\.+*?()|[]{}^$")
+
+
 def request_files(stub: DataStub, ptr: ReferencePointer, contents: bool, uast: bool,
-                  unicode: bool) -> Iterator[File]:
+                  unicode: bool, lazy: bool = False,
+                  unicode_pool: Optional[UnicodeConversionPool] = None,
+                  unicode_cache: Optional[UnicodeFileCache] = None, prefetch: int = 0,
+                  prefetch_bytes: int = 0, retries: int = 0, retry_backoff: float = 1,
+                  reconnect: Optional[Callable[[], DataStub]] = None,
+                  languages: Iterable[str] = (), include_pattern: Optional[str] = None,
+                  max_file_size: int = 0, measure_bytes: bool = False) -> Iterator[File]:
     """
     Invoke GRPC API and get the files. Used by `with_uasts()` and Push events.
 
+    :param stub: Data service stub.
+    :param ptr: Git repository state pointer.
+    :param contents: Value indicating whether to request the file contents.
+    :param uast: Value indicating whether to request the UASTs.
+    :param unicode: Value indicating whether to convert the files to `UnicodeFile`-s.
+    :param lazy: Value indicating whether the Unicode conversion should be postponed until \
+                 the converted fields are accessed. Ignored if `unicode` is False.
+    :param unicode_pool: Pool to run the Unicode conversion in parallel. Ignored if `unicode` \
+                         is False or `lazy` is True.
+    :param unicode_cache: Cache of the files converted to Unicode. Ignored if `unicode` is \
+                          False or `lazy` is True.
+    :param prefetch: Number of messages to receive in a background thread ahead of the \
+                     consumer. 0 disables prefetching.
+    :param prefetch_bytes: Maximum total size of the prefetched messages. 0 means unlimited.
+    :param retries: Maximum number of times to resume the stream after transient RPC failures. \
+                    0 disables resuming.
+    :param retry_backoff: Number of seconds to wait before resuming the stream for the first \
+                          time. The delay doubles with each retry.
+    :param reconnect: Function which returns a `DataStub` on a new channel to resume the \
+                      stream. None resumes with `stub`.
+    :param languages: Names of the languages to request. Empty means all.
+    :param include_pattern: Regular expression which the requested paths must match.
+    :param max_file_size: Maximum size of the raw file contents in bytes. The bigger files \
+                          are dropped before the Unicode conversion. 0 means unlimited.
+    :param measure_bytes: Value indicating whether to report the serialized size of the \
+                          received and the dropped files in the `DataService.files.*` metrics.
     :return: The stream of the gRPC invocation results.
     """
+    request = make_files_request(ptr, contents, uast, languages=languages,
+                                 include_pattern=include_pattern)
+
+    def open_files(stub: DataStub) -> Iterator[File]:
+        files = stub.GetFiles(request)
+        if prefetch > 0:
+            files = StreamPrefetcher(files, prefetch, prefetch_bytes)
+        return files
+
+    files = open_files(stub)
+    if retries > 0:
+        files = ResumableStream(
+            files, lambda: open_files(reconnect() if reconnect is not None else stub),
+            lambda file: file.path, retries, retry_backoff)
+    files = _filter_stream(files, make_file_filter(languages, max_file_size),
+                           "DataService.files", measure_bytes)
+    if unicode:
+        files = convert_to_unicode(BytesToUnicodeConverter.convert_file, files, lazy,
+                                   unicode_pool, unicode_cache)
+    return files
+
+
+def make_changes_request(ptr_from: ReferencePointer, ptr_to: ReferencePointer, contents: bool,
+                         uast: bool, languages: Iterable[str] = (),
+                         include_pattern: Optional[str] = None) -> ChangesRequest:
+    """
+    Create the `GetChanges` request which is sent by `request_changes()`.
+
+    :param ptr_from: Base revision.
+    :param ptr_to: Head revision.
+    :param contents: Value indicating whether to request the raw file contents.
+    :param uast: Value indicating whether to request the UASTs.
+    :param languages: Names of the languages to request. Empty means all.
+    :param include_pattern: Regular expression which the requested paths must match.
+    :return: `ChangesRequest`.
+    """
+    request = ChangesRequest(base=ptr_from.to_pb(), head=ptr_to.to_pb())
+    _set_request_filters(request, contents, uast, languages, include_pattern)
+    return request
+
+
+def make_files_request(ptr: ReferencePointer, contents: bool, uast: bool,
+                       languages: Iterable[str] = (), include_pattern: Optional[str] = None,
+                       ) -> FilesRequest:
+    """
+    Create the `GetFiles` request which is sent by `request_files()`.
+
+    :param ptr: Revision.
+    :param contents: Value indicating whether to request the raw file contents.
+    :param uast: Value indicating whether to request the UASTs.
+    :param languages: Names of the languages to request. Empty means all.
+    :param include_pattern: Regular expression which the requested paths must match.
+    :return: `FilesRequest`.
+    """
     request = FilesRequest(revision=ptr.to_pb())
+    _set_request_filters(request, contents, uast, languages, include_pattern)
+    return request
+
+
+def request_filters(analyzer: Union[Analyzer, Type[Analyzer]]) -> Dict[str, Any]:
+    """
+    Collect the restrictions of the requested files which are declared by the analyzer.
+
+    :param analyzer: `Analyzer` or its class. Missing declarations mean no restrictions.
+    :return: Keyword arguments for `request_changes()` and `request_files()`.
+    """
+    return {
+        "languages": tuple(getattr(analyzer, "languages", None) or ()),
+        "include_pattern": getattr(analyzer, "include_pattern", None),
+        "max_file_size": getattr(analyzer, "max_file_size", None) or 0,
+    }
+
+
+def make_file_filter(languages: Iterable[str], max_file_size: int,
+                     ) -> Optional[Callable[[File], bool]]:
+    """
+    Create the predicate which drops the files which the server did not filter out.
+
+    :param languages: Names of the accepted languages. Empty means all.
+    :param max_file_size: Maximum size of the raw file contents in bytes. 0 means unlimited.
+    :return: Function which returns True for the accepted `File`-s or None if all the files \
+             are accepted.
+    """
+    languages = frozenset(lang.lower() for lang in languages)
+    if not languages and max_file_size <= 0:
+        return None
+
+    def accept_file(file: File) -> bool:
+        if languages and file.language and file.language.lower() not in languages:
+            return False
+        return max_file_size <= 0 or len(file.content) <= max_file_size
+
+    return accept_file
+
+
+def make_change_filter(languages: Iterable[str], max_file_size: int,
+                       ) -> Optional[Callable[[Change], bool]]:
+    """
+    Create the predicate which drops the changes which the server did not filter out.
+
+    A change is accepted if all its non-empty sides are accepted by `make_file_filter()`.
+
+    :param languages: Names of the accepted languages. Empty means all.
+    :param max_file_size: Maximum size of the raw file contents in bytes. 0 means unlimited.
+    :return: Function which returns True for the accepted `Change`-s or None if all the \
+             changes are accepted.
+    """
+    accept_file = make_file_filter(languages, max_file_size)
+    if accept_file is None:
+        return None
+
+    def accept_change(change: Change) -> bool:
+        return all(accept_file(side) for side in (change.base, change.head) if side.path)
+
+    return accept_change
+
+
+def _set_request_filters(request: Union[ChangesRequest, FilesRequest], contents: bool,
+                         uast: bool, languages: Iterable[str], include_pattern: Optional[str]):
     request.exclude_pattern = GARBAGE_PATTERN
     request.exclude_vendored = True
     request.want_contents = contents
-    request.want_language = contents or uast
+    request.want_language = contents or uast or bool(languages)
     request.want_uast = uast
-    files = stub.GetFiles(request)
-    if unicode:
-        files = map(BytesToUnicodeConverter.convert_file, files)
-    return files
+    request.include_languages.extend(sorted(lang.lower() for lang in languages))
+    if include_pattern:
+        request.include_pattern = include_pattern
+
+
+def _filter_stream(stream: Iterable, accept: Optional[Callable[[Any], bool]], metric: str,
+                   measure: bool) -> Iterable:
+    if accept is None and not measure:
+        return stream
+    return _FilteredStream(stream, accept, metric if measure else None)
+
+
+class _FilteredStream:
+    def __init__(self, stream: Iterable, accept: Optional[Callable[[Any], bool]],
+                 metric: Optional[str]):
+        self._stream = stream
+        self._iterator = iter(stream)
+        self._accept = accept
+        self._metric = metric
+        self._received = self._dropped = 0
+        self._reported = False
+
+    def __iter__(self) -> Iterator:
+        return self
+
+    def __next__(self):
+        accept, metric = self._accept, self._metric
+        while True:
+            try:
+                item = next(self._iterator)
+            except BaseException:
+                self._report()
+                raise
+            if metric is not None:
+                size = item.ByteSize()
+                self._received += size
+            if accept is not None and not accept(item):
+                if metric is not None:
+                    self._dropped += size
+                continue
+            return item
+
+    def cancel(self):
+        self._report()
+        cancel = getattr(self._stream, "cancel", None) or getattr(self._stream, "close", None)
+        if cancel is not None:
+            cancel()
+
+    def _report(self):
+        if self._metric is None or self._reported:
+            return
+        self._reported = True
+        record_event(self._metric + ".bytes", self._received)
+        if self._accept is not None:
+            record_event(self._metric + ".dropped", self._dropped)
+
+
+def count_identical_changes(changes: Iterable[Change], skip: bool) -> Iterator[Change]:
+    """
+    Count the changes with identical `base` and `head` in the "DataService.changes.identical" \
+    metric.
+
+    :param changes: Changes to check, see `BytesToUnicodeConverter.has_identical_sides()`.
+    :param skip: Value indicating whether to drop the identical changes.
+    :return: Iterator over the changes which are kept.
+    """
+    identical = 0
+    try:
+        for change in changes:
+            if BytesToUnicodeConverter.has_identical_sides(change):
+                identical += 1
+                if skip:
+                    continue
+            yield change
+    finally:
+        record_event("DataService.changes.identical", identical)
+
+
+def convert_to_unicode(convert: Callable, items: Iterable, lazy: bool,
+                       unicode_pool: Optional[UnicodeConversionPool],
+                       unicode_cache: Optional[UnicodeFileCache]) -> Iterator:
+    """
+    Convert the streamed `File`-s or `Change`-s to Unicode.
+
+    :param convert: `BytesToUnicodeConverter.convert_file()` or \
+                    `BytesToUnicodeConverter.convert_change()`.
+    :param items: `File`-s or `Change`-s to convert.
+    :param lazy: Value indicating whether the conversion should be postponed until the \
+                 converted fields are accessed.
+    :param unicode_pool: Pool to run the conversion in parallel. Ignored if `lazy` is True.
+    :param unicode_cache: Cache of the converted files. Ignored if `lazy` is True.
+    :return: Iterator over the converted items in the original order.
+    """
+    if unicode_pool is not None and not lazy:
+        return unicode_pool.map(functools.partial(convert, inplace=True), items,
+                                cache=unicode_cache)
+    return map(_unicode_converter(convert, lazy, unicode_cache), items)
+
+
+def _unicode_converter(convert: Callable, lazy: bool,
+                       unicode_cache: Optional[UnicodeFileCache]) -> Callable:
+    # the streamed messages are not referenced anywhere else, so we can avoid the copies
+    if lazy:
+        return functools.partial(convert, inplace=True, lazy=True)
+    if unicode_cache is not None:
+        return functools.partial(unicode_cache.convert, inplace=True)
+    return functools.partial(convert, inplace=True)
 
 
 def parse_uast(stub: bblfsh.aliases.ProtocolServiceStub, code: str, filename: str, unicode: bool,
@@ -385,5 +1577,68 @@ def parse_uast(stub: bblfsh.aliases.ProtocolServiceStub, code: str, filename: st
     response = stub.Parse(request)
     uast = response.uast
     if unicode:
-        uast = BytesToUnicodeConverter(code.encode()).convert_uast(uast)
+        uast = BytesToUnicodeConverter(code.encode()).convert_uast(uast, inplace=True)
     return uast, response.errors
+
+
+def parse_uasts(stub: bblfsh.aliases.ProtocolServiceStub, files: Iterable[File], unicode: bool,
+                concurrency: int = 8, ordered: bool = True, timeout: Optional[float] = None,
+                ) -> Iterator[Tuple[Union[File, UnicodeFile], list]]:
+    """
+    Parse many files concurrently and yield the UASTs as soon as they are ready.
+
+    At most `concurrency` parse requests are in flight at any time, and the Unicode \
+    conversion runs in the same threads which wait for the responses. Closing the returned \
+    generator cancels the pending requests.
+
+    :param stub: The Babelfish protocol stub.
+    :param files: `File`-s with the raw contents to parse. The language is detected by \
+                  Babelfish if `File.language` is empty.
+    :param unicode: Set to True if UAST position information should be converted to unicode \
+                    positions. `UnicodeFile`-s are yielded in that case.
+    :param concurrency: Maximum number of simultaneous parse requests.
+    :param ordered: Value indicating whether to yield the results in the order of `files`. \
+                    Otherwise, the results are yielded as they complete.
+    :param timeout: Timeout of each parse request in seconds. None means no timeout.
+    :return: Iterator over the pairs of the parsed file and the list of parsing errors. \
+             The parsed file has `language` set to the one used by Babelfish. The files which \
+             are not valid UTF-8 are not sent and have a single error.
+    """
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    pending = deque()
+    try:
+        for file in files:
+            pending.append(executor.submit(_parse_file, stub, file, unicode, timeout))
+            if len(pending) >= concurrency:
+                yield _pop_parsed(pending, ordered)
+        while pending:
+            yield _pop_parsed(pending, ordered)
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def _parse_file(stub: bblfsh.aliases.ProtocolServiceStub, file: File, unicode: bool,
+                timeout: Optional[float]) -> Tuple[Union[File, UnicodeFile], list]:
+    try:
+        code = file.content.decode()
+    except UnicodeDecodeError as e:
+        return file, ["%s is not UTF-8: %s" % (file.path, e)]
+    request = bblfsh.aliases.ParseRequest(filename=os.path.basename(file.path), content=code,
+                                          language=file.language or None)
+    response = stub.Parse(request, timeout=timeout)
+    parsed = File(path=file.path, content=file.content, uast=response.uast,
+                  language=response.language or file.language)
+    if unicode:
+        parsed = BytesToUnicodeConverter.convert_file(parsed, inplace=True)
+    return parsed, list(response.errors)
+
+
+def _pop_parsed(pending: deque, ordered: bool) -> Tuple[Union[File, UnicodeFile], list]:
+    if ordered:
+        return pending.popleft().result()
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    future = next(iter(done))
+    pending.remove(future)
+    return future.result()
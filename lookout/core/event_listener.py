@@ -3,7 +3,7 @@ import functools
 import logging
 from threading import Event
 import time
-from typing import Any, Dict
+from typing import Any, Dict, Sequence, Tuple
 
 import grpc
 import stringcase
@@ -77,16 +77,19 @@ class EventListener(AnalyzerServicer):
     and needs to be suspended.
     """
 
-    def __init__(self, address: str, handlers: EventHandlers, n_workers: int=1):
+    def __init__(self, address: str, handlers: EventHandlers, n_workers: int=1,
+                 options: Sequence[Tuple[str, Any]] = ()):
         """
         Initialize a new instance of EventListener.
 
         :param address: GRPC endpoint to connect to.
         :param handlers: Event callbacks which actually do the real work.
         :param n_workers: Number of threads in the thread pool which processes incoming events.
+        :param options: gRPC server options, e.g. the compression, see \
+                        `lookout.core.grpc_options.make_grpc_options()`.
         """
         self._server = grpc.server(ThreadPoolExecutor(max_workers=n_workers),
-                                   maximum_concurrent_rpcs=n_workers)
+                                   options=list(options), maximum_concurrent_rpcs=n_workers)
         self._server.address = address
         self._server.n_workers = n_workers
         add_AnalyzerServicer_to_server(self, self._server)
@@ -8,6 +8,7 @@ from lookout.core.api.service_analyzer_pb2 import Comment
 from lookout.core.api.service_data_pb2 import Change, File
 from lookout.core.data_requests import DataService, \
     with_changed_uasts_and_contents, with_uasts_and_contents
+from lookout.core.uast import iter_preorder
 
 
 class MyModel(AnalyzerModel):  # noqa: D
@@ -57,13 +58,7 @@ class MyAnalyzer(Analyzer):  # noqa: D
 
     @staticmethod
     def count_nodes(uast: Node):  # noqa
-        stack = [uast]
-        count = 0
-        while stack:
-            node = stack.pop()
-            count += 1
-            stack.extend(node.children)
-        return count
+        return sum(1 for _ in iter_preorder(uast))
 
 
 analyzer_class = MyAnalyzer
@@ -0,0 +1,39 @@
+"""Tuning options of the gRPC channels and servers."""
+from typing import Any, List, Tuple
+
+from lookout.sdk.grpc import grpc_max_msg_size
+
+# values of grpc_compression_algorithm in grpc/impl/codegen/compression_types.h
+COMPRESSION_ALGORITHMS = {"none": 0, "deflate": 1, "gzip": 2}
+
+
+def make_grpc_options(compression: str = "none", max_message_size: int = grpc_max_msg_size,
+                      window_size: int = 0) -> List[Tuple[str, Any]]:
+    """
+    Create the gRPC channel arguments which are accepted both by channels and servers.
+
+    :param compression: Name of the compression algorithm of the sent messages: "none", \
+                        "deflate" or "gzip". The peer answers with the same algorithm if it \
+                        supports it.
+    :param max_message_size: Maximum size of a sent or received message in bytes.
+    :param window_size: Size of the HTTP/2 flow control window of each stream in bytes. \
+                        0 keeps the window adjusted automatically by the bandwidth-delay \
+                        product probes.
+    :return: List of the channel arguments.
+    """
+    try:
+        algorithm = COMPRESSION_ALGORITHMS[compression]
+    except KeyError:
+        raise ValueError("Unsupported compression %s, must be one of %s" % (
+            compression, ", ".join(COMPRESSION_ALGORITHMS))) from None
+    options = [
+        ("grpc.default_compression_algorithm", algorithm),
+        ("grpc.max_send_message_length", max_message_size),
+        ("grpc.max_receive_message_length", max_message_size),
+    ]
+    if window_size > 0:
+        options.extend([
+            ("grpc.http2.bdp_probe", 0),
+            ("grpc.http2.lookahead_bytes", window_size),
+        ])
+    return options
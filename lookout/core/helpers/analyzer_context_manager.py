@@ -1,7 +1,7 @@
 from argparse import Namespace
 import json
 import subprocess
-from typing import Iterator, Optional, Type
+from typing import Any, Iterator, Optional, Sequence, Tuple, Type
 
 from lookout.core.analyzer import Analyzer
 from lookout.core.api.service_analyzer_pb2 import Comment
@@ -16,7 +16,8 @@ class AnalyzerContextManager:
     """Context manager for launching analyzer."""
 
     def __init__(self, analyzer: Type[Analyzer], db: str, fs: str,
-                 init: bool = True, data_request_address: str = "localhost:10301"):
+                 init: bool = True, data_request_address: str = "localhost:10301",
+                 grpc_options: Sequence[Tuple[str, Any]] = ()):
         """
         Initialization.
 
@@ -26,17 +27,21 @@ class AnalyzerContextManager:
         :param init: Value indicating whether to run the destructive database initialization \
                      or not. If you want to reuse an existing database set False.
         :param data_request_address: DataService GRPC endpoint to use.
+        :param grpc_options: gRPC options of both the DataService channels and the events \
+                             listener, see `lookout.core.grpc_options.make_grpc_options()`.
         """
         self.analyzer = analyzer
         self.init = init
         self._port = find_port()
         self.data_request_address = data_request_address
+        self.grpc_options = list(grpc_options)
         self._sql_alchemy_model_args = Namespace(
             db="sqlite:///%s" % db,
             fs=fs,
             cache_size="1G",
             cache_ttl="6h",
             db_kwargs={},
+            training_lock_ttl="0",
         )
         self._lookout_sdk = None
 
@@ -47,14 +52,15 @@ class AnalyzerContextManager:
         self.model_repository = create_model_repo_from_args(self._sql_alchemy_model_args)
         if self.init:
             self.model_repository.init()
-        self.data_service = DataService(self.data_request_address)
+        self.data_service = DataService(self.data_request_address,
+                                        channel_options=self.grpc_options)
         self.manager = AnalyzerManager(analyzers=[self.analyzer],
                                        model_repository=self.model_repository,
                                        data_service=self.data_service)
         if not check_port_free(self._port):
             self._port = find_port()
         self.listener = EventListener(address="0.0.0.0:%d" % self._port, handlers=self.manager,
-                                      n_workers=1)
+                                      n_workers=1, options=self.grpc_options)
         self.listener.start()
         self._lookout_sdk = LookoutSDK()
         return self
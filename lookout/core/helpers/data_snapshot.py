@@ -0,0 +1,164 @@
+"""Record the Lookout data server responses and replay them offline."""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
+from typing import Any, Iterable, Iterator, List, Sequence, Tuple, Union
+
+import grpc
+
+from lookout.core.api.service_data_pb2 import Change, ChangesRequest, File, FilesRequest
+from lookout.core.api.service_data_pb2_grpc import add_DataServicer_to_server, DataServicer
+from lookout.core.data_cache import DataCache
+from lookout.core.data_requests import DataService
+
+
+class RecordingDataService(DataService):
+    """
+    `DataService` which records the responses of the Lookout data server to a snapshot \
+    directory for `SnapshotDataServer`.
+
+    The snapshot is the persistent cache of `DataService`, so only the completely consumed \
+    responses are recorded and the repeated requests are served from the snapshot.
+    """
+
+    DEFAULT_MAX_SIZE = 1 << 40
+
+    def __init__(self, address: str, snapshot_dir: str, max_size: int = DEFAULT_MAX_SIZE,
+                 **kwargs):
+        """
+        Initialize a new instance of `RecordingDataService`.
+
+        :param address: GRPC endpoint of the real data server.
+        :param snapshot_dir: Directory to write the snapshot to. The existing snapshot is \
+                             extended.
+        :param max_size: Maximum size of the snapshot (in bytes). The oldest responses are \
+                         evicted beyond it.
+        :param kwargs: The rest of the `DataService` parameters.
+        """
+        super().__init__(address, cache_dir=snapshot_dir, cache_size=max_size, **kwargs)
+
+
+class SnapshotDataServicer(DataServicer):
+    """
+    Implementation of the `Data` gRPC service which replays the responses recorded by \
+    `RecordingDataService`.
+
+    The responses are delayed by the constant latency and streamed at the constant bandwidth. \
+    The requests which were not recorded fail with NOT_FOUND.
+    """
+
+    _log = logging.getLogger("SnapshotDataServicer")
+
+    def __init__(self, snapshot: DataCache, latency: float = 0, bandwidth: float = 0):
+        """
+        Initialize a new instance of `SnapshotDataServicer`.
+
+        :param snapshot: Recorded responses.
+        :param latency: Number of seconds before the first message of each response.
+        :param bandwidth: Number of serialized bytes per second to stream. 0 means unlimited.
+        """
+        self.snapshot = snapshot
+        self.latency = latency
+        self.bandwidth = bandwidth
+
+    def GetFiles(self, request: FilesRequest,  # noqa: N802
+                 context: grpc.ServicerContext) -> Iterator[File]:
+        """Stream the recorded files."""
+        digests = self._lookup(request, context)
+        yield from self._replay((self.snapshot.load_file(d) for d in digests), context)
+
+    def GetChanges(self, request: ChangesRequest,  # noqa: N802
+                   context: grpc.ServicerContext) -> Iterator[Change]:
+        """Stream the recorded changes."""
+        digests = self._lookup(request, context)
+        load_file = self.snapshot.load_file
+        yield from self._replay((Change(base=load_file(base), head=load_file(head))
+                                 for base, head in zip(digests[::2], digests[1::2])), context)
+
+    def _lookup(self, request: Union[FilesRequest, ChangesRequest],
+                context: grpc.ServicerContext) -> List[bytes]:
+        digests = self.snapshot.get_response(request)
+        if digests is None:
+            self._log.warning("not recorded: %s %s", type(request).__name__, request)
+            context.set_code(grpc.StatusCode.NOT_FOUND)
+            context.set_details("%s was not recorded" % type(request).__name__)
+            return []
+        return digests
+
+    def _replay(self, messages: Iterable, context: grpc.ServicerContext) -> Iterator:
+        # the schedule is absolute so that the serialization overhead does not add up
+        deadline = time.monotonic() + self.latency
+        for message in messages:
+            if self.bandwidth > 0:
+                deadline += message.ByteSize() / self.bandwidth
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if not context.is_active():
+                return
+            yield message
+
+
+class SnapshotDataServer:
+    """
+    Local replacement of the Lookout data server which serves a snapshot recorded by \
+    `RecordingDataService`. It makes the analyzer benchmarks deterministic and independent \
+    of the network.
+
+    Usage:
+
+    >>> with SnapshotDataServer("snapshot", latency=0.05, bandwidth=10 << 20) as server:
+    ...     data_service = DataService(server.address)
+    """
+
+    def __init__(self, snapshot_dir: str, latency: float = 0, bandwidth: float = 0,
+                 address: str = "localhost:0", n_workers: int = 4,
+                 options: Sequence[Tuple[str, Any]] = ()):
+        """
+        Initialize a new instance of `SnapshotDataServer`.
+
+        :param snapshot_dir: Directory with the snapshot written by `RecordingDataService`.
+        :param latency: Number of seconds before the first message of each response.
+        :param bandwidth: Number of serialized bytes per second to stream in each response. \
+                          0 means unlimited.
+        :param address: GRPC endpoint to listen on. Port 0 picks a free port.
+        :param n_workers: Number of threads which stream the responses.
+        :param options: gRPC server options, e.g. the compression, see \
+                        `lookout.core.grpc_options.make_grpc_options()`.
+        """
+        self._snapshot = DataCache(snapshot_dir, RecordingDataService.DEFAULT_MAX_SIZE)
+        self._server = grpc.server(ThreadPoolExecutor(max_workers=n_workers),
+                                   options=list(options))
+        add_DataServicer_to_server(
+            SnapshotDataServicer(self._snapshot, latency=latency, bandwidth=bandwidth),
+            self._server)
+        port = self._server.add_insecure_port(address)
+        self.address = "%s:%d" % (address.rsplit(":", 1)[0], port)
+
+    def __str__(self) -> str:
+        """Summarize the instance of SnapshotDataServer as a string."""
+        return "SnapshotDataServer(%s, %s)" % (self.address, self._snapshot)
+
+    def __enter__(self) -> "SnapshotDataServer":
+        """Start the server."""
+        return self.start()
+
+    def __exit__(self, exc_type=None, exc_val=None, exc_tb=None):
+        """Stop the server."""
+        self.stop()
+
+    def start(self) -> "SnapshotDataServer":
+        """
+        Start the gRPC server. Does *not* block.
+
+        :return: self
+        """
+        self._server.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the gRPC server and close the snapshot.
+        """
+        self._server.stop(None)
+        self._snapshot.close()
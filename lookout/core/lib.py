@@ -7,10 +7,12 @@ import re
 from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence
 
 from bblfsh import BblfshClient, Node
-from bblfsh.client import NonUTF8ContentException
+from bblfsh.aliases import ParseRequest, ParseResponse
 
 from lookout.core.api.service_data_pb2 import File
+from lookout.core.data_requests import parse_uasts
 from lookout.core.garbage_exclusion import GARBAGE_PATTERN
+from lookout.core.uast import iter_preorder
 
 
 def find_new_lines(before: str, after: str) -> List[int]:
@@ -59,15 +61,11 @@ def extract_changed_nodes(root: Node, lines: Sequence[int]) -> List[Node]:
     :param root: UAST root node.
     :param lines: Changed lines, typically obtained via find_new_lines(). Empty list means all \
                   the lines.
-    :return: List of UAST nodes which are suspected to have been changed.
+    :return: List of UAST nodes which are suspected to have been changed, in pre-order.
     """
     lines = set(lines)
-    queue = [root]
     result = []
-    while queue:
-        node = queue.pop()
-        for child in node.children:
-            queue.append(child)
+    for node in iter_preorder(root):
         if not node.start_position:
             continue
         if not lines or node.start_position.line in lines:
@@ -160,7 +158,7 @@ def filter_files_by_overall_size(filepaths: Iterable[str], content_getter: calla
 def parse_files(filepaths: Sequence[str], line_length_limit: int,
                 overall_size_limit: int, client: BblfshClient, language: str,
                 random_state: int = 7, progress_tracker: Callable = lambda x: x,
-                log: Optional[logging.Logger] = None) -> List[File]:
+                log: Optional[logging.Logger] = None, concurrency: int = 8) -> List[File]:
     """
     Parse files with Babelfish.
 
@@ -178,6 +176,7 @@ def parse_files(filepaths: Sequence[str], line_length_limit: int,
     :param random_state: Random generator state for shuffling the files.
     :param progress_tracker: Optional progress metric whenn iterating over the input files.
     :param log: Logger to use to report the number of excluded files.
+    :param concurrency: Maximum number of files which are parsed simultaneously.
     :return: `File`-s with parsed UASTs and which passed through the filters.
     """
     def load_file(path):
@@ -192,23 +191,20 @@ def parse_files(filepaths: Sequence[str], line_length_limit: int,
                                                   k=len(files_filtered_by_line_length))
     size, n_parsed = 0, 0
     size_passed = []
-    for filename in progress_tracker(files_filtered_by_line_length):
-        try:
-            res = client.parse(filename)
-        except NonUTF8ContentException:
-            # skip files that can't be parsed because of UTF-8 decoding errors.
-            continue
-        if res.status == 0 and res.language.lower() == language.lower():
+    files = (File(path=filename, content=load_file(filename))
+             for filename in progress_tracker(files_filtered_by_line_length))
+    parsed_files = parse_uasts(_BblfshClientStub(client), files, unicode=False,
+                               concurrency=concurrency)
+    # files that can't be parsed because of UTF-8 decoding errors have errors too
+    for file, errors in parsed_files:
+        if not errors and file.language.lower() == language.lower():
             n_parsed += 1
-            with open(filename, "rb") as f:
-                content = f.read()
-            size += len(content)
+            size += len(file.content)
             if size > overall_size_limit:
+                parsed_files.close()
                 break
-            uast = res.uast
-            path = filename
-            size_passed.append(File(content=content, uast=uast, path=path,
-                                    language=res.language.lower()))
+            file.language = file.language.lower()
+            size_passed.append(file)
     if log is not None:
         log.debug("excluded %d/%d files based on their path",
                   len(filepaths) - len(filepaths_filtered), len(filepaths))
@@ -224,6 +220,18 @@ def parse_files(filepaths: Sequence[str], line_length_limit: int,
     return size_passed
 
 
+class _BblfshClientStub:
+    """`ProtocolServiceStub` for `parse_uasts()` which calls the public `BblfshClient.parse()`."""
+
+    def __init__(self, client: BblfshClient):
+        self._client = client
+
+    def Parse(self, request: ParseRequest, timeout: Optional[float] = None,  # noqa: N802
+              ) -> ParseResponse:
+        return self._client.parse(request.filename, language=request.language or None,
+                                  contents=request.content.encode(), timeout=timeout)
+
+
 def filter_files(files: Dict[str, File], line_length_limit: int, overall_size_limit: int,
                  random_state: int = 7, log: Optional[logging.Logger] = None) -> List[File]:
     """
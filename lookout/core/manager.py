@@ -1,17 +1,29 @@
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+import functools
 import logging
-from typing import Iterable, Optional, Sequence
+import threading
+import time
+from typing import Any, Callable, Iterable, List, Optional, Sequence, Tuple, \
+    TYPE_CHECKING
 
 from google.protobuf.struct_pb2 import ListValue as ProtobufList
 from google.protobuf.struct_pb2 import Struct as ProtobufStruct
+import grpc
 
 from lookout.core.analyzer import Analyzer, AnalyzerModel, DummyAnalyzerModel, ReferencePointer
 from lookout.core.api.event_pb2 import PushEvent, ReviewEvent
-from lookout.core.api.service_analyzer_pb2 import EventResponse
-from lookout.core.data_requests import DataService
+from lookout.core.api.service_analyzer_pb2 import Comment, EventResponse
+from lookout.core.data_requests import DataService, request_changes, request_filters
 from lookout.core.event_listener import EventHandlers
 from lookout.core.metrics import record_event
 from lookout.core.model_repository import ModelRepository
 from lookout.core.ports import Type
+from lookout.core.push_scheduler import PushScheduler
+from lookout.core.shared_changes import merge_changes_requirements, SharedChanges
+if TYPE_CHECKING:
+    # grpc.aio is not available in Python 3.5, so the import is optional
+    from lookout.core.async_data_requests import AsyncDataService  # noqa: F401
 
 
 class AnalyzerManager(EventHandlers):
@@ -20,24 +32,85 @@ class AnalyzerManager(EventHandlers):
 
     Relies on a `ModelRepository` to retrieve and update the models. Also requires the address
     of the data (UAST, contents) gRPC service, typically running in the same Lookout server.
+    The concurrent requests to train the same model for the same repository share one training,
+    see also `ModelRepository.training_lock()`.
     """
 
     _log = logging.getLogger("AnalyzerManager")
 
+    DEFAULT_MAX_UPDATE_CHANGES = 1000
+
     def __init__(self, analyzers: Iterable[Type[Analyzer]], model_repository: ModelRepository,
-                 data_service: DataService):
+                 data_service: DataService,
+                 async_data_service: Optional["AsyncDataService"] = None,
+                 max_update_changes: int = DEFAULT_MAX_UPDATE_CHANGES,
+                 analyzer_workers: int = 0, analyzer_timeout: float = 0,
+                 share_changes: bool = False,
+                 shared_changes_memory: int = SharedChanges.DEFAULT_MAX_MEMORY,
+                 background_training: bool = False, training_workers: int = 1,
+                 push_debounce: float = 0, push_max_delay: float = 0):
         """
         Initialize a new instance of the AnalyzerManager class.
 
         :param analyzers: Analyzer types to manage (not instances!).
         :param model_repository: Injected implementor of the `ModelRepository` interface.
         :param data_service: gRPC data retrieval service to fetch UASTs and files.
+        :param async_data_service: asyncio version of `data_service` which is passed to the \
+                                   analyzers with `async def` methods.
+        :param max_update_changes: Maximum number of changed files since the revision of the \
+                                   model to call `Analyzer.update()` instead of \
+                                   `Analyzer.train()` on Push events. 0 disables the updates.
+        :param analyzer_workers: Number of threads which run the analyzers of Review events \
+                                 concurrently. A failed analyzer does not affect the others' \
+                                 comments then. 0 runs the analyzers one after another.
+        :param analyzer_timeout: Maximum number of seconds to wait for each analyzer since \
+                                 the beginning of the concurrent processing of a Review event. \
+                                 The late analyzers are not interrupted, but their comments \
+                                 are dropped. 0 means no timeout. Ignored if `analyzer_workers` \
+                                 is 0.
+        :param share_changes: Value indicating whether to fetch the changes of a Review event \
+                              once for all the analyzers decorated with \
+                              `with_changed_uasts()` and the likes. Each analyzer receives \
+                              its own copies of the changes which it requested.
+        :param shared_changes_memory: Maximum size of the shared changes to keep in memory \
+                                      (in bytes). The rest are stored in a temporary file.
+        :param background_training: Value indicating whether to train the missing models of \
+                                    Review events in the background instead of before the \
+                                    analysis. Such reviews are answered immediately by \
+                                    `Analyzer.untrained_fallback` or without comments, the \
+                                    next reviews use the trained models.
+        :param training_workers: Number of threads which train the models in the background. \
+                                 Ignored if `background_training` is False and \
+                                 `push_debounce` is 0.
+        :param push_debounce: Number of seconds to wait for the next Push event of the same \
+                              repository before training. The Push events are acknowledged \
+                              immediately and the pending ones are collapsed into the newest, \
+                              see `PushScheduler`. 0 processes each Push event synchronously.
+        :param push_max_delay: Maximum number of seconds to postpone the training since the \
+                               oldest pending Push event of the repository. 0 means unlimited. \
+                               Ignored if `push_debounce` is 0.
         """
         self._model_repository = model_repository
         analyzers = [(a.__name__, a) for a in analyzers]
         analyzers.sort()
         self._analyzers = [a[1] for a in analyzers]
         self._data_service = data_service
+        self._async_data_service = async_data_service
+        self._event_loops = threading.local()
+        self._max_update_changes = max_update_changes
+        self._analyzer_executor = ThreadPoolExecutor(max_workers=analyzer_workers) \
+            if analyzer_workers > 0 else None
+        self._analyzer_timeout = analyzer_timeout
+        self._share_changes = share_changes
+        self._shared_changes_memory = shared_changes_memory
+        self._training_executor = ThreadPoolExecutor(max_workers=training_workers) \
+            if background_training else None
+        # (model_id, url) -> training which is queued or running
+        self._trainings = {}  # type: Dict[Tuple[str, str], Future]
+        self._trainings_lock = threading.Lock()
+        self._push_scheduler = PushScheduler(
+            self._process_push_event, push_debounce, push_max_delay, training_workers) \
+            if push_debounce > 0 else None
 
     def __str__(self) -> str:
         """Summarize AnalyzerManager as a string."""
@@ -58,30 +131,21 @@ class AnalyzerManager(EventHandlers):
         head_ptr = ReferencePointer.from_pb(request.commit_revision.head)
         response = EventResponse()
         response.analyzer_version = self.version
-        comments = []
-        for analyzer in self._analyzers:
-            try:
-                mycfg = self._protobuf_struct_to_dict(request.configuration[analyzer.name])
-                self._log.info("%s config: %s", analyzer.name, mycfg)
-            except (KeyError, ValueError):
-                mycfg = {}
-                self._log.debug("no config was provided for %s", analyzer.name)
-            if analyzer.model_type != DummyAnalyzerModel:
-                model = self._get_model(analyzer, base_ptr.url)
-                if model is None:
-                    self._log.info("training: %s", analyzer.name)
-                    record_event("%s.train" % analyzer.name, 1)
-                    model = analyzer.train(base_ptr, mycfg, self._data_service)
-                    self._model_repository.set(self._model_id(analyzer), base_ptr.url, model)
+        shared_changes = self._fetch_shared_changes(base_ptr, head_ptr) \
+            if self._share_changes else None
+        try:
+            if self._analyzer_executor is not None:
+                comments = self._review_concurrently(request, base_ptr, head_ptr,
+                                                     shared_changes)
             else:
-                model = DummyAnalyzerModel()
-            self._log.debug("running %s", analyzer.name)
-            record_event("%s.analyze" % analyzer.name, 1)
-            results = analyzer(model, head_ptr.url, mycfg).analyze(
-                base_ptr, head_ptr, self._data_service)
-            self._log.info("%s: %d comments", analyzer.name, len(results))
-            record_event("%s.comments" % analyzer.name, len(results))
-            comments.extend(results)
+                comments = []
+                for analyzer in self._analyzers:
+                    comments.extend(self._review(analyzer, request, base_ptr, head_ptr,
+                                                 shared_changes))
+        finally:
+            # the analyzers which timed out fail if they are still reading the changes
+            if shared_changes is not None:
+                shared_changes.close()
         response.comments.extend(comments)
         return response
 
@@ -89,29 +153,29 @@ class AnalyzerManager(EventHandlers):
         """
         Callback for push events invoked by EventListener.
         """
-        ptr = ReferencePointer.from_pb(request.commit_revision.head)
-        data_service = self._data_service
-        for analyzer in self._analyzers:
-            if analyzer.model_type == DummyAnalyzerModel:
-                continue
-            try:
-                mycfg = self._protobuf_struct_to_dict(request.configuration[analyzer.name])
-            except (KeyError, ValueError):
-                mycfg = {}
-            model = self._get_model(analyzer, ptr.url)
-            if model is not None:
-                must_train = analyzer.check_training_required(model, ptr, mycfg, data_service)
-                if not must_train:
-                    self._log.info("skipped training %s", analyzer.name)
-                    continue
-            self._log.debug("training %s", analyzer.name)
-            record_event("%s.train" % analyzer.name, 1)
-            model = analyzer.train(ptr, mycfg, data_service)
-            self._model_repository.set(self._model_id(analyzer), ptr.url, model)
+        if self._push_scheduler is not None:
+            self._push_scheduler.submit(request)
+        else:
+            self._process_push_event(request)
         response = EventResponse()
         response.analyzer_version = self.version
         return response
 
+    def shutdown(self, wait: bool = False):
+        """
+        Stop the threads which run the analyzers concurrently and train the models in the \
+        background. The running analyzers and trainings are not interrupted.
+
+        :param wait: Value indicating whether to wait until the queued trainings finish, \
+                     including the pending Push events.
+        """
+        if self._push_scheduler is not None:
+            self._push_scheduler.shutdown(wait=wait)
+        if self._analyzer_executor is not None:
+            self._analyzer_executor.shutdown(wait=wait)
+        if self._training_executor is not None:
+            self._training_executor.shutdown(wait=wait)
+
     def warmup(self, urls: Sequence[str]):
         """
         Warm up the model cache (which supposedly exists in the injected `ModelRepository`). \
@@ -153,6 +217,262 @@ class AnalyzerManager(EventHandlers):
                         d[key] = int(d[key])
         return mycfg
 
+    def _process_push_event(self, request: PushEvent):
+        ptr = ReferencePointer.from_pb(request.commit_revision.head)
+        for analyzer in self._analyzers:
+            if analyzer.model_type == DummyAnalyzerModel:
+                continue
+            try:
+                mycfg = self._protobuf_struct_to_dict(request.configuration[analyzer.name])
+            except (KeyError, ValueError):
+                mycfg = {}
+            model = self._get_model(analyzer, ptr.url)
+            if model is not None:
+                must_train = self._call(analyzer.check_training_required, model, ptr, mycfg)
+                if not must_train:
+                    self._log.info("skipped training %s", analyzer.name)
+                    continue
+                if self._should_update(analyzer, model, ptr):
+                    self._log.debug("updating %s", analyzer.name)
+                    self._train(analyzer, ptr, mycfg, base_model=model)
+                    continue
+            self._log.debug("training %s", analyzer.name)
+            self._train(analyzer, ptr, mycfg)
+
+    def _review(self, analyzer: Type[Analyzer], request: ReviewEvent,
+                base_ptr: ReferencePointer, head_ptr: ReferencePointer,
+                shared_changes: Optional[SharedChanges] = None) -> List[Comment]:
+        try:
+            mycfg = self._protobuf_struct_to_dict(request.configuration[analyzer.name])
+            self._log.info("%s config: %s", analyzer.name, mycfg)
+        except (KeyError, ValueError):
+            mycfg = {}
+            self._log.debug("no config was provided for %s", analyzer.name)
+        if analyzer.model_type != DummyAnalyzerModel:
+            model = self._get_model(analyzer, base_ptr.url)
+            if model is None and self._training_executor is not None:
+                self._train_in_background(analyzer, base_ptr, mycfg)
+                fallback = analyzer.untrained_fallback
+                if fallback is None:
+                    return []
+                self._log.info("running %s instead of %s until the model is trained",
+                               fallback.name, analyzer.name)
+                # the fallback's data requirements were not taken into account
+                analyzer, model, shared_changes = fallback, DummyAnalyzerModel(), None
+            elif model is None:
+                self._log.info("training: %s", analyzer.name)
+                model = self._train(analyzer, base_ptr, mycfg)
+        else:
+            model = DummyAnalyzerModel()
+        self._log.debug("running %s", analyzer.name)
+        record_event("%s.analyze" % analyzer.name, 1)
+        analyze = analyzer(model, head_ptr.url, mycfg).analyze
+        if shared_changes is not None and hasattr(analyze, "changes_requirements"):
+            results = self._call(analyze, base_ptr, head_ptr, shared_changes=shared_changes)
+        else:
+            results = self._call(analyze, base_ptr, head_ptr)
+        self._log.info("%s: %d comments", analyzer.name, len(results))
+        record_event("%s.comments" % analyzer.name, len(results))
+        return results
+
+    def _review_concurrently(self, request: ReviewEvent, base_ptr: ReferencePointer,
+                             head_ptr: ReferencePointer,
+                             shared_changes: Optional[SharedChanges]) -> List[Comment]:
+        deadline = time.monotonic() + self._analyzer_timeout
+        futures = [self._analyzer_executor.submit(self._review, analyzer, request, base_ptr,
+                                                  head_ptr, shared_changes)
+                   for analyzer in self._analyzers]
+        comments = []
+        # the comments are merged in the order of the analyzers regardless of the completion
+        for analyzer, future in zip(self._analyzers, futures):
+            timeout = max(deadline - time.monotonic(), 0) if self._analyzer_timeout > 0 \
+                else None
+            try:
+                comments.extend(future.result(timeout=timeout))
+            except TimeoutError:
+                future.cancel()
+                self._log.error("%s timed out after %.1fs", analyzer.name,
+                                self._analyzer_timeout)
+                record_event("%s.timeout" % analyzer.name, 1)
+            except Exception:
+                self._log.exception("%s failed", analyzer.name)
+                record_event("%s.error" % analyzer.name, 1)
+        return comments
+
+    def _train(self, analyzer: Type[Analyzer], ptr: ReferencePointer, config: dict,
+               base_model: Optional[AnalyzerModel] = None) -> AnalyzerModel:
+        """
+        Train and store the model, or update `base_model` if it is specified. If the same \
+        model is already being trained or updated for the same repository, wait for that \
+        training and return its result instead, provided that it was trained at the same commit.
+        """
+        key = self._model_id(analyzer), ptr.url
+        while True:
+            with self._trainings_lock:
+                training = self._trainings.get(key)
+                joined = training is not None
+                if not joined:
+                    training = self._register_training(key)
+            if not joined:
+                return self._run_training(key, training, analyzer, ptr, config, base_model)
+            self._log.info("%s: waiting for the training in progress for %s", analyzer.name,
+                           ptr.url)
+            model = training.result()
+            if model.ptr.commit == ptr.commit:
+                record_event("%s.train.deduplicated" % analyzer.name, 1)
+                return model
+            self._log.info("%s: the finished training was at %s, training at %s",
+                           analyzer.name, model.ptr.commit, ptr.commit)
+
+    def _train_in_background(self, analyzer: Type[Analyzer], ptr: ReferencePointer,
+                             config: dict):
+        key = self._model_id(analyzer), ptr.url
+        with self._trainings_lock:
+            if key in self._trainings:
+                self._log.info("%s: already training for %s", analyzer.name, ptr.url)
+                return
+            training = self._register_training(key)
+        self._log.info("%s: queued training for %s", analyzer.name, ptr.url)
+        try:
+            self._training_executor.submit(self._run_training, key, training, analyzer, ptr,
+                                           config)
+        except RuntimeError:
+            # the executor has been shut down
+            self._unregister_training(key)
+            raise
+        training.add_done_callback(functools.partial(self._report_background_training, key))
+
+    def _register_training(self, key: Tuple[str, str]) -> Future:
+        # the caller holds self._trainings_lock
+        self._trainings[key] = training = Future()
+        record_event("AnalyzerManager.training.queue", len(self._trainings))
+        return training
+
+    def _unregister_training(self, key: Tuple[str, str]):
+        with self._trainings_lock:
+            del self._trainings[key]
+            record_event("AnalyzerManager.training.queue", len(self._trainings))
+
+    def _run_training(self, key: Tuple[str, str], training: Future, analyzer: Type[Analyzer],
+                      ptr: ReferencePointer, config: dict,
+                      base_model: Optional[AnalyzerModel] = None) -> AnalyzerModel:
+        try:
+            model = self._train_exclusively(analyzer, ptr, config, base_model)
+        except BaseException as e:
+            # the waiters which need another commit must not join the finished training
+            self._unregister_training(key)
+            training.set_exception(e)
+            raise
+        self._unregister_training(key)
+        training.set_result(model)
+        return model
+
+    def _train_exclusively(self, analyzer: Type[Analyzer], ptr: ReferencePointer,
+                           config: dict, base_model: Optional[AnalyzerModel] = None,
+                           ) -> AnalyzerModel:
+        model_id = self._model_id(analyzer)
+        with self._model_repository.training_lock(model_id, ptr.url) as waited:
+            if waited:
+                # the stored model may be older than the requested commit or come from the cache
+                model, _ = self._model_repository.get(model_id, analyzer.model_type, ptr.url)
+                if model is not None and model.ptr.commit == ptr.commit:
+                    self._log.info("%s: another process has trained the model for %s",
+                                   analyzer.name, ptr.url)
+                    record_event("%s.train.deduplicated" % analyzer.name, 1)
+                    return model
+                if base_model is not None and model is not None:
+                    # update the model which the other process has just stored
+                    base_model = model
+            if base_model is not None:
+                record_event("%s.update" % analyzer.name, 1)
+                model = self._call(analyzer.update, base_model, base_model.ptr, ptr, config)
+            else:
+                record_event("%s.train" % analyzer.name, 1)
+                start = time.monotonic()
+                model = self._call(analyzer.train, ptr, config)
+                record_event("%s.train.duration" % analyzer.name, time.monotonic() - start)
+            self._model_repository.set(model_id, ptr.url, model)
+            return model
+
+    def _report_background_training(self, key: Tuple[str, str], training: Future):
+        error = training.exception()
+        if error is not None:
+            self._log.error("failed to train %s for %s: %s: %s", key[0], key[1],
+                            type(error).__name__, error)
+            record_event("AnalyzerManager.training.error", 1)
+        else:
+            self._log.info("trained %s for %s", *key)
+
+    def _call(self, method: Callable, *args, **kwargs) -> Any:
+        """
+        Invoke the analyzer's method with the data service appended to the arguments. \
+        `kwargs` are passed to the method as `**data`.
+
+        The channel borrowed by the current thread is returned to the pool afterwards. \
+        Coroutine functions receive `AsyncDataService` and run to completion in the event loop \
+        of the current thread.
+        """
+        if not asyncio.iscoroutinefunction(method):
+            try:
+                return method(*args, self._data_service, **kwargs)
+            finally:
+                self._data_service.release_channel()
+        if self._async_data_service is None:
+            raise ValueError("%s is a coroutine function and requires AsyncDataService" %
+                             method.__qualname__)
+        loop = getattr(self._event_loops, "loop", None)
+        if loop is None:
+            self._event_loops.loop = loop = asyncio.new_event_loop()
+        return loop.run_until_complete(method(*args, self._async_data_service, **kwargs))
+
+    def _fetch_shared_changes(self, base_ptr: ReferencePointer, head_ptr: ReferencePointer,
+                              ) -> Optional[SharedChanges]:
+        requirements = [(analyzer.analyze.changes_requirements, request_filters(analyzer))
+                        for analyzer in self._analyzers
+                        if hasattr(analyzer.analyze, "changes_requirements")]
+        if len(requirements) < 2:
+            return None
+        try:
+            shared_changes = SharedChanges.fetch(
+                self._data_service, base_ptr, head_ptr, max_memory=self._shared_changes_memory,
+                **merge_changes_requirements(requirements))
+        except grpc.RpcError as e:
+            self._log.warning("failed to fetch the shared changes, the analyzers will request "
+                              "them separately: %s", e)
+            return None
+        self._log.info("fetched %s for %d analyzers", shared_changes, len(requirements))
+        return shared_changes
+
+    def _should_update(self, analyzer: Type[Analyzer], model: AnalyzerModel,
+                       ptr: ReferencePointer) -> bool:
+        if self._max_update_changes <= 0 or not analyzer.supports_update() or \
+                model.ptr.url != ptr.url:
+            return False
+        changes = request_changes(
+            self._data_service.get_data(), model.ptr, ptr, contents=False, uast=False,
+            unicode=False, **request_filters(analyzer))
+        count = 0
+        try:
+            for _ in changes:
+                count += 1
+                if count > self._max_update_changes:
+                    self._log.info("%s: more than %d files changed since %s, training",
+                                   analyzer.name, self._max_update_changes, model.ptr.commit)
+                    return False
+        except grpc.RpcError as e:
+            self._log.warning("%s: failed to list the changes since %s, training: %s",
+                              analyzer.name, model.ptr.commit, e)
+            self._data_service.close_channel()
+            return False
+        finally:
+            # cancel the RPC which is still streaming the changes
+            cancel = getattr(changes, "cancel", None) or getattr(changes, "close", None)
+            if cancel is not None:
+                cancel()
+            self._data_service.release_channel()
+        self._log.info("%s: %d files changed since %s", analyzer.name, count, model.ptr.commit)
+        return True
+
     def _get_model(self, analyzer: Type[Analyzer], url: str) -> Optional[AnalyzerModel]:
         model, cache_miss = self._model_repository.get(
             self._model_id(analyzer), analyzer.model_type, url)
@@ -1,4 +1,5 @@
-from typing import Optional, Tuple
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
 
 from lookout.core.analyzer import AnalyzerModel
 from lookout.core.ports import Type
@@ -36,6 +37,20 @@ class ModelRepository:
         """
         raise NotImplementedError
 
+    @contextmanager
+    def training_lock(self, model_id: str, url: str) -> Iterator[bool]:
+        """
+        Prevent the other processes from training the model for the specified key \
+        (`model_id`) and the repository (`url`) within the context. The default implementation \
+        does not coordinate with the other processes.
+
+        :param model_id: The key of the model (based on the bound analyzer name and version).
+        :param url: Git repository remote.
+        :return: Context manager which returns the value indicating whether another process \
+                 held the lock before, so the model has probably been just trained.
+        """
+        yield False
+
     def init(self):
         """
         Initialize the persistent data structures of this storage.
@@ -0,0 +1,142 @@
+"""Debounce the Push events and coalesce them per repository."""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+from lookout.core.api.event_pb2 import PushEvent
+from lookout.core.metrics import record_event
+
+
+class _PendingPush:
+    __slots__ = ("request", "first", "last", "count")
+
+    def __init__(self, request: PushEvent, now: float):
+        self.request = request
+        self.first = now
+        self.last = now
+        self.count = 1
+
+
+class PushScheduler:
+    """
+    Processes the Push events in the background after they stop arriving for each repository.
+
+    The Push events for the same repository which arrive less than `debounce` seconds apart are \
+    collapsed into the newest one. Each repository is processed at most `max_delay` seconds \
+    after its oldest pending Push event and never concurrently with itself: the events which \
+    arrive during the processing wait for it to finish.
+    """
+
+    _log = logging.getLogger("PushScheduler")
+
+    def __init__(self, process: Callable[[PushEvent], Any], debounce: float,
+                 max_delay: float = 0, workers: int = 1):
+        """
+        Initialize a new instance of `PushScheduler` and start the dispatching thread.
+
+        :param process: Function to call with the newest pending Push event of a repository.
+        :param debounce: Number of seconds to wait for the next Push event of the same \
+                         repository before processing.
+        :param max_delay: Maximum number of seconds to postpone the processing of a repository \
+                          since its oldest pending Push event. 0 means unlimited.
+        :param workers: Number of threads which process the events.
+        """
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._process = process
+        self._pending = {}  # type: Dict[str, _PendingPush]
+        self._running = set()  # type: Set[str]
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._thread = threading.Thread(target=self._dispatch, name="PushScheduler",
+                                        daemon=True)
+        self._thread.start()
+
+    def __str__(self) -> str:
+        """Summarize the instance of PushScheduler as a string."""
+        return "PushScheduler(debounce=%s, max_delay=%s)" % (self.debounce, self.max_delay)
+
+    def submit(self, request: PushEvent):
+        """
+        Schedule the processing of the Push event. Does *not* block.
+
+        :param request: Push event. It replaces the pending event of the same repository.
+        """
+        url = request.commit_revision.head.internal_repository_url
+        now = time.monotonic()
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError("%s has been shut down" % self)
+            pending = self._pending.get(url)
+            if pending is None:
+                self._pending[url] = _PendingPush(request, now)
+            else:
+                self._log.debug("%s: replaced %s with %s", url,
+                                pending.request.commit_revision.head.hash,
+                                request.commit_revision.head.hash)
+                pending.request = request
+                pending.last = now
+                pending.count += 1
+            record_event("PushScheduler.pending", len(self._pending))
+            self._condition.notify()
+
+    def shutdown(self, wait: bool = False):
+        """
+        Stop accepting the Push events.
+
+        :param wait: Value indicating whether to process the pending events immediately and \
+                     wait for all of them. Otherwise, the pending events are discarded and \
+                     the running ones are not waited for.
+        """
+        with self._condition:
+            self._stopped = True
+            if not wait:
+                if self._pending:
+                    self._log.warning("discarded %d pending push events", len(self._pending))
+                self._pending.clear()
+            self._condition.notify()
+        if wait:
+            self._thread.join()
+        self._executor.shutdown(wait=wait)
+
+    def _due(self, pending: _PendingPush) -> float:
+        due = pending.last + self.debounce
+        if self.max_delay > 0:
+            due = min(due, pending.first + self.max_delay)
+        return due
+
+    def _dispatch(self):
+        with self._condition:
+            while not self._stopped or self._pending:
+                now = time.monotonic()
+                next_due = None  # type: Optional[float]
+                for url, pending in list(self._pending.items()):
+                    if url in self._running:
+                        continue
+                    due = self._due(pending)
+                    if due <= now or self._stopped:
+                        del self._pending[url]
+                        self._running.add(url)
+                        self._executor.submit(self._run, url, pending)
+                    elif next_due is None or due < next_due:
+                        next_due = due
+                self._condition.wait(next_due - now if next_due is not None else None)
+
+    def _run(self, url: str, pending: _PendingPush):
+        self._log.info("%s: processing %s, coalesced %d push events", url,
+                       pending.request.commit_revision.head.hash, pending.count)
+        record_event("PushScheduler.coalesced", pending.count - 1)
+        record_event("PushScheduler.delay", time.monotonic() - pending.first)
+        try:
+            self._process(pending.request)
+        except Exception:
+            self._log.exception("%s: failed to process %s", url,
+                                pending.request.commit_revision.head.hash)
+            record_event("PushScheduler.error", 1)
+        finally:
+            with self._condition:
+                self._running.discard(url)
+                self._condition.notify()
@@ -0,0 +1,261 @@
+"""Changes which are fetched once per Review event and shared by several analyzers."""
+import functools
+import logging
+import re
+import tempfile
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+import grpc
+
+from lookout.core.analyzer import ReferencePointer
+from lookout.core.api.service_data_pb2 import Change
+from lookout.core.bytes_to_unicode_converter import BytesToUnicodeConverter, UnicodeFileCache
+from lookout.core.data_requests import ChangesRequirements, convert_to_unicode, \
+    count_identical_changes, DataService, make_change_filter, request_changes, \
+    UnicodeConversionPool
+from lookout.core.metrics import record_event
+
+
+class SharedChanges:
+    """
+    Append-only sequence of `Change`-s which can be iterated many times, possibly \
+    concurrently.
+
+    The changes are stored serialized: in memory up to `max_memory` bytes and in a temporary \
+    file beyond. Each iteration deserializes new messages, so that the consumers can modify \
+    them, e.g. convert to Unicode in place.
+    """
+
+    DEFAULT_MAX_MEMORY = 256 << 20
+
+    _log = logging.getLogger("SharedChanges")
+
+    def __init__(self, max_memory: int = DEFAULT_MAX_MEMORY):
+        """
+        Initialize a new instance of `SharedChanges`.
+
+        :param max_memory: Maximum total size of the serialized changes to keep in memory. \
+                           The rest are spilled to disk.
+        """
+        self.max_memory = max_memory
+        self._memory = 0
+        # either the serialized change or its offset and size in the spill file
+        self._items = []  # type: List[Union[bytes, Tuple[int, int]]]
+        self._file = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of stored changes."""
+        return len(self._items)
+
+    def __str__(self) -> str:
+        """Summarize the instance of SharedChanges as a string."""
+        return "SharedChanges(%d changes, %d bytes in memory, %s)" % (
+            len(self), self._memory, "spilled" if self._file is not None else "not spilled")
+
+    def __iter__(self) -> Iterator[Change]:
+        """
+        Iterate over new copies of the changes which are stored when the iteration starts.
+
+        :raise ValueError: if the instance is closed while reading the spilled changes.
+        """
+        with self._lock:
+            # close() replaces the list, append() may extend it concurrently
+            items = self._items[:]
+        for item in items:
+            if isinstance(item, tuple):
+                offset, size = item
+                with self._lock:
+                    if self._file is None:
+                        raise ValueError("%s is closed" % self)
+                    self._file.seek(offset)
+                    item = self._file.read(size)
+            yield Change.FromString(item)
+
+    @property
+    def spilled(self) -> bool:
+        """Return the value indicating whether some changes are stored on disk."""
+        return self._file is not None
+
+    def append(self, change: Change):
+        """
+        Store the change.
+
+        :param change: Change to store. It is serialized, so it can be modified afterwards.
+        """
+        data = change.SerializeToString()
+        with self._lock:
+            if self._file is None and self._memory + len(data) > self.max_memory:
+                self._log.info("spilling the changes to disk after %d bytes", self._memory)
+                self._file = tempfile.TemporaryFile(prefix="lookout-changes-")
+            if self._file is None:
+                self._memory += len(data)
+                self._items.append(data)
+                return
+            offset = self._file.seek(0, 2)
+            self._file.write(data)
+            self._items.append((offset, len(data)))
+
+    def close(self):
+        """
+        Release the stored changes and delete the spill file.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._items = []
+            self._memory = 0
+
+    def view(self, contents: bool, uast: bool, unicode: bool, lazy: bool = False,
+             unicode_pool: Optional[UnicodeConversionPool] = None,
+             unicode_cache: Optional[UnicodeFileCache] = None, languages: Iterable[str] = (),
+             include_pattern: Optional[str] = None, max_file_size: int = 0,
+             skip_identical: bool = False) -> Iterator[Change]:
+        """
+        Iterate over the changes like `request_changes()` would stream them with the same \
+        arguments.
+
+        The stored changes must have been requested with a superset of the arguments, see \
+        `merge_changes_requirements()`. The fields which were not asked for are cleared and \
+        the extra changes are dropped.
+
+        :param contents: Value indicating whether to keep the file contents.
+        :param uast: Value indicating whether to keep the UASTs.
+        :param unicode: Value indicating whether to convert the files to `UnicodeFile`-s.
+        :param lazy: Value indicating whether the Unicode conversion should be postponed until \
+                     the converted fields are accessed. Ignored if `unicode` is False.
+        :param unicode_pool: Pool to run the Unicode conversion in parallel. Ignored if \
+                             `unicode` is False or `lazy` is True.
+        :param unicode_cache: Cache of the files converted to Unicode. Ignored if `unicode` is \
+                              False or `lazy` is True.
+        :param languages: Names of the languages to keep. Empty means all.
+        :param include_pattern: Regular expression which the paths must match.
+        :param max_file_size: Maximum size of the raw file contents in bytes. The bigger files \
+                              are dropped. 0 means unlimited. Ignored if `contents` is False.
+        :param skip_identical: Value indicating whether to drop the changes with identical \
+                               `base` and `head`, see \
+                               `BytesToUnicodeConverter.has_identical_sides()`.
+        :return: Iterator over the copies of the stored changes.
+        """
+        # request_changes() cannot check the sizes if the contents were not requested
+        changes = self._filter(make_change_filter(languages, max_file_size if contents else 0),
+                               include_pattern)
+        changes = map(functools.partial(self._clear_fields, contents=contents, uast=uast),
+                      changes)
+        if contents or uast:
+            changes = count_identical_changes(changes, skip_identical)
+        if unicode:
+            changes = convert_to_unicode(
+                functools.partial(BytesToUnicodeConverter.convert_change, share_identical=True),
+                changes, lazy, unicode_pool, unicode_cache)
+        return changes
+
+    @classmethod
+    def fetch(cls, data_service: DataService, ptr_from: ReferencePointer,
+              ptr_to: ReferencePointer, contents: bool, uast: bool,
+              languages: Iterable[str] = (), include_pattern: Optional[str] = None,
+              max_memory: int = DEFAULT_MAX_MEMORY) -> "SharedChanges":
+        """
+        Request the changes from the data service and store all of them.
+
+        :param data_service: Data service to request the changes from. The channel of the \
+                             current thread is released afterwards and discarded on RPC \
+                             failures.
+        :param ptr_from: Git repository state pointer to the base revision.
+        :param ptr_to: Git repository state pointer to the head revision.
+        :param contents: Value indicating whether to request the file contents.
+        :param uast: Value indicating whether to request the UASTs.
+        :param languages: Names of the languages to request. Empty means all.
+        :param include_pattern: Regular expression which the requested paths must match.
+        :param max_memory: Maximum total size of the serialized changes to keep in memory.
+        :return: New `SharedChanges`.
+        """
+        shared = cls(max_memory)
+        try:
+            for change in request_changes(
+                    data_service.get_data(), ptr_from, ptr_to, contents=contents, uast=uast,
+                    unicode=False, prefetch_bytes=data_service.prefetch_bytes,
+                    retries=data_service.stream_retries,
+                    retry_backoff=data_service.stream_retry_backoff,
+                    reconnect=data_service.reconnect_data, languages=languages,
+                    include_pattern=include_pattern,
+                    measure_bytes=data_service.measure_stream_bytes):
+                shared.append(change)
+        except grpc.RpcError as e:
+            shared.close()
+            data_service.close_channel()
+            raise e from None
+        except BaseException:
+            shared.close()
+            raise
+        finally:
+            data_service.release_channel()
+        record_event("SharedChanges.count", len(shared))
+        record_event("SharedChanges.spilled", int(shared.spilled))
+        return shared
+
+    def _filter(self, accept: Optional[Callable[[Change], bool]],
+                include_pattern: Optional[str]) -> Iterator[Change]:
+        include_regexp = re.compile(include_pattern) if include_pattern else None
+        for change in self:
+            if include_regexp is not None and not all(
+                    include_regexp.search(side.path)
+                    for side in (change.base, change.head) if side.path):
+                continue
+            if accept is not None and not accept(change):
+                continue
+            yield change
+
+    @staticmethod
+    def _clear_fields(change: Change, contents: bool, uast: bool) -> Change:
+        for side in (change.base, change.head):
+            if not contents:
+                side.ClearField("content")
+            if not uast:
+                side.ClearField("uast")
+        return change
+
+
+def merge_changes_requirements(requirements: Iterable[Tuple[ChangesRequirements, Dict[str, Any]]],
+                               ) -> Dict[str, Any]:
+    """
+    Combine the data requirements of several analyzers into one request which satisfies \
+    all of them.
+
+    :param requirements: Pairs of the requirements declared by `with_changed_uasts()` and \
+                         the likes and the result of `request_filters()` for each analyzer.
+    :return: Keyword arguments for `SharedChanges.fetch()`: "contents", "uast", "languages" \
+             and "include_pattern". The file size limits are applied by each view.
+    """
+    contents = uast = False
+    languages = set()
+    all_languages = False
+    patterns = []
+    any_pattern = False
+    for declared, filters in requirements:
+        contents |= declared.contents
+        uast |= declared.uast
+        if filters["languages"]:
+            languages.update(lang.lower() for lang in filters["languages"])
+        else:
+            all_languages = True
+        pattern = filters["include_pattern"]
+        if pattern:
+            if pattern not in patterns:
+                patterns.append(pattern)
+        else:
+            any_pattern = True
+    if any_pattern or not patterns:
+        include_pattern = None
+    elif len(patterns) == 1:
+        include_pattern = patterns[0]
+    else:
+        include_pattern = "|".join("(?:%s)" % p for p in patterns)
+    return {
+        "contents": contents,
+        "uast": uast,
+        "languages": () if all_languages else tuple(sorted(languages)),
+        "include_pattern": include_pattern,
+    }
@@ -1,14 +1,17 @@
 from contextlib import contextmanager
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
 import os
 import threading
-from typing import Optional, Tuple
+import time
+from typing import Iterator, Optional, Tuple
 from urllib.parse import urlparse, urlunparse
+import uuid
 
 import cachetools
 from pympler.asizeof import asizeof
 from sqlalchemy import and_, bindparam, Column, create_engine, DateTime, String, VARCHAR
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext import baked
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
@@ -32,6 +35,16 @@ class Model(Base):
     updated = Column(DateTime(timezone=True), default=datetime.utcnow)
 
 
+class TrainingLock(Base):
+    """Model which is being trained by one of the processes which share the database."""
+
+    __tablename__ = "training_locks"
+    analyzer = Column(String(40), primary_key=True)
+    repository = Column(String(40 + 100), primary_key=True)
+    owner = Column(String(32))
+    expires = Column(DateTime)
+
+
 class ContextSessionMaker:
     """
     Adds the `__enter__()`/`__exit__()` to an SQLAlchemy session and thus automatically closes it.
@@ -56,7 +69,8 @@ class SQLAlchemyModelRepository(ModelRepository):
     _log = logging.getLogger("SQLAlchemyModelRepository")
 
     def __init__(self, db_endpoint: str, fs_root: str, max_cache_mem: int, ttl: int,
-                 engine_kwargs: dict=None):
+                 engine_kwargs: dict=None, training_lock_ttl: int = 0,
+                 training_lock_poll: float = 1):
         """
         Initialize a new instance of SQLAlchemyModelRepository.
 
@@ -65,6 +79,12 @@ class SQLAlchemyModelRepository(ModelRepository):
         :param max_cache_mem: Maximum memory size to use for model cache (in bytes).
         :param ttl: Time-to-live for each model in the cache (in seconds).
         :param engine_kwargs: Passed directly to SQLAlchemy's `create_engine()`.
+        :param training_lock_ttl: Maximum time to hold the lock of a training in the database \
+                                  (in seconds), see `training_lock()`. The lock of a crashed \
+                                  process expires after it. It should exceed the longest \
+                                  training. 0 disables the locks.
+        :param training_lock_poll: Interval between the attempts to acquire the lock of \
+                                   a training which another process holds (in seconds).
         """
         self.fs_root = fs_root
         # A version of db_endpoint that never contain password is needed for logging
@@ -91,6 +111,10 @@ class SQLAlchemyModelRepository(ModelRepository):
         must_initialize |= not self._engine.has_table(Model.__tablename__)
         if must_initialize:
             Model.metadata.create_all(self._engine)
+        self.training_lock_ttl = training_lock_ttl
+        self.training_lock_poll = training_lock_poll
+        if training_lock_ttl > 0:
+            TrainingLock.__table__.create(self._engine, checkfirst=True)
         self._sessionmaker = ContextSessionMaker(sessionmaker(bind=self._engine))
         bakery = baked.bakery()
         self._get_query = bakery(lambda session: session.query(Model))
@@ -140,6 +164,29 @@ class SQLAlchemyModelRepository(ModelRepository):
             session.commit()
         self._log.debug("set %s with %s", model_id, url)
 
+    @contextmanager
+    def training_lock(self, model_id: str, url: str) -> Iterator[bool]:  # noqa: D102
+        if self.training_lock_ttl <= 0:
+            yield False
+            return
+        owner = uuid.uuid4().hex
+        waited = False
+        while not self._acquire_training_lock(model_id, url, owner):
+            if not waited:
+                self._log.info("waiting for another process to train %s with %s", model_id, url)
+                waited = True
+            time.sleep(self.training_lock_poll)
+        if waited:
+            record_event("SQLAlchemyModelRepository.training_lock.waited", 1)
+        try:
+            yield waited
+        finally:
+            with self._sessionmaker() as session:
+                session.query(TrainingLock).filter(and_(
+                    TrainingLock.analyzer == model_id, TrainingLock.repository == url,
+                    TrainingLock.owner == owner)).delete(synchronize_session=False)
+                session.commit()
+
     def init(self):  # noqa: D102
         self._log.info("initializing")
         Model.metadata.drop_all(self._engine)
@@ -151,6 +198,28 @@ class SQLAlchemyModelRepository(ModelRepository):
         self._cache.clear()
         self._engine.dispose()
 
+    def _acquire_training_lock(self, model_id: str, url: str, owner: str) -> bool:
+        now = datetime.utcnow()
+        expires = now + timedelta(seconds=self.training_lock_ttl)
+        with self._sessionmaker() as session:
+            session.add(TrainingLock(analyzer=model_id, repository=url, owner=owner,
+                                     expires=expires))
+            try:
+                session.commit()
+                return True
+            except IntegrityError:
+                session.rollback()
+            # take over the lock of a crashed process
+            taken = session.query(TrainingLock).filter(and_(
+                TrainingLock.analyzer == model_id, TrainingLock.repository == url,
+                TrainingLock.expires < now)).update(
+                {"owner": owner, "expires": expires}, synchronize_session=False)
+            session.commit()
+            if taken:
+                self._log.warning("took over the expired training lock of %s with %s",
+                                  model_id, url)
+            return taken == 1
+
     @staticmethod
     def split_url(url: str):
         """Explode a Git remote URL into FS-friendly pieces."""
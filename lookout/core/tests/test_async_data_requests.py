@@ -0,0 +1,172 @@
+import asyncio
+from collections import namedtuple
+import unittest
+
+import grpc
+
+from lookout.core.analyzer import ReferencePointer, UnicodeFile
+from lookout.core.api.service_data_pb2 import Change, File
+from lookout.core.tests.test_bytes_to_unicode_converter import create_small_uast
+
+try:
+    from lookout.core.async_data_requests import AsyncDataService, parse_uast, \
+        with_changed_uasts_and_contents_async, with_uasts_async
+    grpc_aio_available = True
+except ImportError:
+    grpc_aio_available = False
+
+
+class FakeStream:
+    def __init__(self, items, error=None):
+        self.items = iter(items)
+        self.error = error
+        self.cancelled = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await asyncio.sleep(0)
+        try:
+            return next(self.items)
+        except StopIteration:
+            if self.error is not None:
+                raise self.error from None
+            raise StopAsyncIteration from None
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakeDataStub:
+    def __init__(self, files, error=None):
+        self.files = files
+        self.error = error
+        self.requests = []
+
+    def GetFiles(self, request):  # noqa: N802
+        self.requests.append(request)
+        return FakeStream(self.files, self.error)
+
+    def GetChanges(self, request):  # noqa: N802
+        self.requests.append(request)
+        return FakeStream([Change(base=file, head=file) for file in self.files], self.error)
+
+
+class FakeAsyncDataService:
+    def __init__(self, stub: FakeDataStub):
+        self.stub = stub
+        self.unicode_cache = None
+        self.closed = False
+
+    def get_data(self):
+        return self.stub
+
+    async def close_channel(self):
+        self.closed = True
+
+
+class FakeBblfshStub:
+    def __init__(self, uast):
+        self.uast = uast
+
+    async def Parse(self, request):  # noqa: N802
+        await asyncio.sleep(0)
+        return namedtuple("ParseResponse", ("uast", "errors"))(self.uast, [])
+
+
+class FakeRpcError(grpc.RpcError):
+    pass
+
+
+@unittest.skipUnless(grpc_aio_available, "grpc.aio is not available")
+class AsyncDataRequestsTests(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        content, uast = create_small_uast()
+        self.files = [File(content=content, uast=uast, path="%d.js" % i,
+                           language="javascript") for i in range(3)]
+        self.ptr = ReferencePointer("repo", "ref", "1" * 40)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_with_uasts_async(self):
+        stub = FakeDataStub(self.files)
+        data_service = FakeAsyncDataService(stub)
+
+        @with_uasts_async(unicode=True)
+        async def train(cls, ptr, config, data_service, **data):
+            result = []
+            async for file in data["files"]:
+                result.append(file)
+            return result
+
+        files = self.loop.run_until_complete(train(None, self.ptr, {}, data_service))
+        self.assertEqual([f.path for f in files], ["0.js", "1.js", "2.js"])
+        self.assertIsInstance(files[0], UnicodeFile)
+        self.assertEqual(files[0].content, "bè = a")
+        self.assertEqual(files[0].uast.end_position.offset, 6)
+        self.assertTrue(stub.requests[0].want_uast)
+        self.assertFalse(stub.requests[0].want_contents)
+
+    def test_with_changed_uasts_and_contents_async(self):
+        stub = FakeDataStub(self.files)
+        data_service = FakeAsyncDataService(stub)
+
+        @with_changed_uasts_and_contents_async(unicode=False)
+        async def analyze(self, ptr_from, ptr_to, data_service, **data):
+            result = []
+            async for change in data["changes"]:
+                result.append(change)
+            return result
+
+        changes = self.loop.run_until_complete(
+            analyze(None, self.ptr, self.ptr, data_service))
+        self.assertEqual([c.head for c in changes], self.files)
+        self.assertTrue(stub.requests[0].want_uast)
+        self.assertTrue(stub.requests[0].want_contents)
+
+    def test_rpc_error(self):
+        data_service = FakeAsyncDataService(FakeDataStub(self.files, FakeRpcError()))
+
+        @with_changed_uasts_and_contents_async(unicode=True, lazy=True)
+        async def analyze(self, ptr_from, ptr_to, data_service, **data):
+            result = []
+            async for change in data["changes"]:
+                result.append(change)
+            return result
+
+        with self.assertRaises(FakeRpcError):
+            self.loop.run_until_complete(analyze(None, self.ptr, self.ptr, data_service))
+        self.assertTrue(data_service.closed)
+
+    def test_parse_uast(self):
+        content, uast = create_small_uast()
+        stub = FakeBblfshStub(uast)
+        parsed, errors = self.loop.run_until_complete(
+            parse_uast(stub, content.decode(), "test.js", unicode=True))
+        self.assertEqual(parsed.end_position.offset, 6)
+        self.assertEqual(errors, [])
+
+    def test_channel_per_event_loop(self):
+        data_service = AsyncDataService("localhost:10301")
+
+        async def get_stubs():
+            return data_service.get_data(), data_service.get_bblfsh()
+
+        stubs1 = self.loop.run_until_complete(get_stubs())
+        self.assertEqual(self.loop.run_until_complete(get_stubs()), stubs1)
+        other_loop = asyncio.new_event_loop()
+        try:
+            stubs2 = other_loop.run_until_complete(get_stubs())
+            self.assertIsNot(stubs2[0], stubs1[0])
+            data_service.shutdown()
+        finally:
+            other_loop.close()
+        self.assertIsNot(self.loop.run_until_complete(get_stubs())[0], stubs1[0])
+        self.loop.run_until_complete(data_service.close_channel())
+
+
+if __name__ == "__main__":
+    unittest.main()
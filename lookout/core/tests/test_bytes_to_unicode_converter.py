@@ -1,18 +1,23 @@
 import lzma
 import os
+import pickle
+from typing import Tuple
 import unittest
 
 import bblfsh
-from lookout.sdk.service_data_pb2 import File
+from lookout.sdk.service_data_pb2 import Change, File
 import numpy
 
-from lookout.core.bytes_to_unicode_converter import BytesToUnicodeConverter
+from lookout.core.analyzer import UnicodeFile
+from lookout.core.bytes_to_unicode_converter import BytesToUnicodeConverter, LazyUnicodeFile, \
+    UnicodeFileCache
+from lookout.core.uast import iter_bfs, iter_positions
 
 
 def check_uast_transformation(test_case: unittest.TestCase, content: bytes,
                               uast_byte_positions, uast_unicode_positions):
-    for node_byte, node_uni in zip(BytesToUnicodeConverter._traverse_uast(uast_byte_positions),
-                                   BytesToUnicodeConverter._traverse_uast(uast_unicode_positions)):
+    for node_byte, node_uni in zip(iter_bfs(uast_byte_positions),
+                                   iter_bfs(uast_unicode_positions)):
         if (node_byte.start_position != node_uni.start_position or
                 node_byte.end_position != node_uni.end_position):
             test_case.assertEqual(
@@ -21,6 +26,17 @@ def check_uast_transformation(test_case: unittest.TestCase, content: bytes,
                 node_uni.end_position.offset - node_uni.start_position.offset)
 
 
+def create_small_uast() -> Tuple[bytes, bblfsh.Node]:
+    content = "b\u00e8 = a".encode()
+    uast = bblfsh.Node(
+        start_position=bblfsh.Position(offset=0, line=1, col=1),
+        end_position=bblfsh.Position(offset=7, line=1, col=8))
+    uast.children.extend([bblfsh.Node(
+        start_position=bblfsh.Position(offset=6, line=1, col=7),
+        end_position=bblfsh.Position(offset=7, line=1, col=8))])
+    return content, uast
+
+
 class BytesToUnicodeConverterTests(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -31,12 +47,40 @@ class BytesToUnicodeConverterTests(unittest.TestCase):
                   b"\x80\x80\xb3\x09\xc3\xa8\x80\x80\xc3\x80"
         content_str = content.decode(errors="replace")
         byte_to_str_offset = BytesToUnicodeConverter._build_bytes_to_str_offset_mapping(content)
-        for offset_byte, offset_str in byte_to_str_offset.items():
+        self.assertEqual(byte_to_str_offset.dtype, numpy.int32)
+        self.assertEqual(len(byte_to_str_offset), len(content) + 1)
+        self.assertEqual(byte_to_str_offset[-1], len(content_str))
+        boundaries = numpy.flatnonzero(numpy.diff(byte_to_str_offset)).tolist()
+        boundaries.append(len(content))
+        for offset_byte in boundaries:
+            offset_str = byte_to_str_offset[offset_byte]
             self.assertEqual(content[:offset_byte].decode(errors="replace"),
                              content_str[:offset_str])
             self.assertEqual(content[offset_byte:].decode(errors="replace"),
                              content_str[offset_str:])
 
+    def test_build_bytes_to_str_offset_mapping_invalid(self):
+        for content in (b"\xe2\x82x", b"a\xf0\x9f\x98", b"\xef\xbf\xbd\xff\xc3", b""):
+            content_str = content.decode(errors="replace")
+            byte_to_str_offset = \
+                BytesToUnicodeConverter._build_bytes_to_str_offset_mapping(content)
+            self.assertEqual(byte_to_str_offset[-1], len(content_str), content)
+            self.assertEqual(byte_to_str_offset[0], 0, content)
+
+    def test_build_bytes_to_str_offset_mapping_latin1(self):
+        content = ("Café naïve résumé à la crème brûlée\n" * 30000).encode("latin-1")
+        self.assertGreater(len(content), 1 << 20)
+        content_str = content.decode(errors="replace")
+        byte_to_str_offset = BytesToUnicodeConverter._build_bytes_to_str_offset_mapping(content)
+        self.assertEqual(byte_to_str_offset[-1], len(content_str))
+        # every invalid byte is a separate replacement character
+        numpy.testing.assert_array_equal(byte_to_str_offset, numpy.arange(len(content) + 1))
+        # truncated multibyte sequences are single replacement characters
+        content = "a€".encode()[:-1] * 1000 + "é".encode()
+        byte_to_str_offset = BytesToUnicodeConverter._build_bytes_to_str_offset_mapping(content)
+        self.assertEqual(byte_to_str_offset[-1], len(content.decode(errors="replace")))
+        self.assertEqual(list(byte_to_str_offset[:7]), [0, 1, 2, 2, 3, 4, 4])
+
     def test_byte_eq_str(self):
         code = b"var a = 1;\nvar b = 'abc'"
         response = self.parse(contents=code, language="javascript", filename="test.js")
@@ -55,6 +99,18 @@ class BytesToUnicodeConverterTests(unittest.TestCase):
         uast_uni = converter.convert_uast(uast)
         check_uast_transformation(self, code, uast, uast_uni)
 
+    def test_convert_uast_inplace(self):
+        content, uast = create_small_uast()
+        original = bblfsh.Node.FromString(uast.SerializeToString())
+        converter = BytesToUnicodeConverter(content)
+        uast_copy = converter.convert_uast(uast)
+        self.assertEqual(uast, original)
+        uast_inplace = converter.convert_uast(uast, inplace=True)
+        self.assertIs(uast_inplace, uast)
+        self.assertEqual(uast_inplace, uast_copy)
+        self.assertEqual(uast_inplace.children[0].start_position,
+                         bblfsh.Position(offset=5, line=1, col=6))
+
     def test_build_lines_offset_mapping(self):
         content = "1\n23\n\n456\r\n\t\t\t\n\n"
         res = BytesToUnicodeConverter._build_lines_offset_mapping(content)
@@ -72,6 +128,125 @@ class BytesToUnicodeConverterTests(unittest.TestCase):
         self.assertEqual(unicode_file.language, file.language)
         check_uast_transformation(self, code, uast, unicode_file.uast)
 
+    def test_lazy_unicode_file(self):
+        content, uast = create_small_uast()
+        file = File(content=content, path="test.js", language="javascript", uast=uast)
+        eager = BytesToUnicodeConverter.convert_file(file)
+        lazy = BytesToUnicodeConverter.convert_file(file, lazy=True)
+        self.assertIsInstance(lazy, LazyUnicodeFile)
+        self.assertIsInstance(lazy, UnicodeFile)
+        self.assertEqual(lazy.path, file.path)
+        self.assertEqual(lazy.language, file.language)
+        self.assertEqual(lazy.content, eager.content)
+        self.assertFalse(lazy.converted)
+        self.assertEqual(lazy.uast, eager.uast)
+        self.assertTrue(lazy.converted)
+        self.assertIs(lazy[1], lazy.uast)
+        self.assertEqual(lazy[-2:], (file.path, file.language))
+        self.assertEqual(len(lazy), 4)
+        self.assertEqual(tuple(lazy), tuple(eager))
+        self.assertEqual(lazy, eager)
+        self.assertEqual(eager, lazy)
+        self.assertEqual(lazy._asdict(), eager._asdict())
+        self.assertEqual(lazy._replace(path="other.js"), eager._replace(path="other.js"))
+        unpickled = pickle.loads(pickle.dumps(lazy))
+        self.assertIs(type(unpickled), UnicodeFile)
+        self.assertEqual(unpickled, eager)
+        self.assertEqual(file.uast, uast)
+
+    def test_pickle_uast(self):
+        _, uast = create_small_uast()
+        unpickled = pickle.loads(pickle.dumps(uast))
+        self.assertIsInstance(unpickled, bblfsh.Node)
+        self.assertEqual(unpickled, uast)
+
+    def test_lazy_unicode_file_inplace(self):
+        content, uast = create_small_uast()
+        file = File(content=content, path="test.js", language="javascript", uast=uast)
+        eager = BytesToUnicodeConverter.convert_file(file)
+        lazy = BytesToUnicodeConverter.convert_change(
+            Change(base=file, head=file), inplace=True, lazy=True).head
+        self.assertEqual(lazy.uast, eager.uast)
+
+    def test_convert_change_share_identical(self):
+        content, uast = create_small_uast()
+        file = File(content=content, path="test.js", language="javascript", uast=uast)
+        renamed = File(content=content, path="other.js", language="javascript", uast=uast)
+        added = Change(base=File(), head=File(path="empty.js"))
+        self.assertTrue(BytesToUnicodeConverter.has_identical_sides(Change(base=file, head=file)))
+        self.assertFalse(BytesToUnicodeConverter.has_identical_sides(added))
+        change = BytesToUnicodeConverter.convert_change(
+            Change(base=file, head=file), share_identical=True)
+        self.assertIs(change.base, change.head)
+        change = BytesToUnicodeConverter.convert_change(
+            Change(base=renamed, head=file), share_identical=True)
+        self.assertEqual(change.base.path, "other.js")
+        self.assertIs(change.base.uast, change.head.uast)
+        change = BytesToUnicodeConverter.convert_change(
+            Change(base=file, head=file), lazy=True, share_identical=True)
+        self.assertIs(change.base, change.head)
+        change = BytesToUnicodeConverter.convert_change(Change(base=file, head=file))
+        self.assertIsNot(change.base.uast, change.head.uast)
+        # the non-ASCII content makes the converted UAST differ from the original
+        change = BytesToUnicodeConverter.convert_change(
+            Change(base=file, head=file), inplace=True, share_identical=True)
+        self.assertIs(change.base, change.head)
+        self.assertEqual(change.head.uast.end_position.offset, 6)
+        change = BytesToUnicodeConverter.convert_change(
+            Change(base=renamed, head=file), inplace=True, share_identical=True)
+        self.assertIs(change.base.uast, change.head.uast)
+        other = File(content=b"a = bbb", path="test.js", language="javascript", uast=uast)
+        self.assertFalse(BytesToUnicodeConverter.has_identical_sides(
+            Change(base=file, head=other)))
+        other = File(content=content, path="test.js", language="javascript", uast=uast,
+                     hash="0" * 40)
+        self.assertFalse(BytesToUnicodeConverter.has_identical_sides(
+            Change(base=file, head=other)))
+
+    def test_unicode_file_cache(self):
+        content, uast = create_small_uast()
+        file = File(content=content, path="test.js", language="javascript", uast=uast)
+        cache = UnicodeFileCache(1 << 20)
+        key, cached = cache.lookup(file)
+        self.assertIsNone(cached)
+        unicode_file = cache.convert(file)
+        self.assertEqual(unicode_file, BytesToUnicodeConverter.convert_file(file))
+        self.assertIs(cache.convert(file).uast, unicode_file.uast)
+        renamed = File(content=content, path="other.js", language="javascript", uast=uast)
+        unicode_renamed = cache.convert(renamed)
+        self.assertEqual(unicode_renamed.path, "other.js")
+        self.assertIs(unicode_renamed.uast, unicode_file.uast)
+        key, cached = cache.lookup(Change(base=file, head=renamed))
+        self.assertEqual(cached.head.path, "other.js")
+        other = File(content=b"a = bbb", path="test.js", language="javascript", uast=uast)
+        self.assertIsNone(cache.lookup(other)[1])
+        unicode_change = cache.convert(Change(base=file, head=other))
+        self.assertIs(unicode_change.base.uast, unicode_file.uast)
+        self.assertIsNotNone(cache.lookup(other)[1])
+        cache.clear()
+        self.assertIsNone(cache.lookup(file)[1])
+
+    def test_unicode_file_cache_inplace(self):
+        content, uast = create_small_uast()
+        file = File(content=content, path="test.js", language="javascript", uast=uast)
+        expected = BytesToUnicodeConverter.convert_file(file)
+        cache = UnicodeFileCache(1 << 20)
+        unicode_file = cache.convert(file, inplace=True)
+        self.assertIsNot(unicode_file.uast, file.uast)
+        self.assertGreater(UnicodeFileCache._getsizeof(unicode_file),
+                           len(unicode_file.content) + unicode_file.uast.ByteSize())
+        file.Clear()
+        self.assertEqual(unicode_file, expected)
+        self.assertEqual(cache.lookup(File(content=content, path="test.js",
+                                           language="javascript", uast=uast))[1], expected)
+
+    def test_unicode_file_cache_too_big(self):
+        content, uast = create_small_uast()
+        file = File(content=content, path="test.js", language="javascript", uast=uast)
+        cache = UnicodeFileCache(10)
+        self.assertEqual(cache.convert(file), BytesToUnicodeConverter.convert_file(file))
+        self.assertIsNone(cache.lookup(file)[1])
+
     def test_real_file(self):
         filepath = os.path.join(os.path.split(__file__)[0], "test-markdown-options.js.xz")
         with lzma.open(filepath) as f:
@@ -80,6 +255,35 @@ class BytesToUnicodeConverterTests(unittest.TestCase):
         uast_uni = BytesToUnicodeConverter(content).convert_uast(uast)
         check_uast_transformation(self, content, uast, uast_uni)
 
+    def test_real_file_batch(self):
+        filepath = os.path.join(os.path.split(__file__)[0], "test-markdown-options.js.xz")
+        with lzma.open(filepath) as f:
+            content = f.read()
+        uast = self.parse(contents=content, filename=filepath, language="javascript").uast
+        converter = BytesToUnicodeConverter(content)
+        uast_uni = converter.convert_uast(uast)
+        uast_ref = bblfsh.Node.FromString(uast.SerializeToString())
+        for position in iter_positions(uast_ref):
+            position.CopyFrom(converter._convert_position(position))
+        self.assertEqual(uast_uni.SerializeToString(deterministic=True),
+                         uast_ref.SerializeToString(deterministic=True))
+
+    def test_convert_uast_end_of_file(self):
+        content = "a\nb\u00e8\n".encode()
+        uast = bblfsh.Node(
+            start_position=bblfsh.Position(offset=0, line=1, col=1),
+            end_position=bblfsh.Position(offset=6, line=2, col=4))
+        uast.children.extend([bblfsh.Node(
+            start_position=bblfsh.Position(offset=2, line=2, col=1),
+            end_position=bblfsh.Position(offset=5, line=2, col=3))])
+        uast_uni = BytesToUnicodeConverter(content).convert_uast(uast)
+        self.assertEqual(uast_uni.start_position, bblfsh.Position(offset=0, line=1, col=1))
+        self.assertEqual(uast_uni.end_position, bblfsh.Position(offset=5, line=3, col=1))
+        self.assertEqual(uast_uni.children[0].start_position,
+                         bblfsh.Position(offset=2, line=2, col=1))
+        self.assertEqual(uast_uni.children[0].end_position,
+                         bblfsh.Position(offset=4, line=2, col=3))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,111 @@
+import time
+import unittest
+
+import grpc
+
+from lookout.core.channel_pool import ChannelPool
+
+
+class ChannelPoolTests(unittest.TestCase):
+    ADDRESS = "localhost:1"
+
+    def test_least_loaded(self):
+        pool = ChannelPool(self.ADDRESS, 2)
+        channels = [pool.borrow() for _ in range(4)]
+        self.assertEqual([c.slot for c in channels], [0, 1, 0, 1])
+        self.assertIs(channels[0], channels[2])
+        self.assertEqual(channels[0].borrowers, 2)
+        pool.release(channels[1])
+        pool.release(channels[3])
+        self.assertIs(pool.borrow(), channels[1])
+        pool.close()
+
+    def test_least_loaded_reuses_open(self):
+        pool = ChannelPool(self.ADDRESS, 4)
+        channel = pool.borrow()
+        pool.release(channel)
+        self.assertIs(pool.borrow(), channel)
+        pool.close()
+
+    def test_round_robin(self):
+        pool = ChannelPool(self.ADDRESS, 3, policy=ChannelPool.ROUND_ROBIN)
+        channels = [pool.borrow() for _ in range(4)]
+        for channel in channels:
+            pool.release(channel)
+        self.assertEqual([c.slot for c in channels], [0, 1, 2, 0])
+        self.assertEqual(channels[0].borrowers, 0)
+        pool.close()
+
+    def test_unhealthy(self):
+        pool = ChannelPool(self.ADDRESS, 2)
+        channel = pool.borrow()
+        pool.release(channel)
+        channel.channel.unsubscribe(channel.watcher)
+        channel.state = grpc.ChannelConnectivity.TRANSIENT_FAILURE
+        self.assertEqual(pool.borrow().slot, 1)
+        self.assertEqual(pool.borrow().slot, 1)
+        pool.close()
+
+    def test_invalidate(self):
+        pool = ChannelPool(self.ADDRESS, 1, initial_backoff=0.1)
+        channel = pool.borrow()
+        self.assertIs(pool.borrow(), channel)
+        pool.invalidate(channel)
+        retry_at = pool._retry_at[0]
+        self.assertGreater(retry_at, time.monotonic())
+        pool.release(channel)
+        self.assertNotIn(channel, pool._slots)
+        self.assertIn(channel, pool._open)
+        pool.release(channel)
+        self.assertNotIn(channel, pool._open)
+        new_channel = pool.borrow()
+        self.assertGreaterEqual(time.monotonic(), retry_at)
+        self.assertIsNot(new_channel, channel)
+        pool.invalidate(new_channel)
+        self.assertAlmostEqual(pool._retry_at[0] - time.monotonic(), 0.2, delta=0.05)
+        pool.close()
+
+    def test_idle_eviction(self):
+        pool = ChannelPool(self.ADDRESS, 2, idle_timeout=0.05)
+        channel = pool.borrow()
+        pool.release(channel)
+        time.sleep(0.1)
+        self.assertIsNot(pool.borrow(), channel)
+        self.assertTrue(channel.retired)
+        pool.close()
+
+    def test_close_after_grace(self):
+        pool = ChannelPool(self.ADDRESS, 2)
+        channel = pool.borrow()
+        pool.invalidate(channel)
+        pool.release(channel)
+        self.assertEqual([c for _, c in pool._closing], [channel])
+        time.sleep(ChannelPool.CLOSE_GRACE)
+        pool.release(pool.borrow())
+        self.assertEqual(pool._closing, [])
+        pool.borrow()
+        pool.close()
+        self.assertEqual(pool._closing, [])
+        self.assertEqual(pool._open, set())
+
+    def test_get_stub(self):
+        pool = ChannelPool(self.ADDRESS, 1)
+        channel = pool.borrow()
+
+        def factory(c):
+            return [c]
+
+        stub = channel.get_stub(factory)
+        self.assertEqual(stub, [channel.channel])
+        self.assertIs(channel.get_stub(factory), stub)
+        pool.close()
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            ChannelPool(self.ADDRESS, 0)
+        with self.assertRaises(ValueError):
+            ChannelPool(self.ADDRESS, 1, policy="random")
+
+
+if __name__ == "__main__":
+    unittest.main()
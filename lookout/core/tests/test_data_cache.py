@@ -0,0 +1,170 @@
+import os
+import re
+import tempfile
+import unittest
+
+from lookout.core.analyzer import ReferencePointer
+from lookout.core.api.service_data_pb2 import Change, ChangesRequest, File, FilesRequest
+from lookout.core.data_cache import BlobStore, CachingDataStub, DataCache
+
+
+class FakeDataStub:
+    def __init__(self, files):
+        self.files = files
+        self.requests = []
+
+    @property
+    def calls(self):
+        return len(self.requests)
+
+    def GetFiles(self, request):  # noqa: N802
+        self.requests.append(request)
+        return iter(self._select(request))
+
+    def GetChanges(self, request):  # noqa: N802
+        self.requests.append(request)
+        return (Change(base=File(), head=file) for file in self._select(request))
+
+    def _select(self, request):
+        files = []
+        for file in self.files:
+            if request.include_pattern and not re.match(request.include_pattern, file.path):
+                continue
+            file = File(path=file.path, hash=file.hash, language=file.language,
+                        content=file.content if request.want_contents else b"")
+            files.append(file)
+        return files
+
+
+class BlobStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory(prefix="lookout-blobs-")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_put_get(self):
+        store = BlobStore(self.tmpdir.name, 1 << 20)
+        key1 = store.put(b"hello")
+        key2 = store.put(b"world")
+        self.assertEqual(store.put(b"hello"), key1)
+        self.assertEqual(store.size, 10)
+        self.assertEqual(store.get(key1), b"hello")
+        self.assertEqual(store.get(key2), b"world")
+        self.assertEqual(store.get(store.put(b"")), b"")
+        self.assertIsNone(store.get(b"x" * 20))
+        self.assertIn(key1, store)
+        store.close()
+        store = BlobStore(self.tmpdir.name, 1 << 20)
+        self.assertEqual(store.size, 10)
+        self.assertEqual(store.get(key2), b"world")
+        self.assertEqual(store.get(store.put(b"again")), b"again")
+        store.close()
+
+    def test_eviction(self):
+        store = BlobStore(self.tmpdir.name, 16 * 100)
+        keys = [store.put(bytes([i]) * 100) for i in range(40)]
+        self.assertLessEqual(store.size, store.max_size)
+        self.assertIsNone(store.get(keys[0]))
+        self.assertEqual(store.get(keys[-1]), bytes([39]) * 100)
+        segments = [name for name in os.listdir(self.tmpdir.name) if name.endswith(".seg")]
+        self.assertLessEqual(len(segments), BlobStore.SEGMENTS_NUMBER)
+        store.close()
+
+
+class DataCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory(prefix="lookout-data-cache-")
+        self.cache = DataCache(self.tmpdir.name, 1 << 20)
+        self.files = [File(path="%d.py" % i, content=b"x = %d" % i, hash="%040d" % i,
+                           language="Python") for i in range(5)]
+        self.request = FilesRequest(
+            revision=ReferencePointer("repo", "ref", "1" * 40).to_pb(), want_contents=True,
+            want_language=True)
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmpdir.cleanup()
+
+    def test_get_files(self):
+        stub = FakeDataStub(self.files)
+        caching_stub = CachingDataStub(stub, self.cache)
+        self.assertEqual(list(caching_stub.GetFiles(self.request)), self.files)
+        # the listing and the complete response
+        self.assertEqual(stub.calls, 2)
+        self.assertFalse(stub.requests[0].want_contents)
+        self.assertEqual(list(caching_stub.GetFiles(self.request)), self.files)
+        self.assertEqual(stub.calls, 2)
+        self.request.want_uast = True
+        self.assertEqual(list(caching_stub.GetFiles(self.request)), self.files)
+        self.assertEqual(stub.calls, 4)
+
+    def test_get_files_other_revision(self):
+        stub = FakeDataStub(self.files)
+        caching_stub = CachingDataStub(stub, self.cache)
+        list(caching_stub.GetFiles(self.request))
+        self.files[3] = File(path="3.py", content=b"x = 33", hash="%040d" % 33,
+                             language="Python")
+        self.request.revision.hash = "2" * 40
+        self.assertEqual(list(caching_stub.GetFiles(self.request)), self.files)
+        self.assertEqual(stub.calls, 4)
+        self.assertEqual(stub.requests[-1].include_pattern, "^(3\\.py)$")
+        self.assertEqual(stub.requests[-1].revision.hash, "2" * 40)
+        self.assertTrue(stub.requests[-1].want_contents)
+        self.assertEqual(list(caching_stub.GetFiles(self.request)), self.files)
+        self.assertEqual(stub.calls, 4)
+
+    def test_get_files_partial(self):
+        stub = FakeDataStub(self.files)
+        caching_stub = CachingDataStub(stub, self.cache)
+        next(caching_stub.GetFiles(self.request))
+        self.assertEqual(list(caching_stub.GetFiles(self.request)), self.files)
+        self.assertEqual(stub.calls, 4)
+        self.assertEqual(stub.requests[-1].include_pattern, "^(1\\.py|2\\.py|3\\.py|4\\.py)$")
+
+    def test_get_files_no_commit(self):
+        stub = FakeDataStub(self.files)
+        caching_stub = CachingDataStub(stub, self.cache)
+        self.request.revision.hash = ""
+        for _ in range(2):
+            self.assertEqual(list(caching_stub.GetFiles(self.request)), self.files)
+        self.assertEqual(stub.calls, 2)
+
+    def test_get_changes(self):
+        stub = FakeDataStub(self.files)
+        caching_stub = CachingDataStub(stub, self.cache)
+        request = ChangesRequest(base=ReferencePointer("repo", "ref", "1" * 40).to_pb(),
+                                 head=ReferencePointer("repo", "ref", "2" * 40).to_pb(),
+                                 want_contents=True)
+        changes = list(caching_stub.GetChanges(request))
+        self.assertEqual(list(caching_stub.GetChanges(request)), changes)
+        self.assertEqual(len(changes), 5)
+        self.assertEqual(stub.calls, 2)
+
+    def test_get_changes_reuse_files(self):
+        stub = FakeDataStub(self.files)
+        caching_stub = CachingDataStub(stub, self.cache)
+        list(caching_stub.GetFiles(self.request))
+        request = ChangesRequest(base=ReferencePointer("repo", "ref", "0" * 40).to_pb(),
+                                 head=self.request.revision, want_contents=True,
+                                 want_language=True)
+        changes = list(caching_stub.GetChanges(request))
+        self.assertEqual([change.head for change in changes], self.files)
+        self.assertEqual([change.base for change in changes], [File()] * 5)
+        # only the listing
+        self.assertEqual(stub.calls, 3)
+        self.assertFalse(stub.requests[-1].want_contents)
+
+    def test_evicted_while_reading(self):
+        stub = FakeDataStub(self.files)
+        caching_stub = CachingDataStub(stub, self.cache)
+        list(caching_stub.GetFiles(self.request))
+        stream = caching_stub.GetFiles(self.request)
+        self.assertEqual(next(stream), self.files[0])
+        self.cache._db.execute("DELETE FROM blobs")
+        self.assertEqual(list(stream), self.files[1:])
+        self.assertEqual(stub.calls, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
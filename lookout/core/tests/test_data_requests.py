@@ -1,23 +1,34 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import os
 from pathlib import Path
+import re
 import threading
 import unittest
+from unittest.mock import patch
 
 import bblfsh
 import grpc
 
 import lookout.core
-from lookout.core.analyzer import ReferencePointer, UnicodeFile
+from lookout.core.analyzer import Analyzer, ReferencePointer, UnicodeFile
 from lookout.core.api.event_pb2 import PushEvent, ReviewEvent
 from lookout.core.api.service_analyzer_pb2 import EventResponse
+from lookout.core.api.service_data_pb2 import Change, File
+from lookout.core.bytes_to_unicode_converter import BytesToUnicodeConverter, LazyUnicodeFile, \
+    UnicodeFileCache
 from lookout.core.data_requests import (
-    DataService, parse_uast, UnsatisfiedDriverVersionError, with_changed_contents,
-    with_changed_uasts, with_changed_uasts_and_contents, with_contents, with_uasts,
-    with_uasts_and_contents)
+    DataService, LazyContentChange, LazyContentFetcher, make_paths_pattern, parse_uast,
+    parse_uasts, request_changes, request_changes_with_lazy_contents, request_files,
+    request_filters, ResumableStream, StreamPrefetcher,
+    UnicodeConversionPool, UnsatisfiedDriverVersionError,
+    with_changed_contents, with_changed_uasts, with_changed_uasts_and_contents, with_contents,
+    with_uasts, with_uasts_and_contents)
 from lookout.core.event_listener import EventHandlers, EventListener
 from lookout.core.helpers.server import find_port, LookoutSDK
 import lookout.core.tests
-from lookout.core.tests.test_bytes_to_unicode_converter import check_uast_transformation
+from lookout.core.tests.test_bytes_to_unicode_converter import check_uast_transformation, \
+    create_small_uast
 
 
 class DataRequestsTests(unittest.TestCase, EventHandlers):
@@ -282,6 +293,50 @@ class DataRequestsTests(unittest.TestCase, EventHandlers):
              ReferencePointer(self.url, self.ref, self.COMMIT_TO),
              self.data_service)
 
+    def test_with_changed_uasts_and_contents_lazy(self):
+        eager_changes = []
+
+        def func(imposter, ptr_from: ReferencePointer, ptr_to: ReferencePointer,
+                 data_service: DataService, **data):
+            changes = list(data["changes"])
+            if not eager_changes:
+                eager_changes.extend(changes)
+                return
+            self.assertEqual(len(changes), 1)
+            for change, eager_change in zip(changes, eager_changes):
+                for file, eager_file in ((change.base, eager_change.base),
+                                         (change.head, eager_change.head)):
+                    self.assertIsInstance(file, LazyUnicodeFile)
+                    self.assertFalse(file.converted)
+                    self.assertEqual(file, eager_file)
+                    self.assertTrue(file.converted)
+
+        for lazy in (False, True):
+            with_changed_uasts_and_contents(unicode=True, lazy=lazy)(func)(
+                self,
+                ReferencePointer(self.url, self.ref, self.COMMIT_FROM),
+                ReferencePointer(self.url, self.ref, self.COMMIT_TO),
+                self.data_service)
+
+    def test_with_uasts_prefetch(self):
+        paths = []
+
+        def func(imposter, ptr: ReferencePointer, config: dict,
+                 data_service: DataService, **data):
+            paths.append([file.path for file in data["files"]])
+
+        for prefetch in (0, 4):
+            # the prefetcher is wrapped by the retries and the filters
+            with patch("lookout.core.data_requests.StreamPrefetcher",
+                       wraps=StreamPrefetcher) as prefetcher:
+                with_uasts(unicode=False, prefetch=prefetch)(func)(
+                    self,
+                    ReferencePointer(self.url, self.ref, self.COMMIT_TO),
+                    None,
+                    self.data_service)
+            self.assertEqual(prefetcher.called, prefetch > 0)
+        self.assertEqual(paths[0], paths[1])
+
     def test_with_uasts_unicode(self):
         def func(imposter, ptr: ReferencePointer, config: dict,
                  data_service: DataService, **data):
@@ -315,5 +370,506 @@ class DataRequestsTests(unittest.TestCase, EventHandlers):
         check_uast_transformation(self, content, uast, uast_uni)
 
 
+class UnicodeConversionPoolTests(unittest.TestCase):
+    def test_map_order(self):
+        pool = UnicodeConversionPool(2)
+        try:
+            self.assertEqual(list(pool.map(abs, range(0, -100, -1))), list(range(100)))
+        finally:
+            pool.shutdown()
+
+    def test_map_processes(self):
+        content, uast = create_small_uast()
+        files = [File(content=content, path="%d.js" % i, language="javascript", uast=uast)
+                 for i in range(4)]
+        pool = UnicodeConversionPool(2)
+        try:
+            converted = list(pool.map(BytesToUnicodeConverter.convert_file, files))
+        finally:
+            pool.shutdown()
+        self.assertEqual(converted, [BytesToUnicodeConverter.convert_file(f) for f in files])
+
+    def test_map_window(self):
+        consumed = 0
+        max_ahead = 0
+
+        def items():
+            nonlocal max_ahead
+            for i in range(20):
+                max_ahead = max(max_ahead, i - consumed)
+                yield i
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            pool = UnicodeConversionPool(4, window=3, executor=executor)
+            for i, x in enumerate(pool.map(lambda x: x * 2, items())):
+                self.assertEqual(x, i * 2)
+                consumed += 1
+            pool.shutdown()
+            self.assertFalse(executor._shutdown)
+        self.assertLessEqual(max_ahead, 3)
+
+    def test_map_cache(self):
+        content, uast = create_small_uast()
+        files = [File(content=content, path="%d.js" % i, language="javascript", uast=uast)
+                 for i in range(4)]
+        cache = UnicodeFileCache(1 << 20)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            pool = UnicodeConversionPool(2, executor=executor)
+            first = list(pool.map(BytesToUnicodeConverter.convert_file, files, cache=cache))
+            second = list(pool.map(BytesToUnicodeConverter.convert_file, files, cache=cache))
+        self.assertEqual(first, second)
+        self.assertEqual([f.path for f in second], ["0.js", "1.js", "2.js", "3.js"])
+        for unicode_file in second:
+            self.assertIs(unicode_file.uast, second[0].uast)
+
+    def test_map_error(self):
+        def fail(x):
+            if x == 5:
+                raise ValueError(x)
+            return x
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            pool = UnicodeConversionPool(2, executor=executor)
+            results = []
+            with self.assertRaises(ValueError):
+                for x in pool.map(fail, range(10)):
+                    results.append(x)
+        self.assertEqual(results, list(range(5)))
+
+
+class FakeMessage:
+    def __init__(self, size: int):
+        self.size = size
+
+    def ByteSize(self):
+        return self.size
+
+
+class FakeStream:
+    def __init__(self, items, error=None):
+        self.items = items
+        self.error = error
+        self.cancelled = threading.Event()
+        self.produced = 0
+
+    def __iter__(self):
+        for item in self.items:
+            if self.cancelled.is_set():
+                return
+            self.produced += 1
+            yield item
+        if self.error is not None:
+            raise self.error
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+class StreamPrefetcherTests(unittest.TestCase):
+    def wait_produced(self, stream: FakeStream, count: int):
+        for _ in range(100):
+            if stream.produced >= count:
+                break
+            threading.Event().wait(0.01)
+        # give the background thread the chance to overrun the limits
+        threading.Event().wait(0.05)
+
+    def test_order(self):
+        self.assertEqual(list(StreamPrefetcher(iter(range(100)), 3)), list(range(100)))
+
+    def test_size(self):
+        stream = FakeStream(list(range(10)))
+        prefetcher = StreamPrefetcher(stream, 3)
+        self.wait_produced(stream, 4)
+        # 3 messages are buffered and the 4th is waiting for the free space
+        self.assertEqual(stream.produced, 4)
+        self.assertEqual(list(prefetcher), list(range(10)))
+
+    def test_max_bytes(self):
+        stream = FakeStream([FakeMessage(size) for size in (10, 50, 50, 10, 200, 10)])
+        prefetcher = StreamPrefetcher(stream, 10, max_bytes=100)
+        self.wait_produced(stream, 3)
+        # 10 + 50 bytes are buffered and the next 50 do not fit
+        self.assertEqual(stream.produced, 3)
+        sizes = [message.size for message in prefetcher]
+        self.assertEqual(sizes, [10, 50, 50, 10, 200, 10])
+
+    def test_error(self):
+        stream = FakeStream(list(range(5)), error=ValueError("boom"))
+        results = []
+        with self.assertRaises(ValueError):
+            for x in StreamPrefetcher(stream, 2):
+                results.append(x)
+        self.assertEqual(results, list(range(5)))
+
+    def test_close(self):
+        stream = FakeStream(list(range(100)))
+        prefetcher = StreamPrefetcher(stream, 2)
+        self.assertEqual(next(prefetcher), 0)
+        prefetcher.close()
+        self.assertTrue(stream.cancelled.is_set())
+        self.assertEqual(list(prefetcher), [])
+
+    def test_del(self):
+        stream = FakeStream(list(range(100)))
+        prefetcher = StreamPrefetcher(stream, 2)
+        self.assertEqual(next(prefetcher), 0)
+        del prefetcher
+        self.assertTrue(stream.cancelled.is_set())
+
+
+class FakeRpcError(grpc.RpcError):
+    def __init__(self, code: grpc.StatusCode):
+        super().__init__(code)
+        self._code = code
+
+    def code(self):
+        return self._code
+
+
+class FakeDataStub:
+    def __init__(self, files, failures):
+        self.files = files
+        self.failures = list(failures)
+        self.calls = 0
+        self.requests = []
+
+    def GetFiles(self, request):  # noqa: N802
+        self.calls += 1
+        self.requests.append(request)
+        if self.failures:
+            position, code = self.failures.pop(0)
+            return FakeStream(self.files[:position], error=FakeRpcError(code))
+        return FakeStream(self.files)
+
+    def GetChanges(self, request):  # noqa: N802
+        self.requests.append(request)
+        return FakeStream([Change(base=file, head=file) for file in self.files])
+
+
+class ResumableStreamTests(unittest.TestCase):
+    def setUp(self):
+        self.files = [File(path="%d.py" % i, content=b"x = %d" % i) for i in range(10)]
+        self.ptr = ReferencePointer("repo", "ref", "1" * 40)
+
+    def test_resume(self):
+        stub = FakeDataStub(self.files, [(6, grpc.StatusCode.UNAVAILABLE),
+                                         (3, grpc.StatusCode.DEADLINE_EXCEEDED)])
+        reconnects = []
+
+        def reconnect():
+            reconnects.append(True)
+            return stub
+
+        files = request_files(stub, self.ptr, contents=True, uast=False, unicode=True,
+                              retries=2, retry_backoff=0.01, reconnect=reconnect)
+        self.assertEqual([f.path for f in files], [f.path for f in self.files])
+        self.assertEqual(stub.calls, 3)
+        self.assertEqual(len(reconnects), 2)
+
+    def test_resume_prefetch(self):
+        stub = FakeDataStub(self.files, [(6, grpc.StatusCode.UNAVAILABLE)])
+        files = request_files(stub, self.ptr, contents=True, uast=False, unicode=False,
+                              prefetch=3, retries=1, retry_backoff=0.01)
+        self.assertEqual(list(files), self.files)
+        self.assertEqual(stub.calls, 2)
+
+    def test_budget(self):
+        stub = FakeDataStub(self.files, [(6, grpc.StatusCode.UNAVAILABLE)] * 3)
+        files = request_files(stub, self.ptr, contents=True, uast=False, unicode=False,
+                              retries=2, retry_backoff=0.01)
+        with self.assertRaises(FakeRpcError):
+            list(files)
+        self.assertEqual(stub.calls, 3)
+
+    def test_not_transient(self):
+        stub = FakeDataStub(self.files, [(6, grpc.StatusCode.INVALID_ARGUMENT)])
+        delivered = []
+        with self.assertRaises(FakeRpcError):
+            for file in request_files(stub, self.ptr, contents=True, uast=False,
+                                      unicode=False, retries=2, retry_backoff=0.01):
+                delivered.append(file)
+        self.assertEqual(delivered, self.files[:6])
+        self.assertEqual(stub.calls, 1)
+
+    def test_cancel(self):
+        stream = FakeStream(list(range(10)))
+        resumable = ResumableStream(stream, lambda: None, str, 1, 0)
+        self.assertEqual(next(resumable), 0)
+        resumable.cancel()
+        self.assertTrue(stream.cancelled.is_set())
+
+
+class RequestFiltersTests(unittest.TestCase):
+    class PythonAnalyzer(Analyzer):
+        languages = ("Python",)
+        include_pattern = r"^src/"
+        max_file_size = 10
+
+    def setUp(self):
+        self.files = [File(path="src/a.py", content=b"x = 1", language="Python"),
+                      File(path="src/b.js", content=b"x = 1", language="JavaScript"),
+                      File(path="src/c.py", content=b"x = 1" * 10, language="Python"),
+                      File(path="src/d.py", content=b"", language="Python")]
+        self.ptr = ReferencePointer("repo", "ref", "1" * 40)
+
+    def test_request_filters(self):
+        self.assertEqual(request_filters(self.PythonAnalyzer), {
+            "languages": ("Python",), "include_pattern": r"^src/", "max_file_size": 10})
+        self.assertEqual(request_filters(None), {
+            "languages": (), "include_pattern": None, "max_file_size": 0})
+
+    def test_request_files(self):
+        stub = FakeDataStub(self.files, [])
+        files = request_files(stub, self.ptr, contents=True, uast=False, unicode=False,
+                              **request_filters(self.PythonAnalyzer))
+        self.assertEqual([f.path for f in files], ["src/a.py", "src/d.py"])
+        request = stub.requests[0]
+        self.assertEqual(list(request.include_languages), ["python"])
+        self.assertEqual(request.include_pattern, r"^src/")
+        self.assertTrue(request.want_language)
+
+    def test_request_changes(self):
+        stub = FakeDataStub(self.files, [])
+        changes = request_changes(stub, self.ptr, self.ptr, contents=False, uast=True,
+                                  unicode=False, languages=("python",))
+        self.assertEqual([c.head.path for c in changes], ["src/a.py", "src/c.py", "src/d.py"])
+        request = stub.requests[0]
+        self.assertEqual(list(request.include_languages), ["python"])
+        self.assertEqual(request.include_pattern, "")
+
+    def test_skip_identical(self):
+        stub = FakeDataStub(self.files, [])
+        changes = list(request_changes(stub, self.ptr, self.ptr, contents=True, uast=False,
+                                       unicode=True))
+        self.assertEqual(len(changes), 4)
+        self.assertIs(changes[0].base, changes[0].head)
+        changes = request_changes(stub, self.ptr, self.ptr, contents=True, uast=False,
+                                  unicode=False, skip_identical=True)
+        self.assertEqual(list(changes), [])
+        changes = request_changes(stub, self.ptr, self.ptr, contents=False, uast=False,
+                                  unicode=False, skip_identical=True)
+        self.assertEqual(len(list(changes)), 4)
+
+    def test_no_filters(self):
+        stub = FakeDataStub(self.files, [])
+        files = request_files(stub, self.ptr, contents=True, uast=False, unicode=False)
+        self.assertIsInstance(files, FakeStream)
+        self.assertEqual(list(files), self.files)
+        self.assertEqual(list(stub.requests[0].include_languages), [])
+
+    def test_cancel(self):
+        stub = FakeDataStub(self.files, [])
+        for measure_bytes in (False, True):
+            changes = request_changes(stub, self.ptr, self.ptr, contents=False, uast=False,
+                                      unicode=False, languages=("python",),
+                                      measure_bytes=measure_bytes)
+            self.assertEqual(next(changes).head.path, "src/a.py")
+            changes.cancel()
+            self.assertEqual(list(changes), [])
+
+
+class FakeContentsStub:
+    def __init__(self, files):
+        self.files = files
+        self.requests = []
+
+    def GetChanges(self, request):  # noqa: N802
+        self.requests.append(request)
+        return FakeStream([Change(base=File(path=file.path, hash=file.hash, uast=file.uast),
+                                  head=File(path=file.path, hash=file.hash, uast=file.uast))
+                           for file in self.files])
+
+    def GetFiles(self, request):  # noqa: N802
+        self.requests.append(request)
+        return FakeStream([file for file in self.files
+                           if re.match(request.include_pattern, file.path)])
+
+
+class LazyContentsTests(unittest.TestCase):
+    def setUp(self):
+        self.content, self.uast = create_small_uast()
+        self.files = [File(path="%d.js" % i, content=self.content, uast=self.uast)
+                      for i in range(10)]
+        self.stub = FakeContentsStub(self.files)
+        self.ptr_from = ReferencePointer("repo", "ref", "1" * 40)
+        self.ptr_to = ReferencePointer("repo", "ref", "2" * 40)
+
+    def test_batch(self):
+        changes = list(request_changes_with_lazy_contents(
+            lambda: self.stub, self.ptr_from, self.ptr_to, unicode=False, batch_size=3))
+        self.assertEqual(len(changes), 10)
+        self.assertIsInstance(changes[0], LazyContentChange)
+        self.assertFalse(self.stub.requests[0].want_contents)
+        self.assertTrue(self.stub.requests[0].want_uast)
+        self.assertEqual(changes[0].head.uast, self.uast)
+        for change in changes[:5]:
+            change.head.request()
+        self.assertEqual(len(self.stub.requests), 1)
+        self.assertEqual(changes[4].head.content, self.content)
+        self.assertEqual(len(self.stub.requests), 2)
+        self.assertEqual(self.stub.requests[1].revision.hash, "2" * 40)
+        self.assertEqual(self.stub.requests[1].include_pattern, "^(4\\.js|0\\.js|1\\.js)$")
+        for change in changes[:4]:
+            self.assertEqual(change.head.content, self.content)
+        self.assertEqual(len(self.stub.requests), 3)
+        self.assertTrue(changes[0].head.fetched)
+        self.assertFalse(changes[0].base.fetched)
+        self.assertFalse(changes[5].head.fetched)
+
+    def test_fetch_concurrently(self):
+        started, proceed = threading.Event(), threading.Event()
+        stub = self.stub
+
+        class SlowContentsStub:
+            def GetFiles(self, request):  # noqa: N802
+                started.set()
+                proceed.wait()
+                return stub.GetFiles(request)
+
+        fetcher = LazyContentFetcher(SlowContentsStub, self.ptr_to, batch_size=10)
+        fetcher.register("0.js")
+        fetcher.register("1.js")
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            first = executor.submit(fetcher.get, "0.js")
+            self.assertTrue(started.wait(10))
+            second = executor.submit(fetcher.get, "1.js")
+            # the lock is not held during the RPC
+            fetcher.register("2.js")
+            proceed.set()
+            self.assertEqual(first.result(), self.content)
+            self.assertEqual(second.result(), self.content)
+        self.assertEqual(len(stub.requests), 1)
+        self.assertEqual(stub.requests[0].include_pattern, "^(0\\.js|1\\.js)$")
+
+    def test_unicode(self):
+        change = next(request_changes_with_lazy_contents(
+            lambda: self.stub, self.ptr_from, self.ptr_to, unicode=True))
+        self.assertEqual(change.base.uast.end_position.offset, 6)
+        self.assertEqual(change.base.content, self.content.decode())
+        self.assertEqual(len(self.stub.requests), 2)
+
+    def test_no_path(self):
+        change = next(request_changes_with_lazy_contents(
+            lambda: FakeContentsStub([File(path="")]), self.ptr_from, self.ptr_to,
+            unicode=False))
+        self.assertEqual(change.head.content, b"")
+
+    def test_skip_identical(self):
+        self.files[0].hash = "0" * 40
+        changes = list(request_changes_with_lazy_contents(
+            lambda: self.stub, self.ptr_from, self.ptr_to, unicode=False, skip_identical=True))
+        # the sides without the hashes may have different contents
+        self.assertEqual([c.head.path for c in changes], ["%d.js" % i for i in range(1, 10)])
+
+    def test_make_paths_pattern(self):
+        pattern = re.compile(make_paths_pattern(["a/b.py", "c+[1].js"]))
+        self.assertTrue(pattern.match("a/b.py"))
+        self.assertTrue(pattern.match("c+[1].js"))
+        self.assertFalse(pattern.match("a/bxpy"))
+        self.assertFalse(pattern.match("a/b.py.orig"))
+
+
+class FakeBblfshStub:
+    def __init__(self, uast, delays=None):
+        self.uast = uast
+        self.delays = delays or {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def Parse(self, request, timeout=None):  # noqa: N802
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        threading.Event().wait(self.delays.get(request.filename, 0.01))
+        with self.lock:
+            self.in_flight -= 1
+        return namedtuple("ParseResponse", ("uast", "errors", "language"))(
+            self.uast, [], request.language or "javascript")
+
+
+class ParseUastsTests(unittest.TestCase):
+    def setUp(self):
+        self.content, self.uast = create_small_uast()
+        self.files = [File(path="%d.js" % i, content=self.content) for i in range(20)]
+
+    def test_ordered(self):
+        stub = FakeBblfshStub(self.uast, {"0.js": 0.2})
+        results = list(parse_uasts(stub, self.files, unicode=False, concurrency=4))
+        self.assertEqual([f.path for f, _ in results], [f.path for f in self.files])
+        self.assertEqual(stub.max_in_flight, 4)
+        file, errors = results[0]
+        self.assertEqual(errors, [])
+        self.assertEqual(file.language, "javascript")
+        self.assertEqual(file.uast, self.uast)
+
+    def test_unordered(self):
+        stub = FakeBblfshStub(self.uast, {"0.js": 0.2})
+        results = list(parse_uasts(stub, self.files, unicode=False, concurrency=4,
+                                   ordered=False))
+        self.assertEqual(sorted(f.path for f, _ in results), sorted(f.path for f in self.files))
+        self.assertNotEqual(results[0][0].path, "0.js")
+
+    def test_unicode(self):
+        stub = FakeBblfshStub(self.uast)
+        file, errors = next(parse_uasts(stub, self.files, unicode=True))
+        self.assertIsInstance(file, UnicodeFile)
+        self.assertEqual(file.content, self.content.decode())
+        self.assertEqual(file.uast.end_position.offset, 6)
+
+    def test_not_utf8(self):
+        stub = FakeBblfshStub(self.uast)
+        files = [File(path="bad.js", content=b"\xff"), File(path="good.js", content=b"x")]
+        results = list(parse_uasts(stub, files, unicode=False, concurrency=2))
+        self.assertEqual(len(results[0][1]), 1)
+        self.assertEqual(results[1][1], [])
+
+    def test_close(self):
+        stub = FakeBblfshStub(self.uast)
+        results = parse_uasts(stub, self.files, unicode=False, concurrency=2)
+        next(results)
+        results.close()
+        threading.Event().wait(0.05)
+        self.assertEqual(stub.in_flight, 0)
+
+
+class FakeSupportedLanguagesStub:
+    def __init__(self):
+        self.calls = 0
+
+    def SupportedLanguages(self, request):  # noqa: N802
+        self.calls += 1
+        driver = namedtuple("Driver", ("language", "version"))("javascript", "2.%d.0" % self.calls)
+        return namedtuple("SupportedLanguagesResponse", ("languages",))([driver])
+
+
+class DriverVersionsTests(unittest.TestCase):
+    def setUp(self):
+        self.stub = FakeSupportedLanguagesStub()
+        self.data_service = DataService("localhost:1", bblfsh_drivers_ttl=0.1)
+        self.data_service.get_bblfsh = lambda: self.stub
+
+    def tearDown(self):
+        self.data_service.shutdown()
+
+    def test_cache(self):
+        for _ in range(3):
+            self.data_service.check_bblfsh_driver_versions(["javascript>=2.1.0"])
+        self.assertEqual(self.stub.calls, 1)
+        with self.assertRaises(UnsatisfiedDriverVersionError):
+            self.data_service.check_bblfsh_driver_versions(["javascript>=2.2.0", "go"])
+        threading.Event().wait(0.1)
+        self.data_service.check_bblfsh_driver_versions(["javascript>=2.2.0"])
+        self.assertEqual(self.stub.calls, 2)
+
+    def test_invalidate(self):
+        self.assertEqual(str(self.data_service.get_bblfsh_driver_versions()["javascript"]),
+                         "2.1.0")
+        self.data_service.invalidate_bblfsh_driver_versions()
+        self.assertEqual(str(self.data_service.get_bblfsh_driver_versions()["javascript"]),
+                         "2.2.0")
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+import time
+import unittest
+
+import grpc
+
+from lookout.core.analyzer import ReferencePointer
+from lookout.core.api.service_data_pb2 import Change, File
+from lookout.core.api.service_data_pb2_grpc import add_DataServicer_to_server, DataServicer
+from lookout.core.data_requests import DataService, request_changes, request_files
+from lookout.core.helpers.data_snapshot import RecordingDataService, SnapshotDataServer
+
+
+class FakeDataServicer(DataServicer):
+    def __init__(self, files):
+        self.files = files
+        self.calls = 0
+
+    def GetFiles(self, request, context):  # noqa: N802
+        self.calls += 1
+        yield from self.files
+
+    def GetChanges(self, request, context):  # noqa: N802
+        self.calls += 1
+        for file in self.files:
+            yield Change(base=File(), head=file)
+
+
+class DataSnapshotTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory(prefix="lookout-snapshot-")
+        self.files = [File(path="%d.py" % i, content=b"x = %d" % i, language="Python")
+                      for i in range(10)]
+        self.ptr_from = ReferencePointer("repo", "ref", "1" * 40)
+        self.ptr_to = ReferencePointer("repo", "ref", "2" * 40)
+        self.servicer = FakeDataServicer(self.files)
+        self.server = grpc.server(ThreadPoolExecutor(max_workers=1))
+        add_DataServicer_to_server(self.servicer, self.server)
+        port = self.server.add_insecure_port("localhost:0")
+        self.server.start()
+        data_service = RecordingDataService("localhost:%d" % port, self.tmpdir.name)
+        try:
+            self.assertEqual(len(list(request_files(
+                data_service.get_data(), self.ptr_to, contents=True, uast=False,
+                unicode=False))), 10)
+            self.assertEqual(len(list(request_changes(
+                data_service.get_data(), self.ptr_from, self.ptr_to, contents=True,
+                uast=False, unicode=False))), 10)
+        finally:
+            data_service.shutdown()
+            self.server.stop(None)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_replay(self):
+        with SnapshotDataServer(self.tmpdir.name) as server:
+            data_service = DataService(server.address)
+            try:
+                files = list(request_files(data_service.get_data(), self.ptr_to, contents=True,
+                                           uast=False, unicode=False))
+                self.assertEqual(files, self.files)
+                changes = list(request_changes(data_service.get_data(), self.ptr_from,
+                                               self.ptr_to, contents=True, uast=False,
+                                               unicode=False))
+                self.assertEqual([c.head for c in changes], self.files)
+                self.assertFalse(changes[0].base.path)
+                with self.assertRaises(grpc.RpcError) as error:
+                    list(request_files(data_service.get_data(), self.ptr_from, contents=True,
+                                       uast=False, unicode=False))
+                self.assertEqual(error.exception.code(), grpc.StatusCode.NOT_FOUND)
+            finally:
+                data_service.shutdown()
+        # the listings and the complete responses while recording
+        self.assertEqual(self.servicer.calls, 4)
+
+    def test_throttling(self):
+        size = sum(f.ByteSize() for f in self.files)
+        with SnapshotDataServer(self.tmpdir.name, latency=0.1, bandwidth=size / 0.2) as server:
+            data_service = DataService(server.address)
+            try:
+                start = time.monotonic()
+                files = list(request_files(data_service.get_data(), self.ptr_to, contents=True,
+                                           uast=False, unicode=False))
+                elapsed = time.monotonic() - start
+            finally:
+                data_service.shutdown()
+        self.assertEqual(len(files), 10)
+        self.assertGreaterEqual(elapsed, 0.3)
+
+
+if __name__ == "__main__":
+    unittest.main()
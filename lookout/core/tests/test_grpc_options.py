@@ -0,0 +1,47 @@
+import unittest
+
+from lookout.core.channel_pool import ChannelPool
+from lookout.core.data_requests import DataService
+from lookout.core.event_listener import EventListener
+from lookout.core.grpc_options import make_grpc_options
+
+
+class GrpcOptionsTests(unittest.TestCase):
+    def test_make_grpc_options(self):
+        options = dict(make_grpc_options(compression="gzip", max_message_size=1024,
+                                         window_size=4096))
+        self.assertEqual(options["grpc.default_compression_algorithm"], 2)
+        self.assertEqual(options["grpc.max_send_message_length"], 1024)
+        self.assertEqual(options["grpc.max_receive_message_length"], 1024)
+        self.assertEqual(options["grpc.http2.lookahead_bytes"], 4096)
+        self.assertEqual(options["grpc.http2.bdp_probe"], 0)
+        options = dict(make_grpc_options())
+        self.assertEqual(options["grpc.default_compression_algorithm"], 0)
+        self.assertNotIn("grpc.http2.lookahead_bytes", options)
+        with self.assertRaises(ValueError):
+            make_grpc_options(compression="brotli")
+
+    def test_channel_pool_overrides(self):
+        pool = ChannelPool("localhost:1", 1, options=make_grpc_options(
+            compression="deflate", max_message_size=1024))
+        options = dict(pool._options)
+        self.assertEqual(len(options), len(pool._options))
+        self.assertEqual(options["grpc.default_compression_algorithm"], 1)
+        self.assertEqual(options["grpc.max_receive_message_length"], 1024)
+        self.assertIn("grpc.keepalive_time_ms", options)
+        pool.borrow()
+        pool.close()
+
+    def test_wiring(self):
+        options = make_grpc_options(compression="gzip")
+        data_service = DataService("localhost:1", channel_options=options)
+        self.assertEqual(dict(data_service._channel_pool._options)[
+            "grpc.default_compression_algorithm"], 2)
+        data_service.shutdown()
+        listener = EventListener("localhost:0", None, options=options)
+        listener.start()
+        listener.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,6 +4,7 @@ from tempfile import NamedTemporaryFile
 import unittest
 
 from bblfsh import BblfshClient, Node, Position
+from bblfsh.aliases import ParseResponse
 
 from lookout.core.api.service_data_pb2 import File
 from lookout.core.lib import extract_changed_nodes, files_by_language, filter_files, \
@@ -109,6 +110,23 @@ class LibTests(unittest.TestCase):
             finally:
                 bblfsh_client._channel.close()
 
+    def test_parse_files_client(self):
+        class FakeBblfshClient:
+            def parse(self, filename, language=None, contents=None, timeout=None):
+                calls.append((filename, language, contents))
+                return ParseResponse(uast=Node(internal_type="Module"), language="javascript")
+
+        calls = []
+        with NamedTemporaryFile(prefix="one", suffix=".js") as tmp:
+            tmp.write(b"hello")
+            tmp.seek(0)
+            filtered = parse_files(filepaths=[tmp.name], line_length_limit=80,
+                                   overall_size_limit=5 << 20, client=FakeBblfshClient(),
+                                   language="javascript")
+        self.assertEqual(calls, [(os.path.basename(tmp.name), None, b"hello")])
+        self.assertEqual(len(filtered), 1)
+        self.assertEqual(filtered[0].uast.internal_type, "Module")
+
     def text_filter_1000_files(self):
         def create_files():
             files = [File(path="one", content=b"hello"),
@@ -1,5 +1,8 @@
+import asyncio
+from contextlib import contextmanager
 import logging
-from typing import Tuple
+import threading
+from typing import Iterator, Tuple
 import unittest
 
 import bblfsh
@@ -9,8 +12,10 @@ from lookout.core import slogging
 from lookout.core.analyzer import Analyzer, AnalyzerModel, DummyAnalyzerModel, ReferencePointer
 from lookout.core.api.event_pb2 import PushEvent, ReviewEvent
 from lookout.core.api.service_analyzer_pb2 import Comment, EventResponse
+from lookout.core.api.service_data_pb2 import Change, File
 from lookout.core.api.service_data_pb2_grpc import DataStub
-from lookout.core.data_requests import DataService
+from lookout.core.data_requests import DataService, with_changed_contents, \
+    with_changed_uasts
 from lookout.core.manager import AnalyzerManager
 from lookout.core.model_repository import ModelRepository
 from lookout.core.ports import Type
@@ -52,7 +57,9 @@ class FakeAnalyzer(Analyzer):
     def train(cls, ptr: ReferencePointer, config: dict, data_service: DataService, **data) \
             -> AnalyzerModel:
         cls.service = data_service
-        return FakeModel()
+        model = FakeModel()
+        model.ptr = ptr
+        return model
 
     @classmethod
     def check_training_required(
@@ -87,6 +94,67 @@ class FakeDummyAnalyzer(Analyzer):
         return DummyAnalyzerModel()
 
 
+class FakeAsyncAnalyzer(Analyzer):
+    version = 1
+    model_type = FakeModel
+    name = "fake.analyzer.FakeAsyncAnalyzer"
+    vendor = "source{d}"
+    service = None
+
+    async def analyze(self, ptr_from: ReferencePointer, ptr_to: ReferencePointer,
+                      data_service: DataService, **data) -> [Comment]:
+        FakeAsyncAnalyzer.service = data_service
+        await asyncio.sleep(0)
+        comment = Comment()
+        comment.text = "async %s|%s" % (ptr_from.commit, ptr_to.commit)
+        return [comment]
+
+    @classmethod
+    async def train(cls, ptr: ReferencePointer, config: dict, data_service: DataService,
+                    **data) -> AnalyzerModel:
+        cls.service = data_service
+        await asyncio.sleep(0)
+        return FakeModel()
+
+
+class FakeSlowAnalyzer(FakeDummyAnalyzer):
+    name = "fake.analyzer.FakeSlowAnalyzer"
+    delay = 0.1
+
+    def analyze(self, ptr_from: ReferencePointer, ptr_to: ReferencePointer,
+                data_service: DataService, **data) -> [Comment]:
+        threading.Event().wait(self.delay)
+        comment = Comment()
+        comment.text = "slow"
+        return [comment]
+
+
+class FakeFailingAnalyzer(FakeDummyAnalyzer):
+    name = "fake.analyzer.FakeFailingAnalyzer"
+
+    def analyze(self, ptr_from: ReferencePointer, ptr_to: ReferencePointer,
+                data_service: DataService, **data) -> [Comment]:
+        raise ValueError("boom")
+
+
+class FakeFallbackAnalyzer(FakeAnalyzer):
+    name = "fake.analyzer.FakeFallbackAnalyzer"
+    untrained_fallback = FakeSlowAnalyzer
+
+
+class FakeSlowTrainingAnalyzer(FakeAnalyzer):
+    name = "fake.analyzer.FakeSlowTrainingAnalyzer"
+    skip_train = True
+    trainings = 0
+
+    @classmethod
+    def train(cls, ptr: ReferencePointer, config: dict, data_service: DataService, **data) \
+            -> AnalyzerModel:
+        cls.trainings += 1
+        threading.Event().wait(0.2)
+        return super().train(ptr, config, data_service, **data)
+
+
 class FakeDataService:
     def get_data(self) -> DataStub:
         return "XXX"
@@ -94,10 +162,88 @@ class FakeDataService:
     def get_bblfsh(self) -> bblfsh.aliases.ProtocolServiceStub:
         return "YYY"
 
+    def release_channel(self):
+        pass
+
     def shutdown(self):
         pass
 
 
+class FakeUpdatingAnalyzer(FakeAnalyzer):
+    name = "fake.analyzer.FakeUpdatingAnalyzer"
+    updated = None
+    trained = False
+
+    @classmethod
+    def train(cls, ptr: ReferencePointer, config: dict, data_service: DataService, **data) \
+            -> AnalyzerModel:
+        cls.trained = True
+        return super().train(ptr, config, data_service, **data)
+
+    @classmethod
+    def update(cls, model: AnalyzerModel, ptr_from: ReferencePointer, ptr_to: ReferencePointer,
+               config: dict, data_service: DataService, **data) -> AnalyzerModel:
+        cls.updated = ptr_from, ptr_to
+        model = FakeModel()
+        model.ptr = ptr_to
+        return model
+
+
+class FakeChangesStub:
+    def __init__(self, changes: int):
+        self.changes = changes
+        self.requests = []
+
+    def GetChanges(self, request):  # noqa: N802
+        self.requests.append(request)
+        return iter([Change(head=File(path=str(i))) for i in range(self.changes)])
+
+
+class FakeChangesDataService(FakeDataService):
+    def __init__(self, changes: int):
+        self.stub = FakeChangesStub(changes)
+
+    def get_data(self) -> DataStub:
+        return self.stub
+
+
+class FakeSharedChangesDataService(FakeChangesDataService):
+    unicode_pool = None
+    unicode_cache = None
+    prefetch_bytes = 0
+    stream_retries = 0
+    stream_retry_backoff = 1
+    measure_stream_bytes = False
+
+    def reconnect_data(self) -> DataStub:
+        return self.stub
+
+    def close_channel(self):
+        pass
+
+
+class FakeUastsAnalyzer(FakeDummyAnalyzer):
+    name = "fake.analyzer.FakeUastsAnalyzer"
+
+    @with_changed_uasts(unicode=False)
+    def analyze(self, ptr_from: ReferencePointer, ptr_to: ReferencePointer,
+                data_service: DataService, **data) -> [Comment]:
+        comment = Comment()
+        comment.text = "uasts %d" % len(list(data["changes"]))
+        return [comment]
+
+
+class FakeContentsAnalyzer(FakeDummyAnalyzer):
+    name = "fake.analyzer.FakeContentsAnalyzer"
+
+    @with_changed_contents(unicode=False)
+    def analyze(self, ptr_from: ReferencePointer, ptr_to: ReferencePointer,
+                data_service: DataService, **data) -> [Comment]:
+        comment = Comment()
+        comment.text = "contents %d" % len(list(data["changes"]))
+        return [comment]
+
+
 class FakeModelRepository(ModelRepository):
     def __init__(self):
         self.get_calls = []
@@ -106,7 +252,9 @@ class FakeModelRepository(ModelRepository):
     def get(self, model_id: str, model_type: Type[AnalyzerModel], url: str) -> \
             Tuple[AnalyzerModel, bool]:
         self.get_calls.append((model_id, model_type, url))
-        return FakeModel(), True
+        model = FakeModel()
+        model.ptr = ReferencePointer(url, "refs/heads/master", "70" * 20)
+        return model, True
 
     def set(self, model_id: str, url: str, model: AnalyzerModel):
         self.set_calls.append((model_id, url, model))
@@ -118,6 +266,33 @@ class FakeModelRepository(ModelRepository):
         pass
 
 
+class FakeLockedModelRepository(FakeModelRepository):
+    def __init__(self):
+        super().__init__()
+        self.lock_calls = []
+
+    @contextmanager
+    def training_lock(self, model_id: str, url: str) -> Iterator[bool]:
+        self.lock_calls.append((model_id, url))
+        yield True
+
+
+class FakeEmptyModelRepository(FakeModelRepository):
+    def __init__(self):
+        super().__init__()
+        self.models = {}
+
+    def get(self, model_id: str, model_type: Type[AnalyzerModel], url: str) -> \
+            Tuple[AnalyzerModel, bool]:
+        self.get_calls.append((model_id, model_type, url))
+        model = self.models.get((model_id, url))
+        return model, model is None
+
+    def set(self, model_id: str, url: str, model: AnalyzerModel):
+        super().set(model_id, url, model)
+        self.models[(model_id, url)] = model
+
+
 class AnalyzerManagerTests(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -130,6 +305,7 @@ class AnalyzerManagerTests(unittest.TestCase):
             [FakeAnalyzer, FakeAnalyzer, FakeDummyAnalyzer],
             self.model_repository, self.data_service)
         FakeAnalyzer.stub = None
+        FakeAnalyzer.skip_train = False
         FakeDummyAnalyzer.skip_train = False
         FakeAnalyzer.service = None
 
@@ -193,6 +369,205 @@ class AnalyzerManagerTests(unittest.TestCase):
         self.assertEqual(len(self.model_repository.set_calls), 0)
         self.assertIsNone(FakeAnalyzer.service)
 
+    def test_process_review_event_async(self):
+        async_data_service = FakeDataService()
+        manager = AnalyzerManager([FakeAnalyzer, FakeAsyncAnalyzer], self.model_repository,
+                                  self.data_service, async_data_service)
+        request = ReviewEvent()
+        for ptr, commit in ((request.commit_revision.base, "00" * 20),
+                            (request.commit_revision.head, "ff" * 20)):
+            ptr.internal_repository_url = "foo"
+            ptr.reference_name = "refs/heads/master"
+            ptr.hash = commit
+        response = manager.process_review_event(request)
+        self.assertEqual([c.text for c in response.comments],
+                         ["00" * 20 + "|" + "ff" * 20, "async " + "00" * 20 + "|" + "ff" * 20])
+        self.assertIs(FakeAsyncAnalyzer.service, async_data_service)
+        self.assertIs(FakeAnalyzer.service, self.data_service)
+        FakeAsyncAnalyzer.service = None
+        request = PushEvent()
+        request.commit_revision.head.internal_repository_url = "foo"
+        request.commit_revision.head.reference_name = "refs/heads/master"
+        request.commit_revision.head.hash = "80" * 20
+        manager.process_push_event(request)
+        self.assertIs(FakeAsyncAnalyzer.service, async_data_service)
+        with self.assertRaises(ValueError):
+            AnalyzerManager([FakeAsyncAnalyzer], self.model_repository,
+                            self.data_service).process_push_event(request)
+
+    def test_process_push_event_update(self):
+        FakeUpdatingAnalyzer.updated = None
+        FakeUpdatingAnalyzer.trained = False
+        FakeUpdatingAnalyzer.skip_train = False
+        request = PushEvent()
+        request.commit_revision.head.internal_repository_url = "wow"
+        request.commit_revision.head.reference_name = "refs/heads/master"
+        request.commit_revision.head.hash = "80" * 20
+        data_service = FakeChangesDataService(3)
+        manager = AnalyzerManager([FakeUpdatingAnalyzer], self.model_repository, data_service,
+                                  max_update_changes=3)
+        manager.process_push_event(request)
+        self.assertFalse(FakeUpdatingAnalyzer.trained)
+        ptr_from, ptr_to = FakeUpdatingAnalyzer.updated
+        self.assertEqual(ptr_from.commit, "70" * 20)
+        self.assertEqual(ptr_to.commit, "80" * 20)
+        self.assertEqual(self.model_repository.set_calls[0][2].ptr, ptr_to)
+        changes_request = data_service.stub.requests[0]
+        self.assertEqual(changes_request.base.hash, "70" * 20)
+        self.assertFalse(changes_request.want_contents)
+        self.assertFalse(changes_request.want_uast)
+
+        FakeUpdatingAnalyzer.updated = None
+        manager = AnalyzerManager([FakeUpdatingAnalyzer], self.model_repository, data_service,
+                                  max_update_changes=2)
+        manager.process_push_event(request)
+        self.assertTrue(FakeUpdatingAnalyzer.trained)
+        self.assertIsNone(FakeUpdatingAnalyzer.updated)
+
+    @staticmethod
+    def make_review_event() -> ReviewEvent:
+        request = ReviewEvent()
+        for ptr, commit in ((request.commit_revision.base, "00" * 20),
+                            (request.commit_revision.head, "ff" * 20)):
+            ptr.internal_repository_url = "foo"
+            ptr.reference_name = "refs/heads/master"
+            ptr.hash = commit
+        return request
+
+    def test_process_review_event_concurrently(self):
+        request = self.make_review_event()
+        FakeSlowAnalyzer.delay = 0.1
+        manager = AnalyzerManager([FakeSlowAnalyzer, FakeAnalyzer, FakeFailingAnalyzer],
+                                  self.model_repository, self.data_service,
+                                  analyzer_workers=3)
+        try:
+            response = manager.process_review_event(request)
+        finally:
+            manager.shutdown()
+        # FakeAnalyzer < FakeFailingAnalyzer < FakeSlowAnalyzer
+        self.assertEqual([c.text for c in response.comments],
+                         ["%s|%s" % ("00" * 20, "ff" * 20), "slow"])
+
+    def test_process_review_event_timeout(self):
+        request = self.make_review_event()
+        FakeSlowAnalyzer.delay = 1
+        manager = AnalyzerManager([FakeSlowAnalyzer, FakeAnalyzer], self.model_repository,
+                                  self.data_service, analyzer_workers=2, analyzer_timeout=0.1)
+        try:
+            response = manager.process_review_event(request)
+        finally:
+            manager.shutdown()
+        self.assertEqual(len(response.comments), 1)
+        self.assertEqual(response.comments[0].text, "%s|%s" % ("00" * 20, "ff" * 20))
+
+    def test_process_review_event_shared_changes(self):
+        request = self.make_review_event()
+        analyzers = [FakeUastsAnalyzer, FakeContentsAnalyzer, FakeDummyAnalyzer]
+        for share_changes, requests in ((False, 2), (True, 1)):
+            data_service = FakeSharedChangesDataService(10)
+            manager = AnalyzerManager(analyzers, self.model_repository, data_service,
+                                      share_changes=share_changes)
+            response = manager.process_review_event(request)
+            self.assertEqual([c.text for c in response.comments],
+                             ["contents 10", "uasts 10"])
+            self.assertEqual(len(data_service.stub.requests), requests)
+        self.assertTrue(data_service.stub.requests[0].want_contents)
+        self.assertTrue(data_service.stub.requests[0].want_uast)
+
+    def test_process_review_event_background_training(self):
+        request = self.make_review_event()
+        FakeSlowAnalyzer.delay = 0
+        model_repository = FakeEmptyModelRepository()
+        analyzers = [FakeAnalyzer, FakeFallbackAnalyzer]
+        manager = AnalyzerManager(analyzers, model_repository, self.data_service,
+                                  background_training=True)
+        try:
+            response = manager.process_review_event(request)
+        finally:
+            manager.shutdown(wait=True)
+        self.assertEqual([c.text for c in response.comments], ["slow"])
+        self.assertEqual(sorted(c[0] for c in model_repository.set_calls),
+                         ["fake.analyzer.FakeAnalyzer/1", "fake.analyzer.FakeFallbackAnalyzer/1"])
+        manager = AnalyzerManager(analyzers, model_repository, self.data_service,
+                                  background_training=True)
+        try:
+            response = manager.process_review_event(request)
+        finally:
+            manager.shutdown(wait=True)
+        self.assertEqual([c.text for c in response.comments],
+                         ["%s|%s" % ("00" * 20, "ff" * 20)] * 2)
+        self.assertEqual(len(model_repository.set_calls), 2)
+
+    def test_process_push_event_single_flight(self):
+        FakeSlowTrainingAnalyzer.trainings = 0
+        model_repository = FakeEmptyModelRepository()
+        manager = AnalyzerManager([FakeSlowTrainingAnalyzer], model_repository,
+                                  self.data_service)
+        request = PushEvent()
+        request.commit_revision.head.internal_repository_url = "foo"
+        request.commit_revision.head.reference_name = "refs/heads/master"
+        request.commit_revision.head.hash = "00" * 20
+        threads = [threading.Thread(target=manager.process_push_event, args=(request,))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(FakeSlowTrainingAnalyzer.trainings, 1)
+        self.assertEqual(len(model_repository.set_calls), 1)
+
+    def test_process_push_event_training_lock(self):
+        model_repository = FakeLockedModelRepository()
+        manager = AnalyzerManager([FakeAnalyzer], model_repository, self.data_service)
+        request = PushEvent()
+        request.commit_revision.head.internal_repository_url = "foo"
+        request.commit_revision.head.reference_name = "refs/heads/master"
+        for commit, trained in (("70", False), ("80", True)):
+            request.commit_revision.head.hash = commit * 20
+            model_repository.set_calls.clear()
+            manager.process_push_event(request)
+            self.assertEqual(len(model_repository.set_calls), int(trained))
+
+    def test_process_push_event_update_locked(self):
+        FakeUpdatingAnalyzer.updated = None
+        FakeUpdatingAnalyzer.trained = False
+        model_repository = FakeLockedModelRepository()
+        manager = AnalyzerManager([FakeUpdatingAnalyzer], model_repository,
+                                  FakeChangesDataService(3), max_update_changes=3)
+        request = PushEvent()
+        request.commit_revision.head.internal_repository_url = "foo"
+        request.commit_revision.head.reference_name = "refs/heads/master"
+        request.commit_revision.head.hash = "80" * 20
+        manager.process_push_event(request)
+        self.assertFalse(FakeUpdatingAnalyzer.trained)
+        self.assertEqual(FakeUpdatingAnalyzer.updated[1].commit, "80" * 20)
+        self.assertEqual(model_repository.lock_calls,
+                         [("fake.analyzer.FakeUpdatingAnalyzer/1", "foo")])
+        self.assertEqual(len(model_repository.set_calls), 1)
+
+    def test_process_push_event_debounce(self):
+        FakeUpdatingAnalyzer.trained = False
+        model_repository = FakeEmptyModelRepository()
+        manager = AnalyzerManager([FakeUpdatingAnalyzer], model_repository, self.data_service,
+                                  push_debounce=10)
+        try:
+            for commit in ("00", "11", "22"):
+                request = PushEvent()
+                request.commit_revision.head.internal_repository_url = "foo"
+                request.commit_revision.head.reference_name = "refs/heads/master"
+                request.commit_revision.head.hash = commit * 20
+                response = manager.process_push_event(request)
+                self.assertEqual(response.analyzer_version, manager.version)
+            self.assertFalse(FakeUpdatingAnalyzer.trained)
+        finally:
+            manager.shutdown(wait=True)
+        self.assertTrue(FakeUpdatingAnalyzer.trained)
+        self.assertEqual(len(model_repository.set_calls), 1)
+
+    def test_supports_update(self):
+        self.assertFalse(FakeAnalyzer.supports_update())
+        self.assertTrue(FakeUpdatingAnalyzer.supports_update())
+
 
 class AnalyzerManagerUtilsTests(unittest.TestCase):
     def test_protobuf_struct_to_dict(self):
@@ -0,0 +1,91 @@
+import threading
+import time
+import unittest
+
+from lookout.core.api.event_pb2 import PushEvent
+from lookout.core.push_scheduler import PushScheduler
+
+
+def make_push_event(url: str, commit: str) -> PushEvent:
+    request = PushEvent()
+    request.commit_revision.head.internal_repository_url = url
+    request.commit_revision.head.reference_name = "refs/heads/master"
+    request.commit_revision.head.hash = commit * 20
+    return request
+
+
+class PushSchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.processed = []
+        self.lock = threading.Lock()
+
+    def process(self, request: PushEvent):
+        with self.lock:
+            self.processed.append((request.commit_revision.head.internal_repository_url,
+                                   request.commit_revision.head.hash[:2]))
+
+    def test_coalesce(self):
+        scheduler = PushScheduler(self.process, debounce=10)
+        for commit in ("00", "11", "22"):
+            scheduler.submit(make_push_event("foo", commit))
+        scheduler.submit(make_push_event("bar", "33"))
+        self.assertEqual(self.processed, [])
+        scheduler.shutdown(wait=True)
+        self.assertEqual(sorted(self.processed), [("bar", "33"), ("foo", "22")])
+        with self.assertRaises(RuntimeError):
+            scheduler.submit(make_push_event("foo", "44"))
+
+    def test_debounce(self):
+        scheduler = PushScheduler(self.process, debounce=0.2)
+        try:
+            scheduler.submit(make_push_event("foo", "00"))
+            time.sleep(0.1)
+            scheduler.submit(make_push_event("foo", "11"))
+            time.sleep(0.1)
+            self.assertEqual(self.processed, [])
+            time.sleep(0.4)
+            self.assertEqual(self.processed, [("foo", "11")])
+        finally:
+            scheduler.shutdown()
+
+    def test_max_delay(self):
+        scheduler = PushScheduler(self.process, debounce=0.2, max_delay=0.3)
+        try:
+            for commit in ("00", "11", "22", "33", "44"):
+                scheduler.submit(make_push_event("foo", commit))
+                time.sleep(0.1)
+            self.assertEqual(len(self.processed), 1)
+        finally:
+            scheduler.shutdown(wait=True)
+        self.assertEqual(self.processed[-1], ("foo", "44"))
+
+    def test_not_concurrent(self):
+        release = threading.Event()
+        running = []
+
+        def process(request: PushEvent):
+            running.append(request.commit_revision.head.hash[:2])
+            release.wait(5)
+            self.process(request)
+
+        scheduler = PushScheduler(process, debounce=0.01, workers=2)
+        try:
+            scheduler.submit(make_push_event("foo", "00"))
+            time.sleep(0.1)
+            scheduler.submit(make_push_event("foo", "11"))
+            time.sleep(0.1)
+            self.assertEqual(running, ["00"])
+            release.set()
+        finally:
+            scheduler.shutdown(wait=True)
+        self.assertEqual(self.processed, [("foo", "00"), ("foo", "11")])
+
+    def test_discard(self):
+        scheduler = PushScheduler(self.process, debounce=10)
+        scheduler.submit(make_push_event("foo", "00"))
+        scheduler.shutdown()
+        self.assertEqual(self.processed, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
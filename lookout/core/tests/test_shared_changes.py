@@ -0,0 +1,169 @@
+from concurrent.futures import ThreadPoolExecutor
+import unittest
+
+from lookout.core.analyzer import ReferencePointer, UnicodeFile
+from lookout.core.api.service_data_pb2 import Change, File
+from lookout.core.data_requests import ChangesRequirements
+from lookout.core.shared_changes import merge_changes_requirements, SharedChanges
+from lookout.core.tests.test_bytes_to_unicode_converter import create_small_uast
+
+
+class FakeChangesStub:
+    def __init__(self, changes):
+        self.changes = changes
+        self.requests = []
+
+    def GetChanges(self, request):  # noqa: N802
+        self.requests.append(request)
+        return iter(self.changes)
+
+
+class FakeDataService:
+    prefetch_bytes = 0
+    stream_retries = 0
+    stream_retry_backoff = 1
+    measure_stream_bytes = False
+
+    def __init__(self, changes):
+        self.stub = FakeChangesStub(changes)
+        self.released = 0
+
+    def get_data(self):
+        return self.stub
+
+    def reconnect_data(self):
+        return self.stub
+
+    def release_channel(self):
+        self.released += 1
+
+
+class SharedChangesTests(unittest.TestCase):
+    def setUp(self):
+        content, uast = create_small_uast()
+        self.changes = []
+        for i in range(10):
+            language = "JavaScript" if i % 2 else "Python"
+            head = File(path="%d.js" % i, content=content * (i + 1), uast=uast,
+                        language=language)
+            base = File(path="%d.js" % i, content=content, uast=uast, language=language) \
+                if i < 5 else File()
+            self.changes.append(Change(base=base, head=head))
+
+    def test_spill(self):
+        shared = SharedChanges(max_memory=sum(c.ByteSize() for c in self.changes[:3]))
+        try:
+            for change in self.changes:
+                shared.append(change)
+            self.assertTrue(shared.spilled)
+            self.assertEqual(len(shared), 10)
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                results = list(executor.map(lambda _: list(shared), range(8)))
+            for result in results:
+                self.assertEqual(result, self.changes)
+            copies = list(shared)
+            copies[0].head.content = b""
+            self.assertEqual(list(shared), self.changes)
+        finally:
+            shared.close()
+        self.assertFalse(shared.spilled)
+        self.assertEqual(list(shared), [])
+
+    def test_no_spill(self):
+        shared = SharedChanges()
+        for change in self.changes:
+            shared.append(change)
+        self.assertFalse(shared.spilled)
+        self.assertEqual(list(shared), self.changes)
+
+    def test_close_while_iterating(self):
+        for max_memory in (1 << 20, 0):
+            shared = SharedChanges(max_memory=max_memory)
+            for change in self.changes:
+                shared.append(change)
+            changes = iter(shared)
+            self.assertEqual(next(changes), self.changes[0])
+            shared.close()
+            if shared.max_memory:
+                self.assertEqual(list(changes), self.changes[1:])
+            else:
+                with self.assertRaises(ValueError):
+                    next(changes)
+
+    def test_view(self):
+        shared = SharedChanges(max_memory=0)
+        for change in self.changes:
+            shared.append(change)
+        changes = list(shared.view(contents=False, uast=True, unicode=False))
+        self.assertEqual(len(changes), 10)
+        for change in changes:
+            self.assertFalse(change.head.content)
+            self.assertTrue(change.head.HasField("uast"))
+        changes = list(shared.view(contents=True, uast=False, unicode=False,
+                                   languages=("python",)))
+        self.assertEqual([c.head.path for c in changes], ["0.js", "2.js", "4.js", "6.js",
+                                                          "8.js"])
+        for change in changes:
+            self.assertTrue(change.head.content)
+            self.assertFalse(change.head.HasField("uast"))
+        changes = list(shared.view(contents=True, uast=True, unicode=False,
+                                   include_pattern=r"^[0-3]\.", max_file_size=3 * 7))
+        self.assertEqual([c.head.path for c in changes], ["0.js", "1.js", "2.js"])
+        changes = list(shared.view(contents=False, uast=True, unicode=False,
+                                   max_file_size=7))
+        self.assertEqual(len(changes), 10)
+        changes = list(shared.view(contents=True, uast=True, unicode=True))
+        self.assertIsInstance(changes[0].head, UnicodeFile)
+        self.assertEqual(changes[0].head.content, "bè = a")
+        self.assertIs(changes[0].base, changes[0].head)
+        changes = list(shared.view(contents=True, uast=True, unicode=False,
+                                   skip_identical=True))
+        self.assertEqual(len(changes), 9)
+
+    def test_fetch(self):
+        data_service = FakeDataService(self.changes)
+        ptr_from = ReferencePointer("repo", "ref", "1" * 40)
+        ptr_to = ReferencePointer("repo", "ref", "2" * 40)
+        shared = SharedChanges.fetch(data_service, ptr_from, ptr_to, contents=True,
+                                     uast=False, languages=("python",),
+                                     include_pattern=r"\.js$")
+        try:
+            self.assertEqual(list(shared),
+                             [c for c in self.changes if c.head.language == "Python"])
+        finally:
+            shared.close()
+        self.assertEqual(data_service.released, 1)
+        request, = data_service.stub.requests
+        self.assertTrue(request.want_contents)
+        self.assertFalse(request.want_uast)
+        self.assertEqual(list(request.include_languages), ["python"])
+        self.assertEqual(request.include_pattern, r"\.js$")
+
+    def test_merge_changes_requirements(self):
+        def filters(languages=(), include_pattern=None):
+            return {"languages": languages, "include_pattern": include_pattern,
+                    "max_file_size": 0}
+
+        merged = merge_changes_requirements([
+            (ChangesRequirements(contents=False, uast=True), filters(("Python",), r"\.py$")),
+            (ChangesRequirements(contents=True, uast=False), filters(("go",), r"\.go$")),
+        ])
+        self.assertEqual(merged, {"contents": True, "uast": True,
+                                  "languages": ("go", "python"),
+                                  "include_pattern": r"(?:\.py$)|(?:\.go$)"})
+        merged = merge_changes_requirements([
+            (ChangesRequirements(contents=False, uast=True), filters(("Python",), r"\.py$")),
+            (ChangesRequirements(contents=False, uast=True), filters((), r"\.py$")),
+        ])
+        self.assertEqual(merged, {"contents": False, "uast": True, "languages": (),
+                                  "include_pattern": r"\.py$"})
+        merged = merge_changes_requirements([
+            (ChangesRequirements(contents=False, uast=True), filters(("Python",), r"\.py$")),
+            (ChangesRequirements(contents=False, uast=False), filters(("Python",))),
+        ])
+        self.assertEqual(merged, {"contents": False, "uast": True, "languages": ("python",),
+                                  "include_pattern": None})
+
+
+if __name__ == "__main__":
+    unittest.main()
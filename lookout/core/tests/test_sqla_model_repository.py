@@ -0,0 +1,61 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from lookout.core.sqla_model_repository import SQLAlchemyModelRepository
+
+
+class TrainingLockTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory(prefix="lookout-models-")
+        self.repo = SQLAlchemyModelRepository(
+            "sqlite:///" + os.path.join(self.tmpdir.name, "models.sqlite"), self.tmpdir.name,
+            max_cache_mem=1 << 20, ttl=60, training_lock_ttl=1, training_lock_poll=0.01)
+
+    def tearDown(self):
+        self.repo.shutdown()
+        self.tmpdir.cleanup()
+
+    def test_wait(self):
+        results = []
+
+        def train():
+            with self.repo.training_lock("analyzer/1", "repo") as waited:
+                results.append(waited)
+
+        with self.repo.training_lock("analyzer/1", "repo") as waited:
+            self.assertFalse(waited)
+            thread = threading.Thread(target=train)
+            thread.start()
+            time.sleep(0.1)
+            self.assertEqual(results, [])
+            with self.repo.training_lock("analyzer/1", "other repo") as waited:
+                self.assertFalse(waited)
+        thread.join()
+        self.assertEqual(results, [True])
+        with self.repo.training_lock("analyzer/1", "repo") as waited:
+            self.assertFalse(waited)
+
+    def test_expired(self):
+        self.assertTrue(self.repo._acquire_training_lock("analyzer/1", "repo", "crashed"))
+        self.assertFalse(self.repo._acquire_training_lock("analyzer/1", "repo", "other"))
+        time.sleep(1.1)
+        self.assertTrue(self.repo._acquire_training_lock("analyzer/1", "repo", "other"))
+
+    def test_disabled(self):
+        repo = SQLAlchemyModelRepository(
+            "sqlite:///" + os.path.join(self.tmpdir.name, "models.sqlite"), self.tmpdir.name,
+            max_cache_mem=1 << 20, ttl=60)
+        try:
+            with repo.training_lock("analyzer/1", "repo") as waited:
+                with repo.training_lock("analyzer/1", "repo") as waited_again:
+                    self.assertFalse(waited)
+                    self.assertFalse(waited_again)
+        finally:
+            repo.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+
+import bblfsh
+
+from lookout.core.uast import iter_bfs, iter_positions, iter_preorder
+
+
+def create_tree() -> bblfsh.Node:
+    """
+    Build the tree with the node tokens equal to their pre-order indexes.
+
+        0
+        ├── 1
+        │   ├── 2
+        │   └── 3
+        └── 4
+            └── 5
+    """
+    def node(index: int, *children: bblfsh.Node) -> bblfsh.Node:
+        result = bblfsh.Node(token=str(index),
+                             start_position=bblfsh.Position(offset=index, line=1, col=index + 1),
+                             end_position=bblfsh.Position(offset=index + 1, line=1,
+                                                          col=index + 2))
+        result.children.extend(children)
+        return result
+
+    return node(0, node(1, node(2), node(3)), node(4, node(5)))
+
+
+class UASTTests(unittest.TestCase):
+    def test_iter_preorder(self):
+        tokens = [node.token for node in iter_preorder(create_tree())]
+        self.assertEqual(tokens, ["0", "1", "2", "3", "4", "5"])
+
+    def test_iter_preorder_prune(self):
+        tokens = [node.token for node in iter_preorder(create_tree(),
+                                                       prune=lambda node: node.token == "1")]
+        self.assertEqual(tokens, ["0", "1", "4", "5"])
+
+    def test_iter_bfs(self):
+        tokens = [node.token for node in iter_bfs(create_tree())]
+        self.assertEqual(tokens, ["0", "1", "4", "2", "3", "5"])
+
+    def test_iter_bfs_prune(self):
+        tokens = [node.token for node in iter_bfs(create_tree(),
+                                                  prune=lambda node: node.token == "4")]
+        self.assertEqual(tokens, ["0", "1", "4", "2", "3"])
+
+    def test_iter_single(self):
+        root = bblfsh.Node(token="x")
+        self.assertEqual(list(iter_preorder(root)), [root])
+        self.assertEqual(list(iter_bfs(root)), [root])
+        self.assertEqual(list(iter_positions(root)), [])
+
+    def test_iter_positions(self):
+        root = create_tree()
+        root.children[1].end_position.Clear()
+        offsets = sorted(position.offset for position in iter_positions(root))
+        self.assertEqual(offsets, [0, 1, 1, 2, 2, 3, 3, 4, 4, 5, 6])
+        for position in iter_positions(root):
+            position.offset += 10
+        self.assertEqual(root.children[0].children[1].start_position.offset, 13)
+        self.assertEqual(root.children[1].end_position.offset, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+"""Linear time UAST traversal utilities."""
+from collections import deque
+from typing import Callable, Iterator, Optional
+
+from bblfsh import Node, Position
+
+
+def iter_preorder(root: Node, prune: Optional[Callable[[Node], bool]] = None) -> Iterator[Node]:
+    """
+    Iterate over the UAST nodes in depth-first pre-order: parents before children, children \
+    in their natural order.
+
+    :param root: UAST root node.
+    :param prune: Optional callback which decides whether to skip the children of the node. \
+                  The node itself is yielded anyway.
+    :return: Iterator over the nodes.
+    """
+    stack = [root]
+    pop, extend = stack.pop, stack.extend
+    while stack:
+        node = pop()
+        yield node
+        if prune is not None and prune(node):
+            continue
+        children = node.children
+        if children:
+            extend(reversed(children))
+
+
+def iter_bfs(root: Node, prune: Optional[Callable[[Node], bool]] = None) -> Iterator[Node]:
+    """
+    Iterate over the UAST nodes in breadth-first order.
+
+    :param root: UAST root node.
+    :param prune: Optional callback which decides whether to skip the children of the node. \
+                  The node itself is yielded anyway.
+    :return: Iterator over the nodes.
+    """
+    queue = deque((root,))
+    popleft, extend = queue.popleft, queue.extend
+    while queue:
+        node = popleft()
+        yield node
+        if prune is not None and prune(node):
+            continue
+        extend(node.children)
+
+
+def iter_positions(root: Node) -> Iterator[Position]:
+    """
+    Iterate over the start and the end positions of all the UAST nodes.
+
+    Empty positions - those which have zero offset, line and column - are skipped. The order \
+    of the positions is unspecified.
+
+    :param root: UAST root node.
+    :return: Iterator over the positions. They can be modified in place.
+    """
+    stack = [root]
+    pop, extend = stack.pop, stack.extend
+    while stack:
+        node = pop()
+        extend(node.children)
+        position = node.start_position
+        if position.offset or position.line or position.col:
+            yield position
+        position = node.end_position
+        if position.offset or position.line or position.col:
+            yield position
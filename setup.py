@@ -46,6 +46,7 @@ setup(
         "packaging>=16.8,<20.0",
         "typing;python_version<'3.5'",
         "prometheus_client == 0.6.0",
+        "grpcio>=1.32.0,<2.0;python_version>='3.6'",
     ],
     python_requires=">=3.5",
     extras_require={